@@ -143,7 +143,6 @@ if __name__ == '__main__':
         ### EXAMPLE ANALYSIS ###
         ########################
         p2p_values=[]
-        trigger=[]    
             
         # loop over existing single antenna files as raw output from simulations
         for ant in tqdm.tqdm(glob.glob(path+ending_e)):
@@ -215,13 +214,10 @@ if __name__ == '__main__':
                 try:
                     ### add some info on P2P and  TRIGGER if wanted: trigger on any component, or x-y combined
                     #NOTE: need to cross-check that trace is also in muV, but should be by definition
-                    from radio_simus.signal_treatment import p2p, _trigger
+                    from radio_simus.signal_treatment import p2p
                     
                     # peak-to-peak values: x, y, z, xy-, all-combined
                     p2p_values.append(p2p(voltage))
-
-                    # trigger info: trigger = [thr_aggr, any_aggr, xz_aggr, thr_cons, any_cons, xy_cons]
-                    trigger.append( (_trigger(p2p(voltage), 'any', threshold_aggr/(u.u*u.V)), _trigger(p2p(voltage), 'xy', threshold_aggr/(u.u*u.V)),  _trigger(p2p(voltage), 'any', threshold_cons/(u.u*u.V)), _trigger(p2p(voltage), 'xy', threshold_cons/(u.u*u.V))) )
         
                 except: 
                     print("====== ATTENTION: ValueError raised for a"+str(ant_number) + " --- no first analysis performed =======")
@@ -229,20 +225,22 @@ if __name__ == '__main__':
         
         
         ## Quit loop 
-        p2p_values = np.array(p2p_values)
-        trigger = np.array(trigger)
+        # trigger info of all antennas at once: any/xy for [thr_aggr, thr_cons]
+        from radio_simus.signal_treatment import trigger_batch, P2P_FIELDS
+        p2p_values = np.array(p2p_values).reshape(-1, len(P2P_FIELDS)) # (0, 5) if no antenna was processed
+        trigger = trigger_batch(p2p_values, [threshold_aggr/(u.u*u.V), threshold_cons/(u.u*u.V)], modes=('any', 'xy'))
             
         a2 = Column(data=np.array(ID_ant), name='ant_ID')
                         
-        b2 = Column(data=p2p_values.T[1], unit=u.u*u.V, name='p2p_x')  
+        b2 = Column(data=p2p_values.T[0], unit=u.u*u.V, name='p2p_x')  
         c2 = Column(data=p2p_values.T[1], unit=u.u*u.V, name='p2p_y') 
-        d2 = Column(data=p2p_values.T[1], unit=u.u*u.V, name='p2p_z') 
-        e2 = Column(data=p2p_values.T[1], unit=u.u*u.V, name='p2p_xy') 
+        d2 = Column(data=p2p_values.T[2], unit=u.u*u.V, name='p2p_z') 
+        e2 = Column(data=p2p_values.T[3], unit=u.u*u.V, name='p2p_xy') 
                         
-        f2 = Column(data=trigger.T[0],  name='trigger_aggr_any')
-        g2 = Column(data=trigger.T[1],  name='trigger_aggr_xy')
-        h2 = Column(data=trigger.T[2],  name='trigger_cons_any')  
-        i2 = Column(data=trigger.T[3],  name='trigger_cons_xy')
+        f2 = Column(data=trigger['any'][:, 0].astype(int),  name='trigger_aggr_any')
+        g2 = Column(data=trigger['xy'][:, 0].astype(int),  name='trigger_aggr_xy')
+        h2 = Column(data=trigger['any'][:, 1].astype(int),  name='trigger_cons_any')  
+        i2 = Column(data=trigger['xy'][:, 1].astype(int),  name='trigger_cons_xy')
                         
         thres_info = {"threshold_aggr": threshold_aggr, "threshold_cons": threshold_cons }
         analysis_info = Table(data=(a2,b2,c2,d2,e2,f2,g2,h2,i2,), meta=thres_info) 
@@ -87,6 +87,8 @@ def load_config(path):
             config.Vrms2=float(line.split('  ',-1)[1])*u.u*u.V # muV  ->astropy.units
         if 'TSAMPLING' in line:
             config.tsampling=float(line.split('  ',-1)[1])*u.ns # ns  ->astropy.units
+        if 'NOISESPECTRUM' in line: # text file: frequency in MHz, amplitude spectral density
+            config.noisespectrum=str(line.split('  ',-1)[1])
 
         if 'ANTX' in line:
             config.antx=str(line.split('  ',-1)[1])
@@ -94,3 +96,10 @@ def load_config(path):
             config.anty=str(line.split('  ',-1)[1])
         if 'ANTZ' in line:
             config.antz=str(line.split('  ',-1)[1])
+        if 'ANTCACHE' in line: # folder for converted antenna response files
+            config.antcache=str(line.split('  ',-1)[1])
+        if 'ANTMODEL' in line: # ANTMODEL  type  fileX  fileY  fileZ, further antenna models
+            tmp = list(line.split('  ',-1))
+            if config.antmodels is None:
+                config.antmodels = {}
+            config.antmodels[str(tmp[1])] = (str(tmp[2]), str(tmp[3]), str(tmp[4]))
@@ -0,0 +1,514 @@
+'''
+    Lazy, memory-mapped storage of the antenna response (leff) tables
+
+    The legacy antenna files (see ANTX/ANTY/ANTZ in the config file) are numpy
+    files holding 9 arrays of shape (nfreq, ndirections):
+        freq, realimp, reactance, theta, phi, lefftheta, leffphi, phasetheta, phasephi
+    Loading them with np.load costs several seconds per arm. They are converted
+    once into a directory of plain .npy files which are then opened memory-mapped
+    on first use, so that the import is cheap and forked workers share the pages.
+
+    At conversion the tables are re-indexed onto a dense regular grid
+    (frequency x zenith x azimuth), so that looking up a direction is plain array
+    slicing for all frequencies at once.
+'''
+
+import os
+from os.path import join, splitext, split, isdir, getmtime
+import json
+import shutil
+import tempfile
+from collections import OrderedDict
+import numpy as np
+
+import logging
+logger = logging.getLogger("AntennaResponse")
+
+
+__all__ = ["AntennaResponse", "TransferCache", "convert_antenna_file", "fold_azimuth", "round_azimuth"]
+
+
+## names of the arrays in the legacy antenna files, in stored order
+LEGACY_ARRAYS = ("freq", "realimp", "reactance", "theta", "phi",
+                 "lefftheta", "leffphi", "phasetheta", "phasephi")
+## names of the arrays in the converted store
+##  freq: (nfreq) in MHz, zenith, azimuth: grid axes in deg,
+##  resistance, reactance: (nfreq) antenna impedance in Ohm,
+##  leff_*: (nfreq, nzen, naz) effective length in m, phase_*: (nfreq, nzen, naz) in rad
+STORE_ARRAYS = ("freq", "zenith", "azimuth", "resistance", "reactance",
+                "leff_theta", "phase_theta", "leff_phi", "phase_phi")
+## version of the converted on-disk format, bump if the layout changes
+STORE_VERSION = 2
+
+
+#===========================================================================================================
+def _store_path(path, cache_dir=None):
+#===========================================================================================================
+    ''' Path of the converted store belonging to a legacy antenna file
+
+    Arguments:
+    ----------
+    path: str
+        path to legacy antenna file (.npy)
+    cache_dir: str
+        optional, folder for the converted store, default: next to the legacy file
+
+    Returns:
+    --------
+    str
+        path to folder of converted store
+    '''
+    folder, name = split(os.path.abspath(path))
+    if cache_dir is not None:
+        folder = cache_dir
+    return join(folder, splitext(name)[0] + ".response")
+
+
+#===========================================================================================================
+def _is_valid_store(store, path):
+#===========================================================================================================
+    ''' Checks whether a converted store exists, has the right version and is not older than the source
+    '''
+    try:
+        with open(join(store, "meta.json"), "r") as f:
+            meta = json.load(f)
+    except (IOError, ValueError):
+        return False
+    if meta.get("version") != STORE_VERSION:
+        return False
+    if os.path.exists(path) and meta.get("mtime", 0) < getmtime(path):
+        return False
+    return True
+
+
+#===========================================================================================================
+def _to_dense(tables):
+#===========================================================================================================
+    ''' Re-indexes the legacy (nfreq, ndirections) tables onto a dense (nfreq, nzen, naz) grid
+
+    Arguments:
+    ----------
+    tables: dict
+        legacy arrays, see LEGACY_ARRAYS
+
+    Returns:
+    --------
+    dict
+        dense arrays, see STORE_ARRAYS
+
+    Raises:
+    --------
+    ValueError:
+        duplicated directions or directions missing from the grid
+
+    Note: the impedance does not depend on the direction, only the first direction is kept
+    '''
+    theta = np.asarray(tables["theta"], dtype=float)
+    phi = np.asarray(tables["phi"], dtype=float)
+    zenith = np.unique(theta)
+    azimuth = np.unique(phi)
+    nfreq = theta.shape[0]
+    # rows may list the directions in different order, map every entry to its grid cell
+    izen = np.searchsorted(zenith, theta)
+    iaz = np.searchsorted(azimuth, phi)
+    ifreq = np.arange(nfreq)[:, None]
+    ncells = np.unique(izen*len(azimuth) + iaz + ifreq*len(zenith)*len(azimuth)).size
+    if ncells != theta.size:
+        raise ValueError("Antenna file contains duplicated directions")
+    if ncells != nfreq*len(zenith)*len(azimuth):
+        raise ValueError("Antenna file does not cover the full (frequency, zenith, azimuth) grid")
+
+    dense = {"freq": np.asarray(tables["freq"], dtype=float)[:, 0],
+             "zenith": zenith,
+             "azimuth": azimuth,
+             "resistance": np.asarray(tables["realimp"], dtype=float)[:, 0],
+             "reactance": np.asarray(tables["reactance"], dtype=float)[:, 0]}
+    for name, legacy, to_rad in (("leff_theta", "lefftheta", False), ("phase_theta", "phasetheta", True),
+                                 ("leff_phi", "leffphi", False), ("phase_phi", "phasephi", True)):
+        table = np.zeros((nfreq, len(zenith), len(azimuth)))
+        values = np.asarray(tables[legacy], dtype=float)
+        table[ifreq, izen, iaz] = np.deg2rad(values) if to_rad else values
+        dense[name] = table
+    return dense
+
+
+#===========================================================================================================
+def round_azimuth(azim, azstep=5):
+#===========================================================================================================
+    ''' Rounds azimuth angles to the table step and folds them into [0, 90] deg
+
+    The antenna tables only cover one quadrant, the other ones follow by symmetry.
+
+    Arguments:
+    ----------
+    azim: float or numpy array
+        azimuth in antenna frame in deg, in [0, 360]
+    azstep: float
+        step in azimuth of the antenna table in deg
+
+    Returns:
+    --------
+    float or numpy array
+        rounded azimuth in deg, in [0, 90]
+    '''
+    azim = np.asarray(azim, dtype=float)
+    if azstep == 5:
+        roundazimuth = np.round(azim/10)*10 + np.round((azim - 10*np.round(azim/10))/5)*5
+    else:
+        roundazimuth = np.round(azim/azstep)*azstep
+    roundazimuth = np.where((roundazimuth >= 91) & (roundazimuth <= 180), 180 - roundazimuth, roundazimuth)
+    roundazimuth = np.where((roundazimuth >= 181) & (roundazimuth <= 270), roundazimuth - 180, roundazimuth)
+    roundazimuth = np.where((roundazimuth >= 271) & (roundazimuth <= 360), 360 - roundazimuth, roundazimuth)
+    return roundazimuth[()]
+
+
+#===========================================================================================================
+def fold_azimuth(azim):
+#===========================================================================================================
+    ''' Folds azimuth angles into [0, 90] deg without rounding, continuous version of round_azimuth
+
+    Arguments:
+    ----------
+    azim: float or numpy array
+        azimuth in antenna frame in deg
+
+    Returns:
+    --------
+    float or numpy array
+        folded azimuth in deg, in [0, 90]
+    '''
+    folded = np.mod(np.asarray(azim, dtype=float), 180.)
+    return np.where(folded > 90., 180. - folded, folded)[()]
+
+
+#===========================================================================================================
+def convert_antenna_file(path, cache_dir=None):
+#===========================================================================================================
+    ''' Converts a legacy antenna file into the memory-mappable store (done once)
+
+    Arguments:
+    ----------
+    path: str
+        path to legacy antenna file (.npy)
+    cache_dir: str
+        optional, folder for the converted store, default: next to the legacy file
+
+    Returns:
+    --------
+    str
+        path to folder of converted store
+
+    Note: the store is written to a temporary folder first and moved in place, an existing store
+          is moved aside before and deleted after, so that concurrent workers never see a
+          half-written or half-deleted store
+    '''
+    store = _store_path(path, cache_dir)
+    logger.info("Converting antenna file " + str(path) + " to " + store)
+    tables = np.load(path, allow_pickle=True) ### slow, done only once
+    if len(tables) != len(LEGACY_ARRAYS):
+        raise ValueError("Antenna file " + str(path) + " does not contain the "
+                         + str(len(LEGACY_ARRAYS)) + " legacy arrays")
+
+    dense = _to_dense(dict(zip(LEGACY_ARRAYS, tables)))
+
+    parent = split(store)[0]
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=".tmp", dir=parent)
+    old = None
+    try:
+        for name in STORE_ARRAYS:
+            np.save(join(tmp, name + ".npy"), np.ascontiguousarray(dense[name]))
+        with open(join(tmp, "meta.json"), "w") as f:
+            json.dump({"version": STORE_VERSION, "source": os.path.abspath(path),
+                       "mtime": getmtime(path)}, f)
+        if isdir(store):
+            # moved aside in one step, readers never see a half deleted store
+            old = tempfile.mkdtemp(prefix=".old", dir=parent)
+            os.replace(store, old)
+        os.replace(tmp, store)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        if not _is_valid_store(store, path): # another process may have won the race
+            raise
+    finally:
+        if old is not None:
+            shutil.rmtree(old, ignore_errors=True)
+    return store
+
+
+#===========================================================================================================
+class AntennaResponse:
+#===========================================================================================================
+    ''' Antenna response tables of one antenna arm
+
+        Nothing is read at construction. On first access of a table the legacy file
+        is converted (if not done yet) and all tables are opened memory-mapped, read-only.
+
+        Usage:
+            resp = AntennaResponse(radio_simus.config.antx)
+            leff_theta, phase_theta, leff_phi, phase_phi = resp.direction(zen, azim)
+            leff_theta, phase_theta, leff_phi, phase_phi = resp.direction(zens, azims, interpolation="bilinear")
+
+    Arguments:
+    ----------
+    path: str
+        path to legacy antenna file (.npy)
+    cache_dir: str
+        optional, folder for the converted store, default: next to the legacy file
+    '''
+
+    def __init__(self, path, cache_dir=None):
+        self.path = path
+        self.cache_dir = cache_dir
+        self._tables = None
+        self._version = None
+
+    def __repr__(self):
+        state = "open" if self._tables is not None else "closed"
+        return f"{self.__class__.__name__}({self.path!r}, {state})"
+
+    def __getstate__(self):
+        # never pickle the mapped tables, workers re-open the store themselves
+        state = self.__dict__.copy()
+        state["_tables"] = None
+        state["_version"] = None
+        return state
+
+    def __getattr__(self, name):
+        # only called if attribute not found the normal way
+        if name in STORE_ARRAYS:
+            return self.tables[name]
+        raise AttributeError(name)
+
+    @property
+    def store(self):
+        """path to the converted store"""
+        return _store_path(self.path, self.cache_dir)
+
+    @property
+    def version(self):
+        """identifies the mapped tables: path of the store, time of the legacy file and of the conversion,
+        changes when the legacy file is converted again (e.g. keys of the transfer function cache)"""
+        if self._tables is None:
+            self.open()
+        return self._version
+
+    @property
+    def tables(self):
+        """dict of memory-mapped tables, opened on first access"""
+        if self._tables is None:
+            self.open()
+        return self._tables
+
+    def open(self):
+        ''' Converts the legacy file if needed and maps the tables into memory
+        '''
+        if self.path is None:
+            raise ValueError("No antenna file given, check ANTX/ANTY/ANTZ in config file")
+        store = self.store
+        if not _is_valid_store(store, self.path):
+            store = convert_antenna_file(self.path, self.cache_dir)
+        logger.debug("Mapping antenna response from " + store)
+        with open(join(store, "meta.json"), "r") as f:
+            meta = json.load(f)
+        self._version = (store, meta.get("mtime"), os.stat(join(store, "meta.json")).st_mtime_ns)
+        self._tables = {name: np.load(join(store, name + ".npy"), mmap_mode="r")
+                        for name in STORE_ARRAYS}
+        return self
+
+    @property
+    def azstep(self):
+        """step of the azimuth grid in deg"""
+        return self.azimuth[1] - self.azimuth[0]
+
+    def zenith_index(self, zen):
+        ''' Lower grid index and linear weight of the upper node for zenith angles
+
+        Arguments:
+        ----------
+        zen: float or numpy array
+            zenith in antenna frame in deg
+
+        Returns:
+        --------
+        izen: int or numpy array
+            index of the grid node below zen
+        weight: float or numpy array
+            weight of node izen+1 for linear interpolation
+        '''
+        zenith = self.zenith
+        zen = np.asarray(zen, dtype=float)
+        izen = np.clip(np.searchsorted(zenith, zen, side="right") - 1, 0, len(zenith) - 2)
+        weight = (zen - zenith[izen]) / (zenith[izen + 1] - zenith[izen])
+        return izen[()], weight[()]
+
+    def azimuth_index(self, azim):
+        ''' Grid index of azimuth angles, rounded to the table step and folded into the table quadrant
+
+        Arguments:
+        ----------
+        azim: float or numpy array
+            azimuth in antenna frame in deg
+
+        Returns:
+        --------
+        int or numpy array
+            index in azimuth grid
+
+        Raises:
+        -------
+        ValueError:
+            rounded azimuth not in table
+        '''
+        azimuth = self.azimuth
+        roundazimuth = np.asarray(round_azimuth(azim, self.azstep))
+        iaz = np.clip(np.searchsorted(azimuth, roundazimuth), 0, len(azimuth) - 1)
+        if np.any(azimuth[iaz] != roundazimuth):
+            raise ValueError("Azimuth not in antenna table: " + str(roundazimuth))
+        return iaz[()]
+
+    def azimuth_weight(self, azim):
+        ''' Lower grid index and linear weight of the upper node for azimuth angles
+
+        The azimuth is folded into the table quadrant first, without rounding.
+
+        Arguments:
+        ----------
+        azim: float or numpy array
+            azimuth in antenna frame in deg
+
+        Returns:
+        --------
+        iaz: int or numpy array
+            index of the grid node below the folded azimuth
+        weight: float or numpy array
+            weight of node iaz+1 for linear interpolation
+        '''
+        azimuth = self.azimuth
+        folded = np.asarray(fold_azimuth(azim))
+        iaz = np.clip(np.searchsorted(azimuth, folded, side="right") - 1, 0, len(azimuth) - 2)
+        weight = np.clip((folded - azimuth[iaz]) / (azimuth[iaz + 1] - azimuth[iaz]), 0., 1.)
+        return iaz[()], weight[()]
+
+    def direction(self, zen, azim, interpolation="nearest"):
+        ''' Response for all frequencies in given direction(s)
+
+        Vectorized over directions. The zenith is always interpolated linearly between grid nodes,
+        the azimuth either rounded to the nearest table azimuth (legacy) or interpolated linearly
+        as well (bilinear in zenith and azimuth).
+
+        Arguments:
+        ----------
+        zen: float or numpy array
+            zenith in antenna frame in deg
+        azim: float or numpy array
+            azimuth in antenna frame in deg
+        interpolation: str
+            "nearest" (default) or "bilinear"
+
+        Returns:
+        --------
+        leff_theta, phase_theta, leff_phi, phase_phi: numpy arrays
+            (nfreq) or (nfreq, ndirections), leff in m, phase in rad
+        '''
+        izen, wzen = self.zenith_index(zen)
+        if interpolation == "nearest":
+            iaz = self.azimuth_index(azim)
+        elif interpolation == "bilinear":
+            iaz, waz = self.azimuth_weight(azim)
+        else:
+            raise ValueError("Unknown interpolation " + str(interpolation))
+        res = []
+        for name in ("leff_theta", "phase_theta", "leff_phi", "phase_phi"):
+            table = self.tables[name]
+            low = table[:, izen, iaz]
+            value = low + wzen*(table[:, izen + 1, iaz] - low)
+            if interpolation == "bilinear":
+                low = table[:, izen, iaz + 1]
+                value = value + waz*(low + wzen*(table[:, izen + 1, iaz + 1] - low) - value)
+            res.append(value)
+        return tuple(res)
+
+    def close(self):
+        ''' Drops the memory maps, they are re-opened on next access
+        '''
+        self._tables = None
+
+
+#===========================================================================================================
+class TransferCache:
+#===========================================================================================================
+    ''' Least-recently-used cache of transfer functions, bounded by the memory used
+
+        Antennas seeing the shower in the same direction, with the same trace length and sampling,
+        share the same transfer function. The cached arrays are read-only.
+
+        Usage:
+            cache = TransferCache(maxbytes=2**28)
+            H = cache.get(key)
+            if H is None:
+                H = cache.put(key, compute(...))
+            print(cache.stats())
+
+    Arguments:
+    ----------
+    maxbytes: int
+        maximal memory of the cached arrays in bytes, least recently used entries are evicted first
+    '''
+
+    def __init__(self, maxbytes=2**28):
+        self.maxbytes = maxbytes
+        self._data = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.stats()})"
+
+    def get(self, key):
+        ''' Cached array for key, None if not cached
+        '''
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        ''' Adds an array to the cache and returns it read-only
+        '''
+        value = np.array(value)
+        value.setflags(write=False)
+        if key in self._data:
+            self.nbytes -= self._data.pop(key).nbytes
+        self._data[key] = value
+        self.nbytes += value.nbytes
+        while self.nbytes > self.maxbytes and self._data:
+            _, old = self._data.popitem(last=False)
+            self.nbytes -= old.nbytes
+            self.evictions += 1
+        return value
+
+    def clear(self):
+        ''' Drops all entries and resets the counters
+        '''
+        self._data.clear()
+        self.nbytes = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        ''' Counters of the cache as dict: entries, nbytes, hits, misses, evictions
+        '''
+        return {"entries": len(self._data), "nbytes": self.nbytes, "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions}
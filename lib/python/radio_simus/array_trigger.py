@@ -0,0 +1,161 @@
+'''
+    array level trigger: coincidences of triggered antennas in space and time
+
+    An event triggers the array if one triggered antenna sees at least `multiplicity` triggered antennas
+    (itself included) within `radius` in space and within `window` of its own peak time.
+
+    The neighbourhood graph is built once per detector with a KD-tree (scipy.spatial.cKDTree) and stored
+    as a sparse adjacency matrix. Events are handled as lists of hits (event, antenna, peak time): the work
+    grows with the number of hits times the number of neighbours, not with the number of antenna pairs.
+
+    Usage:
+        trig = ArrayTrigger.from_detector(det, radius=1500., multiplicity=5)
+        flags = trigger_batch(p2p_batch(voltage), thrs)['any']            # signal_treatment
+        times, _ = hilbert_peak_batch(time, voltage)
+        triggered = trig.evaluate(flags[None], times.min(axis=1)[None])   # (events, antennas)
+'''
+
+import numpy as np
+import astropy.units as u
+
+import logging
+logger = logging.getLogger("ArrayTrigger")
+
+from scipy import sparse
+from scipy.spatial import cKDTree
+
+__all__ = ["ArrayTrigger"]
+
+C_LIGHT = 0.299792458 # m/ns
+
+
+#===========================================================================================================
+class ArrayTrigger:
+#===========================================================================================================
+    ''' Coincidence trigger of an antenna array
+
+    Arguments:
+    ----------
+    positions: numpy array
+        (N, 3) antenna positions in m
+    radius: float
+        distance of neighbouring antennas in m
+    multiplicity: int
+        optional, number of triggered antennas needed in a neighbourhood, the central one included
+    window: float
+        optional, coincidence window in ns, default: light travel time over radius
+    '''
+
+    def __init__(self, positions, radius, multiplicity=3, window=None):
+        if hasattr(positions, "unit"):
+            positions = positions.to(u.m).value
+        positions = np.asarray(positions, dtype=float)
+        self.nant = len(positions)
+        self.radius = float(radius)
+        self.multiplicity = int(multiplicity)
+        self.window = self.radius/C_LIGHT if window is None else float(window)
+        # symmetric adjacency, without self loops
+        pairs = cKDTree(positions).query_pairs(self.radius, output_type="ndarray")
+        rows = np.concatenate([pairs[:, 0], pairs[:, 1]])
+        cols = np.concatenate([pairs[:, 1], pairs[:, 0]])
+        self.adjacency = sparse.csr_matrix((np.ones(len(rows), dtype=bool), (rows, cols)),
+                                           shape=(self.nant, self.nant))
+        self.adjacency.sort_indices()
+        logger.debug("Neighbour graph of " + str(self.nant) + " antennas: " + str(len(pairs)) + " pairs")
+
+    @classmethod
+    def from_detector(cls, detector, radius, multiplicity=3, window=None):
+        ''' Trigger of a Detector, see ArrayTrigger (positions from Detector.position) '''
+        return cls(detector.position, radius, multiplicity, window)
+
+    def __repr__(self):
+        return "{}({} antennas, radius={}, multiplicity={}, window={})".format(
+            self.__class__.__name__, self.nant, self.radius, self.multiplicity, self.window)
+
+    def neighbours(self, antenna):
+        ''' indices of the neighbours of an antenna '''
+        return self.adjacency.indices[self.adjacency.indptr[antenna]:self.adjacency.indptr[antenna + 1]]
+
+    def count_hits(self, event, antenna, time):
+        ''' Number of coincident hits around each hit
+
+        Arguments:
+        ----------
+        event: numpy array
+            (H) event index of each hit (triggered antenna)
+        antenna: numpy array
+            (H) antenna index of each hit
+        time: numpy array
+            (H) peak time of each hit in ns
+
+        Returns:
+        --------
+        numpy array
+            (H) number of hits of the same event in the neighbourhood and window, the hit itself included
+        '''
+        event = np.asarray(event, dtype=np.int64)
+        antenna = np.asarray(antenna, dtype=np.int64)
+        time = np.asarray(time, dtype=float)
+        nhits = len(event)
+        # hits sorted by (event, antenna) to look up the neighbours of each hit
+        keys = event*self.nant + antenna
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+
+        # all (hit, neighbour antenna) combinations, from the CSR rows of the hit antennas
+        indptr = self.adjacency.indptr
+        start, degree = indptr[antenna], np.diff(indptr)[antenna]
+        hit = np.repeat(np.arange(nhits), degree)
+        offset = np.arange(len(hit)) - np.repeat(np.cumsum(degree) - degree, degree)
+        neighbour = self.adjacency.indices[np.repeat(start, degree) + offset]
+
+        wanted = event[hit]*self.nant + neighbour
+        pos = np.minimum(np.searchsorted(sorted_keys, wanted), max(nhits - 1, 0))
+        found = (sorted_keys[pos] == wanted) if nhits else np.zeros(0, dtype=bool)
+        other = order[pos[found]]
+        coincident = np.abs(time[other] - time[hit[found]]) <= self.window
+        return 1 + np.bincount(hit[found][coincident], minlength=nhits)
+
+    def evaluate_hits(self, event, antenna, time, nevents=None):
+        ''' Array trigger of events given as lists of hits, see count_hits
+
+        Arguments:
+        ----------
+        nevents: int
+            optional, number of events, default: largest event index + 1
+
+        Returns:
+        --------
+        numpy array
+            (nevents) True for triggered events
+        numpy array
+            (H) True for the hits with enough coincident neighbours
+        '''
+        event = np.asarray(event, dtype=np.int64)
+        nevents = (int(event.max()) + 1 if len(event) else 0) if nevents is None else nevents
+        central = self.count_hits(event, antenna, time) >= self.multiplicity
+        triggered = np.zeros(nevents, dtype=bool)
+        triggered[event[central]] = True
+        return triggered, central
+
+    def evaluate(self, flags, times):
+        ''' Array trigger of a batch of events
+
+        Arguments:
+        ----------
+        flags: numpy array
+            (E, N) antenna trigger flags (e.g. a field of signal_treatment.trigger_batch)
+        times: numpy array
+            (E, N) peak times in ns, only used for flagged antennas
+
+        Returns:
+        --------
+        numpy array
+            (E) True for triggered events
+        '''
+        flags = np.atleast_2d(flags)
+        if flags.shape[1] != self.nant:
+            raise ValueError("One trigger flag per antenna of the array needed")
+        event, antenna = np.nonzero(flags)
+        time = np.broadcast_to(np.atleast_2d(times), flags.shape)[event, antenna]
+        return self.evaluate_hits(event, antenna, time, len(flags))[0]
@@ -3,7 +3,6 @@
     --- several times modified
     
     TODO:
-        - problem with shape of A and B in computevoltage for time traces with odd number of lines
         - handle neutrinos and in general upward going showers
         - IMPORTANT: how to handle astropy units for electric field and voltage numpy arrays...
         
@@ -19,24 +18,28 @@ import os
 from os.path import  join
 import sys
 import math
+import functools
 import numpy as np
 
 import logging
 logger = logging.getLogger("ComuteVoltage")
 
-import pylab as plt
 import glob
+import multiprocessing
+from timeit import default_timer as timer
 
 from radio_simus.signal_processing import filters
 import radio_simus 
+from radio_simus.antenna_response import AntennaResponse, TransferCache, fold_azimuth
 #radio_simus.load_config('./test.config')
 antx = radio_simus.config.antx
 anty = radio_simus.config.anty
 antz = radio_simus.config.antz
 
 import linecache
-from scipy.fftpack import rfft, irfft, rfftfreq
-from scipy.interpolate import interp1d
+from scipy.fft import rfft, irfft, rfftfreq, next_fast_len
+from scipy import sparse
+from scipy.signal import oaconvolve
 #import astropy.units as u
 
 
@@ -45,8 +48,6 @@ DISPLAY = 0
 
 ## Earth radius in m
 EARTH_RADIUS=6370949. #m
-## step in azimuth in npy file in deg
-azstep=5 
 ## Multiplication factor: freq*2 if h/2 and sizeant/2
 freqscale=1 
 ##if antenna is loaded or not in npy file --- NOTE: Not needed
@@ -84,6 +85,7 @@ def compute_ZL(freq, DISPLAY = False, R = 300, C = 6.5e-12, L = 1e-6):
   RL = R*L*L*w2/deno  # Computed formula
   XL = R*R*L*w*(1-L*C*w2)/deno  # Computed formula
   if DISPLAY:
+    import pylab as plt
     plt.figure(1)
     plt.plot(freq/1e6,RL,label="R$_L$")
     plt.plot(freq/1e6,XL,label="X$_L$")
@@ -121,22 +123,193 @@ fileleff_x = antx
 fileleff_y = anty
 fileleff_z = antz
 
-if PRINT_ON:
-    print('Loading',fileleff_x,'...')  
-logger.debug("Loading antenna files " + fileleff_x +"....")
-freq1,realimp1,reactance1,theta1,phi1,lefftheta1,leffphi1,phasetheta1,phasephi1=np.load(fileleff_x) ### this line cost 6-7s
-RL1=interp1d(fr, RLp, bounds_error=False, fill_value=0.0)(freq1[:,0])
-XL1=interp1d(fr, XLp, bounds_error=False, fill_value=0.0)(freq1[:,0])
-freq2,realimp2,reactance2,theta2,phi2,lefftheta2,leffphi2,phasetheta2,phasephi2=np.load(fileleff_y) ### this line cost 6-7s
-RL2=interp1d(fr, RLp, bounds_error=False, fill_value=0.0)(freq2[:,0])
-XL2=interp1d(fr, XLp, bounds_error=False, fill_value=0.0)(freq2[:,0])
-freq3,realimp3,reactance3,theta3,phi3,lefftheta3,leffphi3,phasetheta3,phasephi3=np.load(fileleff_z) ### this line cost 6-7s
-RL3=interp1d(fr, RLp, bounds_error=False, fill_value=0.0)(freq3[:,0])
-XL3=interp1d(fr, XLp, bounds_error=False, fill_value=0.0)(freq3[:,0])
-if PRINT_ON:
-    print('Done.')
+# Antenna responses are opened lazily and memory-mapped on first use (see antenna_response.py),
+# the legacy np.load of the full tables cost 6-7s per arm at import
+responses = {"X": AntennaResponse(fileleff_x, cache_dir=radio_simus.config.antcache),
+             "Y": AntennaResponse(fileleff_y, cache_dir=radio_simus.config.antcache),
+             "Z": AntennaResponse(fileleff_z, cache_dir=radio_simus.config.antcache)}
 
+# Further antenna models by type (Detector.type), the default type uses the responses above.
+# The converted tables are memory mapped read-only: all processes share the same pages of the
+# page cache (ANTCACHE can point to /dev/shm to keep them in RAM)
+default_model = "HorizonAntenna"
+antenna_models = {}
 
+# Transfer functions per (arm, direction, nf, Fs), shared by all antennas seeing the shower in the same direction
+transfer_cache = TransferCache(maxbytes=2**28)
+## zenith resolution of the cache key in deg, None: exact zenith (results unchanged)
+## With the default the cache only hits for antennas with the same slope (flat arrays): on sloped
+## arrays set it (e.g. 0.1, the zenith is then rounded to it) so that antennas share the transfer functions.
+zenith_resolution = None
+## default number of threads for the FFTs, -1: all cores (set to 1 inside process pools)
+fft_workers = -1
+
+
+
+
+#============================================================================
+def register_antenna_model(name, fileleff_x, fileleff_y, fileleff_z, cache_dir=None):
+#============================================================================
+
+    '''adds an antenna model, used for the antennas of that type
+
+    Arguments:
+    ----------
+    name: str
+        antenna type, as in Detector.type
+    fileleff_x, fileleff_y, fileleff_z: str
+        antenna response files of the arms (legacy npy layout)
+    cache_dir: str
+        optional, folder of the converted files, default: config.antcache
+
+    Returns:
+    ----------
+    dict:
+        AntennaResponse per arm X, Y, Z
+    '''
+    cache_dir = radio_simus.config.antcache if cache_dir is None else cache_dir
+    antenna_models[name] = {"X": AntennaResponse(fileleff_x, cache_dir=cache_dir),
+                            "Y": AntennaResponse(fileleff_y, cache_dir=cache_dir),
+                            "Z": AntennaResponse(fileleff_z, cache_dir=cache_dir)}
+    return antenna_models[name]
+
+
+#============================================================================
+def get_antenna_model(name=None):
+#============================================================================
+
+    '''antenna responses of the arms X, Y, Z for an antenna type
+
+    Arguments:
+    ----------
+    name: str
+        antenna type, default (None or default_model): responses
+
+    Returns:
+    ----------
+    dict:
+        AntennaResponse per arm
+
+    Raises:
+    ----------
+    KeyError:
+        unknown antenna type
+    '''
+    if name is None or name == default_model:
+        return responses
+    try:
+        return antenna_models[name]
+    except KeyError:
+        raise KeyError('Unknown antenna type '+str(name)+', register it with register_antenna_model') from None
+
+
+if radio_simus.config.antmodels is not None:
+    for name, files in radio_simus.config.antmodels.items():
+        register_antenna_model(name, *files)
+
+
+#============================================================================
+def rotation_matrix(alpha, beta):
+#============================================================================
+
+    '''rotation from the topography frame to the antenna frame, for many slopes
+
+    Same rotation as the legacy TopoToAntenna: inverse of the beta (around z) and alpha (around y)
+    rotations, then back around zp so that the x arm points to NS. The inverses are the transposes,
+    written out in closed form.
+
+    Arguments:
+    ----------
+    alpha: float or numpy array
+        surface angle alpha in deg
+    beta: float or numpy array
+        surface angle beta in deg
+
+    Returns:
+    ----------
+    numpy array:
+        (..., 3, 3) rotation matrices, shape of alpha and beta broadcast
+    '''
+    alpha, beta = np.broadcast_arrays(np.deg2rad(alpha), np.deg2rad(beta))
+    ca, sa = np.cos(alpha), np.sin(alpha)
+    cb, sb = np.cos(beta), np.sin(beta)
+    zero, one = np.zeros_like(ca), np.ones_like(ca)
+    # roty^T.rotz^T, beta and then alpha rotation. This induces a EW component for x arm
+    rotyz = np.stack([np.stack([ca*cb, ca*sb, -sa], axis=-1),
+                      np.stack([-sb, cb, zero], axis=-1),
+                      np.stack([sa*cb, sa*sb, ca], axis=-1)], axis=-2)
+    # antrot, angle of NS direction in antenna ref = angle to turn Xarm back to North
+    antrot = np.arctan2(rotyz[..., 1, 0], rotyz[..., 0, 0])
+    cz, sz = np.cos(antrot), np.sin(antrot)
+    rotzant = np.stack([np.stack([cz, sz, zero], axis=-1),
+                        np.stack([-sz, cz, zero], axis=-1),
+                        np.stack([zero, zero, one], axis=-1)], axis=-2)
+    return np.matmul(rotzant, rotyz)
+
+
+#============================================================================
+@functools.lru_cache(maxsize=4096)
+def _rotation(alpha, beta):
+#============================================================================
+    ''' rotation_matrix for one slope pair, memoized (read-only)
+    '''
+    rot = rotation_matrix(alpha, beta)
+    rot.flags.writeable = False
+    return rot
+
+
+#============================================================================
+def slope_rotations(alpha, beta):
+#============================================================================
+
+    '''rotation matrices for arrays of slopes, only computed once per distinct slope pair
+
+    Arguments:
+    ----------
+    alpha: numpy array
+        surface angles alpha in deg
+    beta: numpy array
+        surface angles beta in deg
+
+    Returns:
+    ----------
+    numpy array:
+        (..., 3, 3) rotation matrices
+    '''
+    alpha, beta = np.broadcast_arrays(np.asarray(alpha, dtype=float), np.asarray(beta, dtype=float))
+    # only few different slopes in an array
+    slopes, inverse = np.unique(np.stack([alpha.ravel(), beta.ravel()], axis=-1), axis=0, return_inverse=True)
+    rot = rotation_matrix(slopes[:, 0], slopes[:, 1])
+    return rot[inverse.ravel()].reshape(alpha.shape + (3, 3))
+
+
+#============================================================================
+def topo_to_antenna(u, alpha, beta):
+#============================================================================
+
+    '''from coordinates in the topography frame to coordinates in the antenna, for many vectors
+
+    The rotation is built once per distinct slope pair.
+
+    Arguments:
+    ----------
+    u: numpy array
+        (..., 3) vectors in the topography frame
+    alpha: float or numpy array
+        surface angle alpha in deg, broadcast to u.shape[:-1]
+    beta: float or numpy array
+        surface angle beta in deg, broadcast to u.shape[:-1]
+
+    Returns:
+    ----------
+    numpy array:
+        (..., 3) vectors in coordinates of antenna
+    '''
+    u = np.asarray(u, dtype=float)
+    alpha, beta = np.broadcast_arrays(np.asarray(alpha, dtype=float), np.asarray(beta, dtype=float))
+    if alpha.ndim == 0:
+        return u.dot(_rotation(float(alpha), float(beta)).T)
+    return np.einsum("...ij,...j->...i", slope_rotations(alpha, beta), u)
 
 
 #============================================================================
@@ -148,7 +321,7 @@ def TopoToAntenna(u,alpha,beta):
     Arguments:
     ----------
     u: numpy array
-        shower vector
+        shower vector, components along the first axis
     alpha: float 
         surface angle alpha in deg
     beta: float 
@@ -160,38 +333,13 @@ def TopoToAntenna(u,alpha,beta):
         shower vector in coordinates of antenna
     
     '''
-    
-    alpha=alpha*np.pi/180 #around y
-    beta=beta*np.pi/180 #around z
-    cb = np.cos(beta)
-    sb = np.sin(beta)
-    ca = np.cos(alpha)
-    sa = np.sin(alpha)
-    roty = np.array([[ca,0,sa],[0,1,0],[-sa,0,ca]])
-    roty = np.linalg.inv(roty)  # Since we rotate referential, inverse transformation should be applied
-    rotz = np.array([[cb,-sb,0],[sb,cb,0],[0,0,1]])
-    rotz = np.linalg.inv(rotz) # Since we rotate referential, inverse transformation should be applied
-    rotyz=roty.dot(rotz)  # beta and then alpha rotation. This induces a EW component for x arm
-
-    # Now rotate along zp so that we are back with x along NS
-    xarm = [1,0,0]  #Xarm
-    xarmp = rotyz.dot(xarm)  # Rotate Xarm along slope
-    # Compute antrot, angle of NS direction in antenna ref = angle to turn Xarm back to North
-    antrot = math.atan2(xarmp[1],xarmp[0])*180/np.pi
-    cz = np.cos(antrot*np.pi/180)
-    sz = np.sin(antrot*np.pi/180)
-    rotzant = np.array([[cz,-sz,0],[sz,cz,0],[0,0,1]])
-    rotzant = np.linalg.inv(rotzant)
-    rottot = rotzant.dot(rotyz)
-
-    [xp,yp,zp] = rottot.dot(u)
-    return np.array([xp,yp,zp])
+    return _rotation(float(alpha), float(beta)).dot(u)
 
 
 
 
 #===========================================================================================================
-def get_voltage(time1, Ex, Ey, Ez, zenith_sim, azimuth_sim,alpha=0, beta=0, typ="X"):
+def get_voltage(time1, Ex, Ey, Ez, zenith_sim, azimuth_sim,alpha=0, beta=0, typ="X", model=None):
 #===========================================================================================================
     ''' Applies the antenna response
     
@@ -215,6 +363,8 @@ def get_voltage(time1, Ex, Ey, Ez, zenith_sim, azimuth_sim,alpha=0, beta=0, typ=
         surface angle beta in deg
     typ: str
         hand over arm (X,Y,Z)
+    model: str
+        optional, antenna type, default: default_model
         
     Returns:
     --------
@@ -225,45 +375,7 @@ def get_voltage(time1, Ex, Ey, Ez, zenith_sim, azimuth_sim,alpha=0, beta=0, typ=
     '''
     
     # Load proper antenna response matrix
-    if typ=="X":
-       fileleff = fileleff_x
-       freq=freq1
-       realimp=realimp1
-       reactance=reactance1
-       theta=theta1
-       phi=phi1
-       lefftheta=lefftheta1
-       leffphi=leffphi1
-       phasetheta=phasetheta1
-       phasephi=phasephi1
-       RL=RL1
-       XL=XL1
-    if typ=="Y":
-       fileleff = fileleff_y
-       freq=freq2
-       realimp=realimp2
-       reactance=reactance2
-       theta=theta2
-       phi=phi2
-       lefftheta=lefftheta2
-       leffphi=leffphi2
-       phasetheta=phasetheta2
-       phasephi=phasephi2
-       RL=RL2
-       XL=XL2
-    if typ=="Z":
-       fileleff = fileleff_z
-       freq=freq3
-       realimp=realimp3
-       reactance=reactance3
-       theta=theta3
-       phi=phi3
-       lefftheta=lefftheta3
-       leffphi=leffphi3
-       phasetheta=phasetheta3
-       phasephi=phasephi3
-       RL=RL3
-       XL=XL3
+    response = get_antenna_model(model)[typ]
 
     # Compute effective theta, phi in antenna tilted frame (taking slope into account, with x=SN)
     caz = np.cos(np.deg2rad(azimuth_sim))
@@ -310,114 +422,398 @@ def get_voltage(time1, Ex, Ey, Ez, zenith_sim, azimuth_sim,alpha=0, beta=0, typ=
     #     plt.plot(Eyp)
     #     plt.plot(Ezp)
 
-    ##################################
-    ### all the settings for the 3 different antenna arms:
-
-    nfreq=len(freq[:,0])
-    f=np.zeros(nfreq)
-    RA=np.zeros(nfreq)
-    XA=np.zeros(nfreq)
-    ltr1=np.zeros(nfreq)
-    lta1=np.zeros(nfreq)
-    lpr1=np.zeros(nfreq)
-    lpa1=np.zeros(nfreq)
-    ltr2=np.zeros(nfreq)
-    lta2=np.zeros(nfreq)
-    lpr2=np.zeros(nfreq)
-    lpa2=np.zeros(nfreq)
-    
-    if azstep==5:
-        roundazimuth=round(azim/10)*10+round((azim-10*round(azim/10))/5)*5
-    elif azstep==1:
-        roundazimuth=round(azim)
-    else:
-        print('Error on azimuth step!')
-        logger.error('Error on azimuth step!')
-        return(0)
-    if roundazimuth>=91 and roundazimuth<=180:
-        roundazimuth=180-roundazimuth
-    if roundazimuth>=181 and roundazimuth<=270:
-        roundazimuth=roundazimuth-180
-    if roundazimuth>=271 and roundazimuth<=360:
-        roundazimuth=360-roundazimuth
-
-    for i in range(nfreq):   # Using interpolation for every angle
-        f[i]=freq[i,0]*freqscale
-        indtheta=np.nonzero(theta[i,:]==int(zen))[0]
-        indphi=np.nonzero(phi[i,:]==roundazimuth)[0]
-        indcom=np.intersect1d(indtheta,indphi)
-        ltr1[i]=lefftheta[i,indcom]
-        lta1[i]=np.deg2rad(phasetheta[i,indcom]) #*np.pi/180
-        lpr1[i]=leffphi[i,indcom]
-        lpa1[i]=np.deg2rad(phasephi[i,indcom]) #*np.pi/180
-        indtheta=np.nonzero(theta[i,:]==int(zen)+1)[0]
-        indphi=np.nonzero(phi[i,:]==roundazimuth)[0]
-        indcom=np.intersect1d(indtheta,indphi)
-        ltr2[i]=lefftheta[i,indcom]
-        lta2[i]=np.deg2rad(phasetheta[i,indcom]) #*np.pi/180
-        lpr2[i]=leffphi[i,indcom]
-        lpa2[i]=np.deg2rad(phasephi[i,indcom]) #*np.pi/180
-
-        ltr=interp1d([int(zen),int(zen)+1],np.transpose([ltr1,ltr2]))(zen)
-        lta=interp1d([int(zen),int(zen)+1],np.transpose([lta1,lta2]))(zen)
-        lpr=interp1d([int(zen),int(zen)+1],np.transpose([lpr1,lpr2]))(zen)
-        lpa=interp1d([int(zen),int(zen)+1],np.transpose([lpa1,lpa2]))(zen)
-
     ###############################
     # Now go for the real thing
-    
-    fmin=f[0]
-    fmax=f[-1]
-    f=f*1e6
-    #nf  = int(2**np.floor(np.log(len(amplitudet))/np.log(2))) # changed in July2019 - shortens the trace
-    nf = len(amplitudet)
-    while Fs/nf > fmin*1e6:   # <== Make sure that the DFT resolution is at least fmin.
-        nf *= 2
-    F = rfftfreq(nf)*Fs
-
-    modulust = interp1d(f, ltr, bounds_error=False, fill_value=0.0)(F)
-    phaset   = interp1d(f, lta, bounds_error=False, fill_value=0.0)(F)
-    modulusp = interp1d(f, lpr, bounds_error=False, fill_value=0.0)(F)
-    phasep   = interp1d(f, lpa, bounds_error=False, fill_value=0.0)(F)
-    
-    phaset -= phaset[0] # Switch the phase origin to be consistent with a real signal.
-    phasep -= phasep[0] # Switch the phase origin to be consistent with a real signal.
-
-    # Switch to frequency domain
-    #B and D are V in freq domain, they are complex
-    A = rfft(amplitudet, nf)
-    ct = np.cos(phaset)
-    st = np.sin(phaset)
-    B = np.zeros(A.shape)
-    B[1:-1:2] = modulust[1:-1:2]*(A[1:-1:2]*ct[1:-1:2]-A[2:-1:2]*st[2:-1:2])
-    B[2:-1:2] = modulust[2:-1:2]*(A[1:-1:2]*st[1:-1:2]+A[2:-1:2]*ct[2:-1:2])
-    B[0]  = A[0]*modulust[0]
-    B[-1] = A[-1]*modulust[-1]
-    
-    
-    C = rfft(amplitudep, nf)
-    cp = np.cos(phasep)
-    sp = np.sin(phasep)
-    D = np.zeros(C.shape)
-    D[1:-1:2] = modulusp[1:-1:2]*(C[1:-1:2]*cp[1:-1:2]-C[2:-1:2]*sp[2:-1:2])
-    D[2:-1:2] = modulusp[2:-1:2]*(C[1:-1:2]*sp[1:-1:2]+C[2:-1:2]*cp[2:-1:2])
-    D[0]  = C[0]*modulusp[0]
-    D[-1] = C[-1]*modulusp[-1]
-
-    vt=irfft(B)
-    vp=irfft(D)
-    voltage = vp + vt
-    timet     = np.arange(0, len(vt))/Fs
-    timep     = np.arange(0, len(vp))/Fs
+    fmin = response.freq[0]*freqscale*1e6
+    nf = _fft_length(len(amplitudet), Fs, fmin)
+    # response of the antenna arm in that direction, on the rfft frequencies:
+    # linear interpolation in zenith, azimuth rounded to the table step
+    Ht, Hp = _transfer_function(response, np.array([zen]), np.array([azim]), nf, Fs)
+
+    # Switch to frequency domain, complex spectra
+    A = rfft(amplitudet, nf, workers=fft_workers)
+    C = rfft(amplitudep, nf, workers=fft_workers)
+    voltage = irfft(A*Ht[0] + C*Hp[0], nf, workers=fft_workers)
+    timet     = np.arange(0, len(voltage))/Fs
     
     return(voltage, timet+timeoff)
 
 
 #===========================================================================================================
-def compute_antennaresponse(signal, zenith_sim, azimuth_sim, alpha=0., beta=0.):
+def _antenna_directions(zenith_sim, azimuth_sim, alpha, beta):
+#===========================================================================================================
+    ''' Direction of the source and rotation into the antenna frame, for many antennas
+
+    Arguments:
+    ----------
+    zenith_sim: float
+        GRAND zenith in deg
+    azimuth_sim: float
+        GRAND azimuth in deg
+    alpha, beta: numpy array
+        (N) surface angles in deg
+
+    Returns:
+    --------
+    zen, azim: numpy array
+        (N) zenith and azimuth of the source in antenna frame in deg
+    rot: numpy array
+        (N, 3, 3) rotation from topography to antenna frame
+    '''
+    caz = np.cos(np.deg2rad(azimuth_sim))
+    saz = np.sin(np.deg2rad(azimuth_sim))
+    czen = np.cos(np.deg2rad(zenith_sim))
+    szen = np.sin(np.deg2rad(zenith_sim))
+    ush = -np.array([caz*szen, saz*szen,czen])  # Vector pointing towards source
+
+    rot = slope_rotations(alpha, beta)
+    ushp = rot.dot(ush)  # Xmax vector in antenna frame
+    zen = np.rad2deg(np.arccos(ushp[:, 2]))  # Zenith in antenna frame
+    azim = np.rad2deg(np.arctan2(ushp[:, 1], ushp[:, 0])) % 360.
+    return zen, azim, rot
+
+
+#===========================================================================================================
+def _fft_length(ntime, Fs, fmin):
+#===========================================================================================================
+    ''' Number of samples for the DFT: at least the trace length and a resolution of at least fmin (Hz),
+        rounded up to the next fast FFT length (no power-of-two padding)
+    '''
+    return next_fast_len(max(ntime, int(np.ceil(Fs/fmin))), real=True)
+
+
+#===========================================================================================================
+def _transfer_function(response, zen, azim, nf, Fs, interpolation="nearest"):
+#===========================================================================================================
+    ''' Complex transfer functions of one antenna arm for the theta and phi field components
+
+    Looked up in transfer_cache per direction bin (zenith, table azimuth or folded azimuth) and
+    version of the response tables, only the missing directions are computed. The zenith is exact
+    unless zenith_resolution is set: each slope of a sloped array is then a cache miss of its own.
+
+    Arguments:
+    ----------
+    response: AntennaResponse
+        antenna arm
+    zen, azim: numpy array
+        (N) direction in antenna frame in deg
+    nf: int
+        number of samples of the DFT
+    Fs: float
+        sampling frequency in Hz
+    interpolation: str
+        in azimuth, "nearest" table azimuth or "bilinear" in zenith and azimuth
+
+    Returns:
+    --------
+    Ht, Hp: numpy array
+        (N, nf//2+1) complex transfer functions on the rfft frequencies
+    '''
+    zen = np.asarray(zen, dtype=float)
+    if zenith_resolution is not None:
+        zen = np.round(zen/zenith_resolution)*zenith_resolution
+    if interpolation == "nearest":
+        azim = response.azimuth[response.azimuth_index(azim)]
+    else:
+        azim = fold_azimuth(azim)
+    bins, inverse = np.unique(np.stack([zen, azim], axis=-1), axis=0, return_inverse=True)
+
+    H = np.empty((len(bins), 2, nf//2 + 1), dtype=complex)
+    keys = [(response.version, interpolation, z, a, nf, Fs) for z, a in bins]
+    missing = []
+    for i, key in enumerate(keys):
+        cached = transfer_cache.get(key)
+        if cached is None:
+            missing.append(i)
+        else:
+            H[i] = cached
+    if missing:
+        missing = np.array(missing)
+        H[missing] = np.stack(_compute_transfer_function(response, bins[missing, 0], bins[missing, 1],
+                                                         nf, Fs, interpolation), axis=1)
+        for i in missing:
+            transfer_cache.put(keys[i], H[i])
+    H = H[inverse.ravel()]
+    return H[:, 0], H[:, 1]
+
+
+#===========================================================================================================
+def resampling_matrix(freq, nf, Fs):
+#===========================================================================================================
+    ''' Sparse linear interpolation operator from the antenna table frequencies onto the rfft frequencies
+
+    Fixed for given table frequencies, nf and Fs, so it is built once and cached.
+    Rows of rfft frequencies outside the table are empty (response 0).
+
+    Arguments:
+    ----------
+    freq: numpy array
+        table frequencies in Hz, increasing
+    nf: int
+        number of samples of the DFT
+    Fs: float
+        sampling frequency in Hz
+
+    Returns:
+    --------
+    scipy.sparse.csr_matrix:
+        (nf//2+1, len(freq)) operator, R.dot(table) resamples table along its first axis
+    '''
+    return _resampling_matrix(tuple(np.asarray(freq, dtype=float)), int(nf), float(Fs))
+
+
+@functools.lru_cache(maxsize=64)
+def _resampling_matrix(freq, nf, Fs):
+    f = np.array(freq)
+    F = rfftfreq(nf)*Fs # same rounding as the legacy grid, bins on the table edges stay inside
+    ind = np.clip(np.searchsorted(f, F), 1, len(f) - 1)
+    weight = (F - f[ind-1]) / (f[ind] - f[ind-1])
+    rows = np.flatnonzero((F >= f[0]) & (F <= f[-1]))
+    ind, weight = ind[rows], weight[rows]
+    R = sparse.csr_matrix((np.concatenate([1. - weight, weight]),
+                           (np.concatenate([rows, rows]), np.concatenate([ind - 1, ind]))),
+                          shape=(len(F), len(f)))
+    R.sum_duplicates()
+    return R
+
+
+#===========================================================================================================
+def _compute_transfer_function(response, zen, azim, nf, Fs, interpolation="nearest"):
+#===========================================================================================================
+    ''' Computes the transfer functions of _transfer_function, without cache
+    '''
+    R = resampling_matrix(response.freq*freqscale*1e6, nf, Fs)
+    # all directions and the four responses resampled with a single product
+    tables = np.concatenate(response.direction(np.atleast_1d(zen), np.atleast_1d(azim), interpolation), axis=1)
+    leff_t, phase_t, leff_p, phase_p = np.split(R.dot(tables).T, 4)
+    res = []
+    for modulus, phase in ((leff_t, phase_t), (leff_p, phase_p)):
+        phase = phase - phase[:, :1] # Switch the phase origin to be consistent with a real signal.
+        H = modulus*np.exp(1j*phase)
+        if nf % 2 == 0: # the Nyquist bin only gets the modulus, it has no imaginary part
+            H[:, -1] = modulus[:, -1]
+        res.append(H)
+    return tuple(res)
+
+
+#===========================================================================================================
+def _field_components(efield, zenith_sim, azimuth_sim, alpha, beta):
+#===========================================================================================================
+    ''' Direction in the antenna frame and theta, phi components of the E-field, for many antennas
+
+    Arguments:
+    ----------
+    efield: numpy array
+        (N, T, 3) electric field Ex, Ey, Ez in muV/m
+    zenith_sim, azimuth_sim: float
+        shower direction in deg (GRAND)
+    alpha, beta: float or numpy array
+        (N) antenna angles in deg
+
+    Returns:
+    --------
+    zen, azim: numpy array
+        (N) direction in antenna frame in deg, zenith set to 90 below the horizon
+    below: numpy array
+        (N) True for antennas seeing the signal below the horizon
+    amplitudet, amplitudep: numpy array
+        (N, T) theta and phi components of the E-field in muV/m
+    '''
+    nant = len(efield)
+    alpha = np.broadcast_to(np.asarray(alpha, dtype=float), (nant,))
+    beta = np.broadcast_to(np.asarray(beta, dtype=float), (nant,))
+
+    zen, azim, rot = _antenna_directions(zenith_sim, azimuth_sim, alpha, beta)
+    below = (zen > 90) if freespace == 0 else np.zeros(nant, dtype=bool)
+    zen = np.where(below, 90., zen)
+    amplitudet, amplitudep = _project(efield, zen, azim, rot)
+    return zen, azim, below, amplitudet, amplitudep
+
+
+#===========================================================================================================
+def _project(efield, zen, azim, rot):
+#===========================================================================================================
+    ''' theta, phi components (N, T) of the E-field (N, T, 3), for directions and rotations
+        of _antenna_directions
+    '''
+    # Rotate Efield to antenna frame (x along actual arm) and project on theta, phi
+    Ep = np.einsum("nij,ntj->nti", rot, efield)
+    szen, czen = np.sin(np.deg2rad(zen))[:, None], np.cos(np.deg2rad(zen))[:, None]
+    saz, caz = np.sin(np.deg2rad(azim))[:, None], np.cos(np.deg2rad(azim))[:, None]
+    amplitudet = czen*(caz*Ep[..., 0]+saz*Ep[..., 1])-szen*Ep[..., 2]
+    amplitudep = -saz*Ep[..., 0]+caz*Ep[..., 1]
+    return amplitudet, amplitudep
+
+
+#===========================================================================================================
+def _model_groups(types, nant):
+#===========================================================================================================
+    ''' antennas grouped by antenna model: list of (responses of the model, selection of the antennas) '''
+    if types is None:
+        return [(get_antenna_model(), slice(None))]
+    types = np.broadcast_to(np.asarray(types), (nant,))
+    return [(get_antenna_model(model), types == model) for model in np.unique(types)]
+
+
+#===========================================================================================================
+def _compute_spectra(time, efield, zenith_sim, azimuth_sim, alpha, beta, interpolation="nearest", workers=None,
+                     types=None, multiple=1):
+#===========================================================================================================
+    ''' Spectra of the voltages of the three arms for many antennas, see compute_antennaresponse_spectrum
+
+    Returns:
+    --------
+    t0: numpy array
+        (N) time of the first sample in ns
+    Fs: float
+        sampling frequency in Hz
+    nf: int
+        number of samples of the DFT
+    spectrum: numpy array
+        (N, nf//2+1, 3) complex rfft of the voltages Vx, Vy, Vz in muV
+    below: numpy array
+        (N) True for antennas seeing the signal below the horizon
+    '''
+    efield = np.asarray(efield, dtype=float)
+    nant, ntime = efield.shape[:2]
+    time = np.broadcast_to(np.asarray(time, dtype=float)*1e-9, (nant, ntime)) # ns -> s
+    zen, azim, below, amplitudet, amplitudep = _field_components(efield, zenith_sim, azimuth_sim, alpha, beta)
+
+    # one stacked FFT for all antennas, shared by the arms
+    workers = fft_workers if workers is None else workers
+    delt = np.mean(np.diff(time[0]))
+    Fs = round(1/delt)
+    groups = _model_groups(types, nant)
+    fmin = min(model[typ].freq[0] for model, _ in groups for typ in "XYZ")*freqscale*1e6
+    nf = _fft_length(ntime, Fs, fmin)
+    if multiple > 1:
+        nf = multiple*next_fast_len(-(-nf//multiple), real=True)
+    A = rfft(amplitudet, nf, axis=-1, workers=workers)
+    C = rfft(amplitudep, nf, axis=-1, workers=workers)
+
+    spectrum = np.zeros((nant, nf//2 + 1, 3), dtype=complex)
+    for model, sel in groups:
+        for i, typ in enumerate("XYZ"):
+            Ht, Hp = _transfer_function(model[typ], zen[sel], azim[sel], nf, Fs, interpolation)
+            spectrum[sel, :, i] = A[sel]*Ht + C[sel]*Hp
+    spectrum[below] = 0.
+    return time[:, 0]*1e9, Fs, nf, spectrum, below
+
+
+#===========================================================================================================
+def _compute_voltages(time, efield, zenith_sim, azimuth_sim, alpha, beta, interpolation="nearest", workers=None,
+                      types=None):
+#===========================================================================================================
+    ''' Fused computation of the three arms for many antennas, see compute_antennaresponse_batch
+
+    Returns:
+    --------
+    time: numpy array
+        (N, T') time in ns
+    voltage: numpy array
+        (N, T', 3) voltages Vx, Vy, Vz in muV
+    below: numpy array
+        (N) True for antennas seeing the signal below the horizon
+    '''
+    t0, Fs, nf, spectrum, below = _compute_spectra(time, efield, zenith_sim, azimuth_sim, alpha, beta,
+                                                   interpolation, workers, types)
+    workers = fft_workers if workers is None else workers
+    voltage = irfft(spectrum, nf, axis=1, workers=workers)
+    time_out = t0[:, None] + np.arange(nf)/Fs*1e9 # ns
+    return time_out, voltage, below
+
+
+#===========================================================================================================
+def compute_antennaresponse_spectrum(time, efield, zenith_sim, azimuth_sim, alpha=0., beta=0.,
+                                     interpolation="nearest", workers=None, types=None, multiple=1):
+#===========================================================================================================
+    '''
+    antenna response of many antennas, kept in the frequency domain (for further processing of the
+    spectra before a single inverse FFT, see signal_processing.fused_processing)
+
+    Arguments:
+    ----------
+    time, efield, zenith_sim, azimuth_sim, alpha, beta, interpolation, workers, types:
+        as compute_antennaresponse_batch
+    multiple: int
+        optional, the DFT length is rounded up to a multiple of it (e.g. decimation ratio)
+
+    Returns:
+    --------
+    t0: numpy array
+        (N) time of the first sample in ns
+    Fs: float
+        sampling frequency in Hz
+    nf: int
+        number of samples of the DFT (irfft(spectrum, nf, axis=1) are the voltages)
+    spectrum: numpy array
+        (N, nf//2+1, 3) complex spectra of the voltages Vx, Vy, Vz in muV, zero for antennas seeing
+        the signal below the horizon
+    '''
+    t0, Fs, nf, spectrum, below = _compute_spectra(time, efield, zenith_sim, azimuth_sim, alpha, beta,
+                                                   interpolation, workers, types, multiple)
+    if np.any(below):
+        logger.info(str(np.count_nonzero(below)) + ' antennas see the signal below antenna horizon! No antenna response computed.')
+    return t0, Fs, nf, spectrum
+
+
+#===========================================================================================================
+def compute_antennaresponse_batch(time, efield, zenith_sim, azimuth_sim, alpha=0., beta=0., interpolation="nearest",
+                                  workers=None, types=None):
+#===========================================================================================================
+    '''
+    applies the antenna response to the traces of many antennas at once
+
+    The direction in the antenna frame is looked up for all antennas at once, the E-field
+    spectra are computed once with a stacked rfft and shared by the three arms.
+    All traces must have the same length and sampling.
+
+    Arguments:
+    ----------
+    time: numpy array
+        (T) or (N, T) time in ns
+    efield: numpy array
+        (N, T, 3) electric field Ex, Ey, Ez in muV/m
+    zenith_sim: float
+        GRAND zenith in deg
+    azimuth_sim: float
+        GRAND azimuth in deg
+    alpha, beta: float or numpy array
+        (N) surface angles in deg, optional
+    interpolation: str
+        optional, "nearest" table azimuth (default, as get_voltage) or "bilinear" in zenith and azimuth
+    workers: int
+        optional, number of threads for the FFTs, default: fft_workers
+    types: str or numpy array
+        optional, (N) antenna types (Detector.type), each antenna gets the response of its model,
+        default: default_model for all
+
+    Returns:
+    --------
+    time: numpy array
+        (N, T') time in ns
+    voltage: numpy array
+        (N, T', 3) voltages Vx, Vy, Vz in muV, zero for antennas seeing the signal below the horizon
+
+    Note: T' >= T, the traces are zero-padded to a fast FFT length with a DFT resolution of at least
+          the lowest antenna frequency. The transfer functions are cached per direction: for sloped
+          arrays set zenith_resolution, else antennas with different slopes do not share them.
+    '''
+    time, voltage, below = _compute_voltages(time, efield, zenith_sim, azimuth_sim, alpha, beta, interpolation, workers,
+                                             types)
+    if np.any(below):
+        logger.info(str(np.count_nonzero(below)) + ' antennas see the signal below antenna horizon! No antenna response computed.')
+    return time, voltage
+
+
+#===========================================================================================================
+def compute_antennaresponse(signal, zenith_sim, azimuth_sim, alpha=0., beta=0., interpolation="nearest", model=None):
 #===========================================================================================================
     ''' 
-    calls compute voltage for each component and stacks the results
+    computes the voltage of the three arms and stacks the results
+
+    Single pass over the three arms: the direction in the antenna frame and the spectra of the
+    E-field components are computed once and shared by the arms (see compute_antennaresponse_batch)
     
     Parameters
     -----------
@@ -429,21 +825,223 @@ def compute_antennaresponse(signal, zenith_sim, azimuth_sim, alpha=0., beta=0.):
         azimuth of shower in deg (GRAND)
     alpha, beta: float
         antenna angles, optional, in deg
+    interpolation: str
+        optional, "nearest" table azimuth (default) or "bilinear" in zenith and azimuth
+    model: str
+        optional, antenna type, default: default_model
         
     Returns
     ---------
     numpy array
         voltage traces, Time in ns, Vx,Vy,Vz in muV
+
+    Raises
+    ---------
+    ValueError:
+        signal originates below antenna horizon
     '''
-    
-    voltage_NS, timeNS = get_voltage(signal.T[0]*1e-9, signal.T[1], signal.T[2], signal.T[3], zenith_sim, azimuth_sim, alpha, beta, typ="X")
-    voltage_EW, timeEW = get_voltage(signal.T[0]*1e-9, signal.T[1], signal.T[2], signal.T[3], zenith_sim, azimuth_sim, alpha, beta, typ="Y")
-    voltage_vert, timevert = get_voltage(signal.T[0]*1e-9, signal.T[1], signal.T[2], signal.T[3],zenith_sim, azimuth_sim, alpha, beta, typ="Z")
+    signal = np.asarray(signal)
+    time, voltage, below = _compute_voltages(signal.T[0], signal[None, :, 1:4], zenith_sim, azimuth_sim, alpha, beta,
+                                             interpolation, types=model)
+    if below[0]:
+        logger.info('Signal originates below antenna horizon! No antenna response computed. Abort.')
+        raise ValueError('Signal originates below antenna horizon! No antenna response computed.')
         
     # ATTENTION EW AND NS WERE SWITCHED 
     # ATTENTION voltage time now in ns 
     #return np.vstack((timeNS*1e9,voltage_NS,voltage_EW,voltage_vert)) # switched to be consistent to efield treatment
-    return np.stack([timeNS*1e9,voltage_NS,voltage_EW,voltage_vert], axis=-1)
+    return np.column_stack([time[0], voltage[0]])
+
+
+#===========================================================================================================
+def fir_kernels(response, zen, azim, ntaps, Fs, interpolation="nearest", delay=0):
+#===========================================================================================================
+    ''' Impulse responses (FIR kernels) of one antenna arm for the theta and phi field components
+
+    The kernels are the inverse rfft of the transfer functions on a ntaps point grid, so that
+    convolving the field components with them is the time domain version of get_voltage.
+    ntaps has to cover the duration of the impulse response (see fir_length). The response is not
+    causal (ringing at the band edges of the tables), the kernels are shifted by delay samples.
+
+    Arguments:
+    ----------
+    response: AntennaResponse
+        antenna arm
+    zen, azim: numpy array
+        (N) direction in antenna frame in deg
+    ntaps: int
+        number of samples of the kernels
+    Fs: float
+        sampling frequency in Hz
+    interpolation: str
+        in azimuth, "nearest" table azimuth or "bilinear" in zenith and azimuth
+    delay: int
+        optional, shift of the kernels in samples, the last delay samples of the impulse response
+        are its part at negative times
+
+    Returns:
+    --------
+    ht, hp: numpy array
+        (N, ntaps) kernels, voltage in muV at t-delay = sum_k E(t-k) h(k), E in muV/m
+    '''
+    Ht, Hp = _transfer_function(response, zen, azim, ntaps, Fs, interpolation)
+    return (np.roll(irfft(Ht, ntaps, axis=-1), delay, axis=-1),
+            np.roll(irfft(Hp, ntaps, axis=-1), delay, axis=-1))
+
+
+#===========================================================================================================
+def fir_length(Fs, types=None):
+#===========================================================================================================
+    ''' Default number of taps of the FIR kernels: ten times the inverse of the frequency step of the
+        antenna tables (of the models in types, default: default_model), rounded up to a fast FFT length
+
+    The responses are cut at the ends of the tables, their impulse responses ring long: the difference
+    to the frequency domain result (of a zero padded trace) decreases like 1/ntaps, ~1% for this length.
+    '''
+    models = [get_antenna_model()] if types is None else [get_antenna_model(m) for m in np.unique(types)]
+    df = min(np.min(np.diff(model[typ].freq)) for model in models for typ in "XYZ")*freqscale*1e6
+    return next_fast_len(int(np.ceil(10*Fs/df)), real=True)
+
+
+#===========================================================================================================
+class VoltageStream:
+#===========================================================================================================
+    ''' Applies the antenna response to continuous E-field data of many antennas, chunk by chunk
+
+    Time domain alternative to compute_antennaresponse_batch: the FIR kernels of the three arms are
+    computed once per antenna direction and applied with overlap-add convolution (oaconvolve), the
+    tail of each chunk is added to the next one. The cost is linear in the trace length and the output
+    of consecutive chunks is the one of the whole trace, without padding. As the response is not causal,
+    the voltages come out delay samples after the E-field (default: half the kernel length).
+
+    Arguments:
+    ----------
+    zenith_sim: float
+        zenith of shower in deg (GRAND)
+    azimuth_sim: float
+        azimuth of shower in deg (GRAND)
+    alpha, beta: float or numpy array
+        optional, (N) antenna angles in deg, define the number of antennas
+    tstep: float
+        optional, sampling time in ns, default 1
+    ntaps: int
+        optional, length of the FIR kernels, default: fir_length
+    interpolation: str
+        optional, "nearest" table azimuth (default) or "bilinear" in zenith and azimuth
+    delay: int
+        optional, latency of the output in samples, default ntaps//2
+    types: str or numpy array
+        optional, (N) antenna types (Detector.type), each antenna gets the response of its model,
+        default: default_model for all
+
+    Attributes:
+    ----------
+    below: numpy array
+        (N) True for antennas seeing the signal below the horizon (voltage 0)
+    kernels: numpy array
+        (N, 2, 3, ntaps) kernels of the theta and phi components for the arms X, Y, Z
+    '''
+
+    def __init__(self, zenith_sim, azimuth_sim, alpha=0., beta=0., tstep=1., ntaps=None, interpolation="nearest",
+                 delay=None, types=None):
+        alpha, beta = np.broadcast_arrays(np.atleast_1d(np.asarray(alpha, dtype=float)),
+                                          np.atleast_1d(np.asarray(beta, dtype=float)))
+        self.Fs = round(1/(tstep*1e-9))
+        self.ntaps = fir_length(self.Fs, types) if ntaps is None else int(ntaps)
+        self.delay = self.ntaps//2 if delay is None else int(delay)
+        self.zen, self.azim, self.rot = _antenna_directions(zenith_sim, azimuth_sim, alpha, beta)
+        self.below = (self.zen > 90) if freespace == 0 else np.zeros(len(alpha), dtype=bool)
+        self.zen = np.where(self.below, 90., self.zen)
+
+        self.kernels = np.zeros((len(alpha), 2, 3, self.ntaps))
+        for model, sel in _model_groups(types, len(alpha)):
+            for i, typ in enumerate("XYZ"):
+                ht, hp = fir_kernels(model[typ], self.zen[sel], self.azim[sel], self.ntaps, self.Fs, interpolation,
+                                     self.delay)
+                self.kernels[sel, 0, i], self.kernels[sel, 1, i] = ht, hp
+        self.kernels[self.below] = 0.
+        self.reset()
+
+    def reset(self):
+        ''' Starts a new stream (drops the tail of the previous chunk) '''
+        self._tail = np.zeros((len(self.kernels), 3, self.ntaps - 1))
+
+    def process(self, efield):
+        ''' Voltages of the next chunk
+
+        Arguments:
+        ----------
+        efield: numpy array
+            (N, L, 3) electric field Ex, Ey, Ez in muV/m of the next L samples
+
+        Returns:
+        --------
+        voltage: numpy array
+            (N, L, 3) voltages Vx, Vy, Vz in muV, delayed by delay samples
+        '''
+        efield = np.asarray(efield, dtype=float)
+        nchunk = efield.shape[1]
+        amplitudet, amplitudep = _project(efield, self.zen, self.azim, self.rot)
+        amplitude = np.stack([amplitudet, amplitudep], axis=1)[:, :, None, :] # (N, 2, 1, L)
+        full = oaconvolve(amplitude, self.kernels, mode="full", axes=-1).sum(axis=1) # (N, 3, L+ntaps-1)
+        full[..., :self.ntaps - 1] += self._tail
+        self._tail = full[..., nchunk:]
+        return np.moveaxis(full[..., :nchunk], 1, -1)
+
+
+#===========================================================================================================
+def compute_antennaresponse_fir(time, efield, zenith_sim, azimuth_sim, alpha=0., beta=0., ntaps=None,
+                                interpolation="nearest", chunksize=None, types=None):
+#===========================================================================================================
+    '''
+    applies the antenna response to the traces of many antennas with FIR kernels (see VoltageStream)
+
+    Same as compute_antennaresponse_batch, but in the time domain: no padding, the voltages have the
+    length of the E-field traces and the ringing after the end of the traces is dropped.
+
+    Arguments:
+    ----------
+    time: numpy array
+        (T) or (N, T) time in ns
+    efield: numpy array
+        (N, T, 3) electric field Ex, Ey, Ez in muV/m
+    zenith_sim: float
+        zenith of shower in deg (GRAND)
+    azimuth_sim: float
+        azimuth of shower in deg (GRAND)
+    alpha, beta: float or numpy array
+        optional, (N) antenna angles in deg
+    ntaps: int
+        optional, length of the FIR kernels, default: fir_length
+    interpolation: str
+        optional, "nearest" table azimuth (default) or "bilinear" in zenith and azimuth
+    chunksize: int
+        optional, process the traces in chunks of that many samples, default: all at once
+    types: str or numpy array
+        optional, (N) antenna types (Detector.type), each antenna gets the response of its model,
+        default: default_model for all
+
+    Returns:
+    --------
+    time: numpy array
+        (N, T) time in ns
+    voltage: numpy array
+        (N, T, 3) voltages Vx, Vy, Vz in muV, zero for antennas seeing the signal below the horizon
+    '''
+    efield = np.asarray(efield, dtype=float)
+    nant, ntime = efield.shape[:2]
+    time = np.broadcast_to(np.asarray(time, dtype=float), (nant, ntime))
+    alpha = np.broadcast_to(np.asarray(alpha, dtype=float), (nant,))
+    beta = np.broadcast_to(np.asarray(beta, dtype=float), (nant,))
+    stream = VoltageStream(zenith_sim, azimuth_sim, alpha, beta, tstep=np.mean(np.diff(time[0])), ntaps=ntaps,
+                           interpolation=interpolation, types=types)
+    if np.any(stream.below):
+        logger.info('Signal originates below antenna horizon for antennas '+str(np.flatnonzero(stream.below))
+                    +'! No antenna response computed.')
+    chunksize = ntime if chunksize is None else chunksize
+    voltage = [stream.process(efield[:, i:i+chunksize]) for i in range(0, ntime, chunksize)]
+    voltage.append(stream.process(np.zeros((nant, stream.delay, 3)))) # flush the delayed samples
+    return np.array(time), np.concatenate(voltage, axis=1)[:, stream.delay:]
 
 
 ##===========================================================================================================
@@ -586,6 +1184,270 @@ def compute(opt_input,path, zenith_sim, azimuth_sim):
 ############### end of loop over antennas
 
 
+#===========================================================================================================
+def _trace_files(path):
+#===========================================================================================================
+    ''' a<ID>.trace files of a folder, sorted by antenna ID
+
+    Returns:
+    --------
+    ids: numpy array
+        antenna IDs
+    files: list
+        paths of the trace files
+    '''
+    files = glob.glob(join(path, 'a*.trace'))
+    ids = []
+    for name in files:
+        try:
+            ids.append(int(os.path.basename(name)[1:-len('.trace')]))
+        except ValueError:
+            ids.append(-1)
+    order = [i for i in np.argsort(ids, kind='stable') if ids[i] >= 0]
+    return np.array([ids[i] for i in order], dtype=int), [files[i] for i in order]
+
+
+#===========================================================================================================
+def _compute_chunk(args):
+#===========================================================================================================
+    ''' Worker of compute_folder: reads a chunk of trace files and applies the antenna response
+        to all antennas of the chunk at once (one batch per trace length and sampling)
+
+    Returns:
+    --------
+    index: list
+        position of the antennas in the chunk
+    results: list
+        (time, voltage, below) per antenna
+    timing: dict
+        time spent reading and computing in s
+    '''
+    index, files, zenith_sim, azimuth_sim, alpha, beta, types, workers = args
+    t0 = timer()
+    efields = [np.loadtxt(name, usecols=(0,1,2,3)) for name in files]
+    t1 = timer()
+
+    results = [None]*len(files)
+    # antennas with the same trace length and sampling go in one batch
+    groups = np.array([(len(e), round(1e9/np.mean(np.diff(e[:, 0])))) for e in efields])
+    for group in np.unique(groups, axis=0):
+        sel = np.flatnonzero(np.all(groups == group, axis=1))
+        efield = np.stack([efields[i] for i in sel])
+        time, voltage, below = _compute_voltages(efield[..., 0], efield[..., 1:4], zenith_sim, azimuth_sim,
+                                                 alpha[sel], beta[sel], workers=workers, types=types[sel])
+        for k, i in enumerate(sel):
+            results[i] = (time[k], voltage[k], below[k])
+    t2 = timer()
+    return index, results, {'read': t1-t0, 'response': t2-t1}
+
+
+#===========================================================================================================
+def _as_detector(detector):
+#===========================================================================================================
+    ''' Detector, read from the array file if a path is given (see Detector.create_from_file)
+    '''
+    if isinstance(detector, str):
+        from radio_simus.detector import Detector
+        array_file, detector = detector, Detector()
+        detector.create_from_file(array_file)
+    return detector
+
+
+#===========================================================================================================
+def _detector_antennas(detector, ids):
+#===========================================================================================================
+    ''' slopes and types of the antennas of a folder, looked up by antenna ID in the detector
+
+    Arguments:
+    ----------
+    detector: Detector or str
+        detector or array file (see Detector.create_from_file)
+    ids: numpy array
+        (N) antenna IDs
+
+    Returns:
+    --------
+    alpha, beta: numpy array
+        (N) antenna slopes in deg
+    types: numpy array
+        (N) antenna types (Detector.type)
+    '''
+    detector = _as_detector(detector)
+    index = {int(antenna): i for i, antenna in enumerate(np.atleast_1d(detector.ID))}
+    missing = [int(antenna) for antenna in ids if int(antenna) not in index]
+    if missing:
+        raise ValueError('Antenna(s) '+str(missing)+' not in the detector')
+    rows = [index[int(antenna)] for antenna in ids]
+    slope = np.asarray(getattr(detector.slope, 'value', detector.slope), dtype=float).reshape(-1, 2) # deg
+    return slope[rows, 0], slope[rows, 1], np.asarray(detector.type)[rows]
+
+
+#===========================================================================================================
+def _open_models():
+#===========================================================================================================
+    ''' opens (converts and maps) the responses of all antenna models
+    '''
+    for model in [responses] + list(antenna_models.values()):
+        for response in model.values():
+            response.open()
+
+
+#===========================================================================================================
+def compute_folder(path, zenith_sim=None, azimuth_sim=None, alpha=0., beta=0., processes=None, output=None,
+                   chunksize=32, pool=None, types=None, detector=None):
+#===========================================================================================================
+    ''' Applies the antenna response to all a<ID>.trace files (ZHAireS, time in ns, Ex, Ey, Ez in muV/m)
+        of an event folder with a pool of processes and writes the voltages of all antennas to one file
+
+    The antenna model is opened (memory mapped) before the workers are forked, so that all workers
+    share it. Each worker reads a chunk of antennas and computes them in one batch with a single
+    FFT thread. The output is a npz file with arrays
+        antenna (N) IDs, time (N, T) in ns, voltage (N, T, 3) Vx, Vy, Vz in muV, below (N) signal below the
+        antenna horizon (voltage 0), zenith, azimuth (shower direction, GRAND, deg)
+    Traces shorter than the longest one are padded with zeros at the end.
+
+    Arguments:
+    ----------
+    path: str
+        path to event folder
+    zenith_sim: float
+        optional, GRAND zenith in deg, default: read from the *.inp file of the folder
+    azimuth_sim: float
+        optional, GRAND azimuth in deg, default: read from the *.inp file of the folder
+    alpha, beta: float or numpy array
+        optional, antenna slopes in deg, (N) arrays in the order of the antenna IDs
+    processes: int
+        optional, number of worker processes, default: number of cores, 1: no pool
+    output: str
+        optional, output file, default: <path>/voltage.npz
+    chunksize: int
+        optional, number of antennas per task
+    pool: multiprocessing.Pool
+        optional, pool to use (see compute_tree)
+    types: str or numpy array
+        optional, antenna types (Detector.type), (N) array in the order of the antenna IDs,
+        default: default_model
+    detector: Detector or str
+        optional, detector or array file: alpha, beta and type of the antennas by ID, instead of alpha, beta,
+        types
+
+    Returns:
+    --------
+    output: str
+        path of the written file
+    timing: dict
+        time in s spent reading the traces and computing the response (summed over the workers),
+        writing the output and in total (wall time)
+    '''
+    start = timer()
+    if zenith_sim is None or azimuth_sim is None:
+        from radio_simus.AiresInfoFunctions import inputfromtxt
+        inpfile = glob.glob(join(path, '*.inp'))
+        if not inpfile:
+            raise ValueError('no shower direction given and no inp-file found in '+str(path))
+        zenith_sim, azimuth_sim = inputfromtxt(inpfile[0])[:2]
+    if output is None:
+        output = join(path, 'voltage.npz')
+
+    ids, files = _trace_files(path)
+    nant = len(files)
+    if detector is not None:
+        alpha, beta, types = _detector_antennas(detector, ids)
+    alpha = np.array(np.broadcast_to(np.asarray(alpha, dtype=float), (nant,)))
+    types = np.array(np.broadcast_to(np.asarray(default_model if types is None else types), (nant,)))
+    beta = np.array(np.broadcast_to(np.asarray(beta, dtype=float), (nant,)))
+    serial = pool is None and (processes == 1 or nant <= chunksize)
+    workers = None if serial else 1 # one FFT thread per process
+    tasks = [(list(range(i, min(i+chunksize, nant))), files[i:i+chunksize], zenith_sim, azimuth_sim,
+              alpha[i:i+chunksize], beta[i:i+chunksize], types[i:i+chunksize], workers)
+             for i in range(0, nant, chunksize)]
+    logger.info('Computing '+str(nant)+' antenna(s) in folder '+str(path))
+
+    _open_models() # convert once and map before forking
+    results = [None]*nant
+    timing = {'read': 0., 'response': 0.}
+    if serial:
+        chunks = [_compute_chunk(task) for task in tasks]
+    elif pool is None:
+        with multiprocessing.get_context('fork').Pool(processes) as pool:
+            chunks = list(pool.imap_unordered(_compute_chunk, tasks))
+    else:
+        chunks = list(pool.imap_unordered(_compute_chunk, tasks))
+    for index, chunk, chunk_timing in chunks:
+        for i, result in zip(index, chunk):
+            results[i] = result
+        for key in timing:
+            timing[key] += chunk_timing[key]
+
+    t0 = timer()
+    ntime = max((len(t) for t, _, _ in results), default=0)
+    time = np.zeros((nant, ntime))
+    voltage = np.zeros((nant, ntime, 3))
+    below = np.zeros(nant, dtype=bool)
+    for i, (t, v, b) in enumerate(results):
+        step = t[1] - t[0] if len(t) > 1 else 0.
+        time[i] = t[0] + step*np.arange(ntime)
+        voltage[i, :len(v)] = v
+        below[i] = b
+    tmp = output + '.tmp.npz' # written completely, then moved into place
+    np.savez(tmp, antenna=ids, time=time, voltage=voltage, below=below, zenith=zenith_sim, azimuth=azimuth_sim)
+    os.replace(tmp, output)
+    timing['write'] = timer() - t0
+    timing['total'] = timer() - start
+    if np.any(below):
+        logger.info('Signal originates below antenna horizon for antennas '+str(ids[below])+'! Voltage set to 0.')
+    logger.info('Voltages written to '+str(output)+', timing (s): '+str(timing))
+    return output, timing
+
+
+#===========================================================================================================
+def compute_tree(root, zenith_sim=None, azimuth_sim=None, processes=None, chunksize=32, detector=None):
+#===========================================================================================================
+    ''' Runs compute_folder on all folders below root which contain a<ID>.trace files, with one pool of
+        processes for all of them (none for processes=1). The voltages are written to voltage.npz in
+        each folder.
+
+    Arguments:
+    ----------
+    root: str
+        path to the folder tree
+    zenith_sim: float
+        optional, GRAND zenith in deg, default: read from the *.inp file of each folder
+    azimuth_sim: float
+        optional, GRAND azimuth in deg, default: read from the *.inp file of each folder
+    processes: int
+        optional, number of worker processes, default: number of cores, 1: no pool
+    chunksize: int
+        optional, number of antennas per task
+    detector: Detector or str
+        optional, detector or array file with the slopes and types of the antennas (by ID),
+        default: flat antennas (alpha = beta = 0) of type default_model
+
+    Returns:
+    --------
+    timing: dict
+        timing of compute_folder per folder
+    '''
+    if detector is None:
+        logger.warning('No detector given: antennas taken as flat (alpha = beta = 0) and of type '+default_model)
+    else:
+        detector = _as_detector(detector) # read once for all folders
+    folders = sorted(dirpath for dirpath, dirnames, filenames in os.walk(root)
+                     if any(name.startswith('a') and name.endswith('.trace') for name in filenames))
+    _open_models() # convert once and map before forking
+    timing = {}
+    pool = None if processes == 1 else multiprocessing.get_context('fork').Pool(processes)
+    try:
+        for folder in folders:
+            timing[folder] = compute_folder(folder, zenith_sim, azimuth_sim, processes=processes,
+                                            chunksize=chunksize, pool=pool, detector=detector)[1]
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return timing
+
+
 ####################################################################################################################################
 ####################################################################################################################################
 ####################################################################################################################################
@@ -596,7 +1458,8 @@ def compute(opt_input,path, zenith_sim, azimuth_sim):
 if __name__ == '__main__':
 
     #print('Nb of paras=',len(sys.argv))
-    if ((str(sys.argv[2])=="manual") & (len(sys.argv)<5)) or ((str(sys.argv[2])=="txt") & (len(sys.argv)<3)):
+    if ((str(sys.argv[2])=="manual") & (len(sys.argv)<5)) or ((str(sys.argv[2])=="txt") & (len(sys.argv)<3)) \
+        or ((str(sys.argv[2])=="dir") & (len(sys.argv) not in (3,4,6))):
         print("""
 	Wrong minimum number of arguments. All angles are to be expressed in degrees and in GRAND convention.
         Usage:
@@ -606,6 +1469,11 @@ if __name__ == '__main__':
         if manual input (Single antenna):
             python computevoltage.py [path to traces] [input_option] [zenith] [azimuth] [opt: alpha,beta] [opt: antenna ID]]
             example: python computeVoltage.py ./  manual 85 205 10 5
+        if whole event folder or tree of folders (all a*.trace files, process pool, output voltage.npz per folder):
+            python computevoltage.py [path to folder(s)] dir [opt: nb of processes] [opt: zenith] [opt: azimuth]
+            example: python computevoltage.py ./events dir 8
+            (shower direction from the inp file of each folder if not given,
+             antenna slopes and types from the ARRAY file of the config file if it exists)
             
         """)
 	
@@ -622,6 +1490,19 @@ if __name__ == '__main__':
     opt_input = str(sys.argv[2])
     print("opt_input = ",opt_input)
 
+    if opt_input=='dir':
+        processes = int(sys.argv[3]) if len(sys.argv)>3 else None
+        zenith_sim = float(sys.argv[4]) if len(sys.argv)>4 else None #deg
+        azimuth_sim = float(sys.argv[5]) if len(sys.argv)>5 else None #deg
+        arrayfile = radio_simus.config.arrayfile
+        detector = arrayfile if arrayfile is not None and os.path.isfile(arrayfile) else None
+        print("VOLTAGE COMPUTATION STARTED")
+        timing = compute_tree(path, zenith_sim, azimuth_sim, processes=processes, detector=detector)
+        for folder in timing:
+            print(folder, ' '.join('%s: %.2fs' % item for item in timing[folder].items()))
+        print("VOLTAGE COMPUTED")
+        sys.exit(0)
+
     if opt_input=='txt':
         import in_out
         # Read the ZHAireS input (.inp) file to extract the primary type, the energy, the injection height and the direction
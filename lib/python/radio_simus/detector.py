@@ -266,6 +266,7 @@ class Detector:
         ant_array = np.loadtxt(array_file,  comments="#")
         self.ID = ant_array[:, 0].tolist()
         self.position = ant_array[:, 1:4].tolist()
+        types = []
         for i in range(0,len(ant_array.T[0])):
             try:
                 self.slope = ant_array[i, 4:6].tolist()
@@ -273,10 +274,11 @@ class Detector:
                 logger.debug("slope needs to be caluclated")
                 self.slope = (0,0)
             try:
-                self.type = str(ant_array[i,6])
+                types.append(str(ant_array[i,6]))
             except: #add exception
                 logger.debug("Type needs to be defined")
-                self.type = "HorizonAntenna" # default type
+                types.append("HorizonAntenna") # default type
+        self.type = types # one entry per antenna, used to pick the antenna model in computevoltage
  
  
  
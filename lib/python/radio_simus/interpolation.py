@@ -5,7 +5,7 @@ TODO: use magnetic field values and shower core from config-file
 
 import numpy as np
 from scipy import signal
-from utils import getn
+from utils import getn, unwrap, PolarIndex
 import operator
 
 from os.path import split
@@ -49,37 +49,6 @@ from __init__ import phigeo, thetageo
 # return f
 ####################################
 
-def unwrap(phi, ontrue=None):
-    """Unwrap the phase to a strictly decreasing function.
-
-    Parameters:
-    ----------
-        phi: numpy array, float
-            phase of the signal trace
-        ontrue: str
-            printing option, default=None
-    Returns:
-    ----------
-        phi_unwrapped: numpy array, float
-            unwarpped phase of the signal trace
-    """
-
-    phi_unwrapped = np.zeros(phi.shape)
-    p0 = phi_unwrapped[0] = phi[0]
-    pi2 = 2. * np.pi
-    l = 0
-    for i0, p1 in enumerate(phi[1:]):
-        i = i0 + 1
-        if p1 >= p0:
-            l += np.floor_divide(p1 - p0, pi2) + 1
-        phi_unwrapped[i] = p1 - l * pi2
-        p0 = p1
-        if ontrue is not None:
-            print(i, phi[i], phi[i-1], l, phi_unwrapped[i], abs(phi[i] - phi[i-1]),
-                  abs(phi[i] - phi[i-1] + np.pi), abs(phi[i] - phi[i-1] - np.pi), l)
-    return phi_unwrapped
-
-
 def interpolate_trace(t1, trace1, x1, t2, trace2, x2, xdes, upsampling=None,  zeroadding=None, ontrue=None, flow=60.e6, fhigh=200.e6):
     """Interpolation of signal traces at the specific position in the frequency domain
     
@@ -527,79 +496,33 @@ def do_interpolation(desired, array, zenith, azimuth, phigeo=phigeo, thetageo=th
 
       
 
-    # calculate radius and angle for simulated positions and store some in list
-    points=[]
-    for i in np.arange(0,len(pos_sims[:,1])):  # position should be within one plane yz plane, remove x=v component for simplicity
-        #points.append([i, pos_sims[i,1], pos_sims[i,2] ])
-        theta2 = np.arctan2(pos_sims[i,2], pos_sims[i,1])
-        radius2 = np.sqrt( pos_sims[i,1]**2 + pos_sims[i,2]**2 )
-        if round(theta2,4) == -3.1416:
-            theta2*=-1
-        points.append([i, theta2, radius2])
-        
+    # closest simulated positions in the 4 quadrants (delta_phi, delta_r) of all desired positions,
+    # sorted by distance, delta_phi, delta_r -- not optimal (the best) solution for all, but brings stable/acceptable results
+    neighbours = PolarIndex(pos_sims).quadrant_neighbours(pos)
 
     #loop only over desired in-plane positions, acting as new reference 
     for i in np.arange(0,len(pos[:,1])):  # position should be within one plane yz plane, remove x=v component for simplicity
 
-        theta = np.arctan2(pos[i,2], pos[i,1])
-        radius = np.sqrt( pos[i,1]**2 + pos[i,2]**2 )
-        #print("index of desired antenna ", ind[i], theta, radius, )
-        
-        
         # The 4 quadrants -- in allen 4 Ecken soll Liebe drin stecken
-        points_I=[]
-        points_II=[]
-        points_III=[]
-        points_IV=[]
-        
-        for m in np.arange(0,len(points)): # desired points as reference
-            delta_phi = points[m][1]-theta
-            if delta_phi > np.pi:
-                delta_phi = delta_phi -2.*np.pi
-            delta_r = points[m][2]-radius
-            
-            #distance = np.sqrt(delta_r**2 + (delta_r *delta_phi)**2 ) # weighting approach1
-            #distance= np.sqrt((pos_sims[m,1]-pos[i,1])**2. +(pos_sims[m,2]-pos[i,2])**2.) # euclidean distance
-            distance= np.sqrt(points[m][2]**2. +radius**2. -2.*points[m][2]*radius* np.cos(points[m][1]-theta) ) #polar coordinates
-            
-            if delta_phi >= 0. and  delta_r >= 0:
-                points_I.append((m,abs(round(delta_phi,2)),abs(round(delta_r,2)), distance))
-            if delta_phi > 0. and  delta_r < 0:
-                points_II.append((m,abs(round(delta_phi,2)),abs(round(delta_r,2)), distance))
-            if delta_phi <= 0. and  delta_r <= 0:
-                points_III.append((m,abs(round(delta_phi,2)),abs(round(delta_r,2)), distance))
-            if delta_phi < 0. and  delta_r > 0:
-                points_IV.append((m,abs(round(delta_phi,2)),abs(round(delta_r,2)), distance))
-        
+        #indizes of 4 closest neigbours: point_I, point_II, point_III, point_IV
+        point_I, point_II, point_III, point_IV = neighbours[i]
     
-        if not points_I:
+        if point_I < 0:
             print("list - Quadrant 1 - empty --> no interpolation for ant", str(ind[i]))
             continue
-        if not points_II:
+        if point_II < 0:
             print("list - Quadrant 2 - empty --> no interpolation for desired ant", str(ind[i]))  
             continue
-        if not points_III:
+        if point_III < 0:
             print("list - Quadrant 3 - empty --> no interpolation for ant", str(ind[i]))   
             continue
-        if not points_IV:
+        if point_IV < 0:
             print("list - Quadrant 4 - empty --> no interpolation for ant", str(ind[i]))
             continue
-
-        points_I=np.array(points_I, dtype = [('index', 'i4'), ('delta_phi', 'f4'), ('delta_r', 'f4'), ('distance', 'f4')])
-        points_II=np.array(points_II, dtype = [('index', 'i4'), ('delta_phi', 'f4'), ('delta_r', 'f4'), ('distance', 'f4')])
-        points_III=np.array(points_III, dtype = [('index', 'i4'), ('delta_phi', 'f4'), ('delta_r', 'f4'), ('distance', 'f4')])
-        points_IV=np.array(points_IV, dtype = [('index', 'i4'), ('delta_phi', 'f4'), ('delta_r', 'f4'), ('distance', 'f4')])
-
-        ## Sort points; not optimal (the best) solution for all, but brings stable/acceptable results
-        points_I = np.sort(points_I, order=['distance', 'delta_phi', 'delta_r'])    
-        points_II = np.sort(points_II, order=['distance', 'delta_phi', 'delta_r']) 
-        points_III = np.sort(points_III, order=[ 'distance','delta_phi', 'delta_r']) 
-        points_IV = np.sort(points_IV, order=['distance', 'delta_phi', 'delta_r']) 
-        #indizes of 4 closest neigbours: points_I[0][0], points_II[0][0], points_III[0][0], points_IV[0][0]
         
         # try to combine the one with roughly the same radius first and then the ones in phi
-        point_online1=_ProjectPointOnLine(pos_sims[points_I[0][0]], pos_sims[points_IV[0][0]], pos[i])# Project Point on line 1 - I-IV
-        point_online2=_ProjectPointOnLine(pos_sims[points_II[0][0]], pos_sims[points_III[0][0]], pos[i])# Project Point on line 2 - II-III
+        point_online1=_ProjectPointOnLine(pos_sims[point_I], pos_sims[point_IV], pos[i])# Project Point on line 1 - I-IV
+        point_online2=_ProjectPointOnLine(pos_sims[point_II], pos_sims[point_III], pos[i])# Project Point on line 2 - II-III
 
         # ------------------
         if DISPLAY:
@@ -612,10 +535,10 @@ def do_interpolation(desired, array, zenith, azimuth, phigeo=phigeo, thetageo=th
             ## x component should be 0
             ax3.scatter(pos_sims[:,1], pos_sims[:,2], label = "simulated")
             ax3.scatter(pos[i,1], pos[i,2], label = "desired")
-            ax3.scatter(pos_sims[points_I[0][0],1], pos_sims[points_I[0][0],2], label = "1")
-            ax3.scatter(pos_sims[points_II[0][0],1], pos_sims[points_II[0][0],2], label = "2")
-            ax3.scatter(pos_sims[points_III[0][0],1], pos_sims[points_III[0][0],2], label = "3")
-            ax3.scatter(pos_sims[points_IV[0][0],1], pos_sims[points_IV[0][0],2], label = "4")
+            ax3.scatter(pos_sims[point_I,1], pos_sims[point_I,2], label = "1")
+            ax3.scatter(pos_sims[point_II,1], pos_sims[point_II,2], label = "2")
+            ax3.scatter(pos_sims[point_III,1], pos_sims[point_III,2], label = "3")
+            ax3.scatter(pos_sims[point_IV,1], pos_sims[point_IV,2], label = "4")
             
             ax3.scatter(point_online1[1], point_online1[2], marker ="x")
             ax3.scatter(point_online2[1], point_online2[2], marker ="x")            
@@ -635,17 +558,17 @@ def do_interpolation(desired, array, zenith, azimuth, phigeo=phigeo, thetageo=th
         directory=split(array)[0]+"/"
         print("Read traces from ", directory)
         
-        txt0 = load_trace(directory, points_I[0][0], suffix=".trace")
-        txt1 = load_trace(directory, points_IV[0][0], suffix=".trace")
-        xnew1, tracedes1x = interpolate_trace(txt0.T[0], txt0.T[1], positions_sims[points_I[0][0]] , txt1.T[0], txt1.T[1], positions_sims[points_IV[0][0]], point_online1 ,upsampling=None, zeroadding=None) 
-        xnew1, tracedes1y = interpolate_trace(txt0.T[0], txt0.T[2], positions_sims[points_I[0][0]] , txt1.T[0], txt1.T[2], positions_sims[points_IV[0][0]], point_online1 ,upsampling=None, zeroadding=None) 
-        xnew1, tracedes1z = interpolate_trace(txt0.T[0], txt0.T[3], positions_sims[points_I[0][0]] , txt1.T[0], txt1.T[3], positions_sims[points_IV[0][0]], point_online1 ,upsampling=None, zeroadding=None) 
+        txt0 = load_trace(directory, point_I, suffix=".trace")
+        txt1 = load_trace(directory, point_IV, suffix=".trace")
+        xnew1, tracedes1x = interpolate_trace(txt0.T[0], txt0.T[1], positions_sims[point_I] , txt1.T[0], txt1.T[1], positions_sims[point_IV], point_online1 ,upsampling=None, zeroadding=None) 
+        xnew1, tracedes1y = interpolate_trace(txt0.T[0], txt0.T[2], positions_sims[point_I] , txt1.T[0], txt1.T[2], positions_sims[point_IV], point_online1 ,upsampling=None, zeroadding=None) 
+        xnew1, tracedes1z = interpolate_trace(txt0.T[0], txt0.T[3], positions_sims[point_I] , txt1.T[0], txt1.T[3], positions_sims[point_IV], point_online1 ,upsampling=None, zeroadding=None) 
         
-        txt2 = load_trace(directory, points_II[0][0], suffix=".trace")
-        txt3 = load_trace(directory, points_III[0][0], suffix=".trace")
-        xnew2, tracedes2x = interpolate_trace(txt2.T[0], txt2.T[1], positions_sims[points_II[0][0]] , txt3.T[0], txt3.T[1], positions_sims[points_III[0][0]], point_online2 ,upsampling=None, zeroadding=None) 
-        xnew2, tracedes2y = interpolate_trace(txt2.T[0], txt2.T[2], positions_sims[points_II[0][0]] , txt3.T[0], txt3.T[2], positions_sims[points_III[0][0]], point_online2 ,upsampling=None, zeroadding=None) 
-        xnew2, tracedes2z = interpolate_trace(txt2.T[0], txt2.T[3], positions_sims[points_II[0][0]] , txt3.T[0], txt3.T[3], positions_sims[points_III[0][0]], point_online2 ,upsampling=None, zeroadding=None)         
+        txt2 = load_trace(directory, point_II, suffix=".trace")
+        txt3 = load_trace(directory, point_III, suffix=".trace")
+        xnew2, tracedes2x = interpolate_trace(txt2.T[0], txt2.T[1], positions_sims[point_II] , txt3.T[0], txt3.T[1], positions_sims[point_III], point_online2 ,upsampling=None, zeroadding=None) 
+        xnew2, tracedes2y = interpolate_trace(txt2.T[0], txt2.T[2], positions_sims[point_II] , txt3.T[0], txt3.T[2], positions_sims[point_III], point_online2 ,upsampling=None, zeroadding=None) 
+        xnew2, tracedes2z = interpolate_trace(txt2.T[0], txt2.T[3], positions_sims[point_II] , txt3.T[0], txt3.T[3], positions_sims[point_III], point_online2 ,upsampling=None, zeroadding=None)         
         
         ###### Get the pulse shape of the desired position from projection on line1 and 2
         xnew_desiredx, tracedes_desiredx =interpolate_trace(xnew1, tracedes1x, point_online1, xnew2, tracedes2x, point_online2, positions[ind[i]], zeroadding=None)      
@@ -663,9 +586,7 @@ def do_interpolation(desired, array, zenith, azimuth, phigeo=phigeo, thetageo=th
                 print("%3.2f %1.5e %1.5e %1.5e" % (
                     xnew_desiredx[i], tracedes_desiredx[i], tracedes_desiredy[i], tracedes_desiredz[i]), end='\n', file=FILE)
         FILE.close()
-        
-        #delete after iterate
-        del points_I, points_II, points_III, points_IV
+
 #-------------------------------------------------------------------
 
 
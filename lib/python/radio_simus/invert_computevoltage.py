@@ -0,0 +1,180 @@
+'''
+    reconstruction of the electric field from the voltages of the three arms (deconvolution of the
+    antenna response), inverse of computevoltage
+
+    For each frequency the voltages of the three arms are V = Ht*E_theta + Hp*E_phi, with the transfer
+    functions of computevoltage. E_theta and E_phi are the regularized (Wiener) least-squares solution
+    of these three equations, the radial component of the field is set to zero.
+
+    The regularization is left to the user: it sets the weight of the noise against the signal at the
+    frequencies where the response is weak and depends on the noise level of the traces.
+'''
+
+import numpy as np
+
+import logging
+logger = logging.getLogger("InvertComputeVoltage")
+
+from scipy.fft import rfft, irfft, next_fast_len
+
+from radio_simus import computevoltage
+from radio_simus.computevoltage import _antenna_directions, _model_groups, _transfer_function
+
+
+#===========================================================================================================
+def _compute_electricfields(time, voltage, zenith_sim, azimuth_sim, alpha, beta, regularization=1e-3,
+                            interpolation="nearest", workers=None, types=None):
+#===========================================================================================================
+    ''' Batched deconvolution, see compute_electricfield_batch
+
+    Returns:
+    --------
+    time: numpy array
+        (N, T) time in ns
+    efield: numpy array
+        (N, T, 3) electric field Ex, Ey, Ez in muV/m
+    below: numpy array
+        (N) True for antennas seeing the signal below the horizon
+    '''
+    voltage = np.asarray(voltage, dtype=float)
+    nant, ntime = voltage.shape[:2]
+    time = np.broadcast_to(np.asarray(time, dtype=float), (nant, ntime))
+    alpha = np.broadcast_to(np.asarray(alpha, dtype=float), (nant,))
+    beta = np.broadcast_to(np.asarray(beta, dtype=float), (nant,))
+    workers = computevoltage.fft_workers if workers is None else workers
+
+    zen, azim, rot = _antenna_directions(zenith_sim, azimuth_sim, alpha, beta)
+    below = (zen > 90) if computevoltage.freespace == 0 else np.zeros(nant, dtype=bool)
+    zen = np.where(below, 90., zen)
+
+    delt = np.mean(np.diff(time[0]))*1e-9 # ns -> s
+    Fs = round(1/delt)
+    nf = next_fast_len(ntime, real=True)
+    V = rfft(voltage, nf, axis=1, workers=workers) # (N, F, 3)
+
+    # normal equations of the (3 arms x 2 polarisations) system per antenna and frequency,
+    # antennas grouped by antenna model
+    Ht = np.zeros((nant, nf//2 + 1, 3), dtype=complex)
+    Hp = np.zeros_like(Ht)
+    for model, sel in _model_groups(types, nant):
+        for i, typ in enumerate("XYZ"):
+            Ht[sel, :, i], Hp[sel, :, i] = _transfer_function(model[typ], zen[sel], azim[sel], nf, Fs,
+                                                              interpolation)
+    a = np.sum(np.abs(Ht)**2, axis=-1)
+    d = np.sum(np.abs(Hp)**2, axis=-1)
+    b = np.sum(np.conj(Ht)*Hp, axis=-1)
+    ut = np.sum(np.conj(Ht)*V, axis=-1)
+    up = np.sum(np.conj(Hp)*V, axis=-1)
+
+    # Wiener regularization, relative to the largest response of each antenna
+    lam = regularization*np.max(a + d, axis=-1, keepdims=True)/2.
+    a, d = a + lam, d + lam
+    det = a*d - np.abs(b)**2
+    det[det == 0.] = np.inf # no response at all: zero field
+    At = (d*ut - b*up)/det
+    Cp = (a*up - np.conj(b)*ut)/det
+    etheta = irfft(At, nf, axis=-1, workers=workers)[:, :ntime]
+    ephi = irfft(Cp, nf, axis=-1, workers=workers)[:, :ntime]
+
+    # back from theta, phi to the antenna frame and to the topography frame
+    szen, czen = np.sin(np.deg2rad(zen))[:, None], np.cos(np.deg2rad(zen))[:, None]
+    saz, caz = np.sin(np.deg2rad(azim))[:, None], np.cos(np.deg2rad(azim))[:, None]
+    Ep = np.stack([czen*caz*etheta - saz*ephi, czen*saz*etheta + caz*ephi, -szen*etheta], axis=-1)
+    efield = np.einsum("nji,ntj->nti", rot, Ep)
+    efield[below] = 0.
+    return np.array(time), efield, below
+
+
+#===========================================================================================================
+def compute_electricfield_batch(time, voltage, zenith_sim, azimuth_sim, alpha=0., beta=0., regularization=1e-3,
+                                interpolation="nearest", workers=None, types=None):
+#===========================================================================================================
+    '''
+    reconstructs the electric field of many antennas at once from the voltages of the three arms
+
+    All antennas are solved together, one stacked FFT and one batched 2x2 solve per frequency.
+    The transfer functions are the ones of computevoltage and share its cache.
+    All traces must have the same length and sampling.
+
+    Arguments:
+    ----------
+    time: numpy array
+        (T) or (N, T) time in ns
+    voltage: numpy array
+        (N, T, 3) voltages Vx, Vy, Vz in muV
+    zenith_sim: float
+        zenith of shower in deg (GRAND)
+    azimuth_sim: float
+        azimuth of shower in deg (GRAND)
+    alpha, beta: float or numpy array
+        optional, (N) antenna angles in deg
+    regularization: float
+        optional, Wiener regularization relative to the peak response of the antenna, default 1e-3,
+        to be chosen from the noise level of the traces
+    interpolation: str
+        optional, "nearest" table azimuth (default, as get_voltage) or "bilinear" in zenith and azimuth
+    workers: int
+        optional, number of threads for the FFTs, default: computevoltage.fft_workers
+    types: str or numpy array
+        optional, (N) antenna types (Detector.type), each antenna is inverted with the response of its model,
+        default: default_model for all
+
+    Returns:
+    --------
+    time: numpy array
+        (N, T) time in ns
+    efield: numpy array
+        (N, T, 3) electric field Ex, Ey, Ez in muV/m, zero for antennas seeing the signal below the horizon
+
+    Note: only the frequencies covered by the antenna response are reconstructed
+    '''
+    time, efield, below = _compute_electricfields(time, voltage, zenith_sim, azimuth_sim, alpha, beta,
+                                                  regularization, interpolation, workers, types)
+    if np.any(below):
+        logger.info('Signal originates below antenna horizon for antennas '+str(np.flatnonzero(below))
+                    +'! No electric field reconstructed.')
+    return time, efield
+
+
+#===========================================================================================================
+def compute_electricfield(trace, zenith_sim, azimuth_sim, alpha=0., beta=0., regularization=1e-3,
+                          interpolation="nearest", model=None):
+#===========================================================================================================
+    '''
+    reconstructs the electric field of one antenna from the voltages of the three arms
+
+    Parameters
+    -----------
+    trace: numpy array
+        voltage traces, Time in ns, Vx,Vy,Vz in muV
+    zenith_sim: float
+        zenith of shower in deg (GRAND)
+    azimuth_sim: float
+        azimuth of shower in deg (GRAND)
+    alpha, beta: float
+        antenna angles, optional, in deg
+    regularization: float
+        optional, Wiener regularization relative to the peak response of the antenna, default 1e-3,
+        to be chosen from the noise level of the traces
+    interpolation: str
+        optional, "nearest" table azimuth (default) or "bilinear" in zenith and azimuth
+    model: str
+        optional, antenna type, default: default_model
+
+    Returns
+    ---------
+    numpy array
+        electric field trace time/ns, Ex, Ey,Ez in muV/m
+
+    Raises
+    ---------
+    ValueError:
+        signal originates below antenna horizon
+    '''
+    trace = np.asarray(trace)
+    time, efield, below = _compute_electricfields(trace.T[0], trace[None, :, 1:4], zenith_sim, azimuth_sim,
+                                                  alpha, beta, regularization, interpolation, types=model)
+    if below[0]:
+        logger.info('Signal originates below antenna horizon! No electric field reconstructed. Abort.')
+        raise ValueError('Signal originates below antenna horizon! No electric field reconstructed.')
+    return np.column_stack([time[0], efield[0]])
@@ -0,0 +1,437 @@
+'''
+    stationary noise (galactic and ground) for batches of voltage traces
+
+    Every antenna draws from its own numpy.random.Generator, seeded by (seed, event, antenna ID) through
+    numpy.random.SeedSequence: the noise of an antenna does not depend on the other antennas of the batch,
+    on the order of processing or on the number of processes.
+
+    The noise is coloured by the spectrum of the config file (NOISESPECTRUM: frequency in MHz, amplitude
+    spectral density in relative units) if there is one, else white. Another spectrum can be given as
+    function of the frequency in Hz or as a table, spectrum="white" forces white noise. The rms of the
+    traces is vrms in all cases.
+
+    For large productions, build_noise_bank writes one long, band-pass filtered noise stream to disk once;
+    NoiseBank maps it read-only into memory and cuts random windows from it, no filtering per trace.
+'''
+
+import os
+import json
+import shutil
+import tempfile
+from functools import lru_cache
+from os.path import join, isdir, split
+
+import numpy as np
+
+import logging
+logger = logging.getLogger("Noise")
+
+from scipy.fft import rfft, irfft, rfftfreq
+from scipy.signal import sosfilt
+
+# load config file first
+import radio_simus
+#assuming units: muV , ns
+Vrms2 = radio_simus.config.Vrms2.value
+
+__all__ = ["noise_rng", "load_noise_spectrum", "noise_spectrum", "generate_noise", "noise_stream", "add_noise_batch",
+           "build_noise_bank", "NoiseBank"]
+
+
+#===========================================================================================================
+def noise_rng(seed, event, antenna, stream=0):
+#===========================================================================================================
+    ''' Random generator of one antenna
+
+    Arguments:
+    ----------
+    seed: int
+        seed of the simulation
+    event: int
+        event number
+    antenna: int
+        antenna ID
+    stream: int
+        optional, use of the draws: 0 noise samples, 1 windows of a noise bank
+
+    Returns:
+    --------
+    numpy.random.Generator
+        independent stream for (seed, event, antenna, stream)
+    '''
+    entropy = [int(seed), int(event), int(antenna)]
+    if stream:
+        entropy.append(int(stream))
+    return np.random.Generator(np.random.PCG64(np.random.SeedSequence(entropy)))
+
+
+#===========================================================================================================
+def load_noise_spectrum(path):
+#===========================================================================================================
+    ''' Read a noise spectrum table
+
+    Arguments:
+    ----------
+    path: str
+        text file, columns: frequency in MHz, amplitude spectral density (relative units)
+
+    Returns:
+    --------
+    freq: numpy array
+        frequencies in Hz
+    amplitude: numpy array
+        amplitude spectral density
+    '''
+    table = np.loadtxt(path, ndmin=2)
+    if table.shape[1] < 2 or len(table) < 2:
+        raise ValueError("Noise spectrum needs two columns and two frequencies at least: " + str(path))
+    return table[:, 0]*1e6, table[:, 1] # MHz -> Hz
+
+
+@lru_cache(maxsize=4)
+def _cached_noise_spectrum(path):
+    freq, amplitude = load_noise_spectrum(path)
+    freq.flags.writeable = False # shared by all calls
+    amplitude.flags.writeable = False
+    return freq, amplitude
+
+
+#===========================================================================================================
+def noise_spectrum():
+#===========================================================================================================
+    ''' Noise spectrum of the config file (NOISESPECTRUM), read once
+
+    Returns:
+    --------
+    tuple
+        (freq in Hz, amplitude), see load_noise_spectrum, None if the config file has no spectrum
+    '''
+    if radio_simus.config.noisespectrum is None:
+        return None
+    return _cached_noise_spectrum(radio_simus.config.noisespectrum)
+
+
+#===========================================================================================================
+def _resolve_spectrum(spectrum):
+#===========================================================================================================
+    ''' Spectrum to shape the noise with, None for white noise
+    '''
+    if spectrum is None:
+        return noise_spectrum()
+    if isinstance(spectrum, str):
+        if spectrum != "white":
+            raise ValueError("Unknown noise spectrum: " + spectrum)
+        return None
+    return spectrum
+
+
+#===========================================================================================================
+def _shaping(spectrum, nf, Fs):
+#===========================================================================================================
+    ''' Amplitude per rfft bin, normalized so that white noise keeps its rms
+    '''
+    freq = rfftfreq(nf)*Fs
+    if callable(spectrum):
+        shape = np.broadcast_to(np.asarray(spectrum(freq), dtype=float), freq.shape)
+    else:
+        fspec, aspec = spectrum
+        shape = np.interp(freq, fspec, aspec, left=0., right=0.)
+    # variance of irfft(rfft(w)*shape) for unit white noise w, DC and Nyquist bins count once
+    weight = np.full(len(freq), 2.)
+    weight[0] = 1.
+    if nf % 2 == 0:
+        weight[-1] = 1.
+    power = np.sum(weight*shape**2)/nf
+    if power == 0.:
+        raise ValueError("Noise spectrum vanishes in the band of the traces")
+    return shape/np.sqrt(power)
+
+
+#===========================================================================================================
+def generate_noise(nant, ntime, tstep=1., vrms=Vrms2, seed=0, event=0, antennas=None, spectrum=None):
+#===========================================================================================================
+    ''' Noise traces of a batch of antennas
+
+    Arguments:
+    ----------
+    nant: int
+        number of antennas
+    ntime: int
+        number of time bins
+    tstep: float
+        optional, time binning in ns
+    vrms: float
+        optional, rms of the noise in muV, default VRMS2 of the config file
+    seed, event: int
+        optional, seed of the simulation and event number
+    antennas: numpy array
+        optional, (N) antenna IDs, default: 0..N-1
+    spectrum: callable, tuple or str
+        optional, amplitude spectral density as function of the frequency in Hz or (freq in Hz, amplitude),
+        "white" for white noise, default: noise_spectrum() (white if the config file has none)
+
+    Returns:
+    --------
+    numpy array
+        (N, T, 3) noise in muV
+    '''
+    antennas = np.arange(nant) if antennas is None else np.asarray(antennas)
+    if len(antennas) != nant:
+        raise ValueError("One antenna ID per antenna needed")
+    noise = np.empty((nant, ntime, 3))
+    for i, antenna in enumerate(antennas):
+        noise[i] = noise_rng(seed, event, antenna).normal(0., vrms, size=(ntime, 3))
+    spectrum = _resolve_spectrum(spectrum)
+    if spectrum is None:
+        return noise
+
+    # coloured: white noise shaped in the frequency domain (circular, the noise stays stationary)
+    shape = _shaping(spectrum, ntime, 1e9/tstep) # ns -> Hz
+    return irfft(rfft(noise, axis=1)*shape[:, None], ntime, axis=1)
+
+
+#===========================================================================================================
+def noise_stream(nant, nsamples, blocksize=2**16, vrms=Vrms2, seed=0, event=0, antennas=None):
+#===========================================================================================================
+    ''' White noise of a batch of antennas, block by block, for long continuous streams
+
+    The blocks are drawn from the same random streams as generate_noise: concatenated, they are
+    identical to generate_noise(nant, nsamples, ..., spectrum="white"). Memory is bounded by one block.
+    The noise stays white whatever the config file: a spectrum needs the whole trace.
+
+    Arguments:
+    ----------
+    nant: int
+        number of antennas
+    nsamples: int
+        length of the stream in time bins
+    blocksize: int
+        optional, time bins per block
+    vrms, seed, event, antennas:
+        optional, see generate_noise
+
+    Yields:
+    --------
+    numpy array
+        (N, L, 3) noise in muV, L = blocksize (the last block may be shorter)
+    '''
+    antennas = np.arange(nant) if antennas is None else np.asarray(antennas)
+    if len(antennas) != nant:
+        raise ValueError("One antenna ID per antenna needed")
+    rngs = [noise_rng(seed, event, antenna) for antenna in antennas]
+    for start in range(0, nsamples, blocksize):
+        length = min(blocksize, nsamples - start)
+        noise = np.empty((nant, length, 3))
+        for i, rng in enumerate(rngs):
+            noise[i] = rng.normal(0., vrms, size=(length, 3))
+        yield noise
+
+
+#===========================================================================================================
+def add_noise_batch(voltages, tstep=1., vrms=Vrms2, seed=0, event=0, antennas=None, spectrum=None):
+#===========================================================================================================
+    ''' Add noise to the voltages of a batch of antennas, see generate_noise
+
+    Arguments:
+    ----------
+    voltages: numpy array
+        (N, T, 3) voltages in muV
+
+    Returns:
+    --------
+    numpy array
+        (N, T, 3) noisy voltages in muV, the input is not modified
+    '''
+    voltages = np.asarray(voltages, dtype=float)
+    nant, ntime = voltages.shape[:2]
+    return voltages + generate_noise(nant, ntime, tstep, vrms, seed, event, antennas, spectrum)
+
+
+#===========================================================================================================
+def build_noise_bank(path, nsamples, tstep=1., vrms=Vrms2, FREQMIN=50.e6, FREQMAX=200.e6, seed=0,
+                     dtype=np.float32, blocksize=2**20):
+#===========================================================================================================
+    ''' Writes a bank of filtered noise (done once)
+
+    The noise is one continuous stream: white noise of rms vrms (as add_noise) through the Butterworth
+    band-pass of signal_processing.filters, filtered block by block with the filter state carried over.
+
+    Arguments:
+    ----------
+    path: str
+        folder of the bank
+    nsamples: int
+        length of the stream in time bins
+    tstep: float
+        optional, time binning in ns
+    vrms: float
+        optional, rms of the noise before filtering in muV, default VRMS2 of the config file
+    FREQMIN, FREQMAX: float
+        optional, band of the filter in Hz, FREQMIN=None: no filter
+    seed: int
+        optional, seed of the stream
+    dtype: numpy dtype
+        optional, type of the stored samples, default float32
+    blocksize: int
+        optional, time bins generated and filtered at once
+
+    Returns:
+    --------
+    str
+        path to the bank
+
+    Note: the bank is written to a temporary folder first and moved in place, an existing bank is
+          moved aside before and deleted after
+    '''
+    from radio_simus.signal_processing import butter_sos
+
+    rng = np.random.Generator(np.random.PCG64(np.random.SeedSequence([int(seed)]))) # not an (event, antenna) stream
+    sos = None
+    if FREQMIN is not None:
+        sos = np.array(butter_sos(float(1e9/tstep), float(FREQMIN), float(FREQMAX))) # ns -> Hz
+        zi = np.zeros((sos.shape[0], 2, 3))
+        # discard the start-up transient of the filter
+        warmup = int(np.ceil(20e9/(tstep*FREQMIN)))
+        zi = sosfilt(sos, rng.normal(0., vrms, size=(warmup, 3)), axis=0, zi=zi)[1]
+
+    parent = split(os.path.abspath(path))[0]
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=".tmp", dir=parent)
+    old = None
+    try:
+        bank = np.lib.format.open_memmap(join(tmp, "noise.npy"), mode="w+", dtype=dtype, shape=(nsamples, 3))
+        for start in range(0, nsamples, blocksize):
+            block = rng.normal(0., vrms, size=(min(blocksize, nsamples - start), 3))
+            if sos is not None:
+                block, zi = sosfilt(sos, block, axis=0, zi=zi)
+            bank[start:start+len(block)] = block
+        bank.flush()
+        rms = float(np.sqrt(np.mean(np.square(bank, dtype=float))))
+        del bank
+        with open(join(tmp, "meta.json"), "w") as f:
+            json.dump({"nsamples": int(nsamples), "tstep": float(tstep), "vrms": float(vrms), "rms": rms,
+                       "FREQMIN": FREQMIN, "FREQMAX": FREQMAX, "seed": int(seed)}, f)
+        if isdir(path):
+            # moved aside in one step, open banks never see a half deleted folder
+            old = tempfile.mkdtemp(prefix=".old", dir=parent)
+            os.replace(path, old)
+        os.replace(tmp, path)
+    except Exception:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    finally:
+        if old is not None:
+            shutil.rmtree(old, ignore_errors=True)
+    logger.info("Noise bank of " + str(nsamples) + " time bins written to " + str(path))
+    return path
+
+
+#===========================================================================================================
+class NoiseBank:
+#===========================================================================================================
+    ''' Random windows of a noise bank written by build_noise_bank
+
+        The bank is mapped read-only into memory on first use, processes share it.
+        The window of an antenna only depends on (seed, event, antenna ID), as generate_noise.
+
+        Usage:
+            bank = NoiseBank(path)
+            noisy = bank.inject(voltages, event=12, antennas=ids)
+
+    Arguments:
+    ----------
+    path: str
+        folder of the bank
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._noise = None
+        with open(join(path, "meta.json"), "r") as f:
+            self.meta = json.load(f)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.path!r}, {self.meta['nsamples']} time bins)"
+
+    def __getstate__(self):
+        # never pickle the mapped bank, workers re-open it themselves
+        state = self.__dict__.copy()
+        state["_noise"] = None
+        return state
+
+    def __len__(self):
+        return self.meta["nsamples"]
+
+    @property
+    def tstep(self):
+        """time binning in ns"""
+        return self.meta["tstep"]
+
+    @property
+    def noise(self):
+        """memory-mapped noise stream (nsamples, 3) in muV"""
+        if self._noise is None:
+            self._noise = np.load(join(self.path, "noise.npy"), mmap_mode="r")
+        return self._noise
+
+    def offsets(self, nant, ntime, seed=0, event=0, antennas=None):
+        ''' Start of the window of each antenna
+
+        Arguments:
+        ----------
+        nant, ntime: int
+            number of antennas and time bins
+        seed, event: int
+            optional, seed of the simulation and event number
+        antennas: numpy array
+            optional, (N) antenna IDs, default: 0..N-1
+
+        Returns:
+        --------
+        numpy array
+            (N) first time bin of the windows
+        '''
+        if ntime > len(self):
+            raise ValueError("Noise bank shorter than the traces")
+        antennas = np.arange(nant) if antennas is None else np.asarray(antennas)
+        if len(antennas) != nant:
+            raise ValueError("One antenna ID per antenna needed")
+        # own stream: the windows do not depend on the noise samples of generate_noise
+        return np.array([noise_rng(seed, event, antenna, stream=1).integers(0, len(self) - ntime + 1)
+                         for antenna in antennas], dtype=np.int64)
+
+    def sample(self, nant, ntime, seed=0, event=0, antennas=None):
+        ''' Noise windows of a batch of antennas, see offsets
+
+        Returns:
+        --------
+        numpy array
+            (N, T, 3) noise in muV
+        '''
+        offsets = self.offsets(nant, ntime, seed, event, antennas)
+        return self.noise[offsets[:, None] + np.arange(ntime)].astype(float) # one gather from the mapped stream
+
+    def inject(self, voltages, tstep=None, seed=0, event=0, antennas=None):
+        ''' Add noise windows to the voltages of a batch of antennas
+
+        Arguments:
+        ----------
+        voltages: numpy array
+            (N, T, 3) voltages in muV
+        tstep: float
+            optional, time binning of the voltages in ns, checked against the bank
+
+        Returns:
+        --------
+        numpy array
+            (N, T, 3) noisy voltages in muV, the input is not modified
+        '''
+        if tstep is not None and abs(tstep - self.tstep) > 1e-6*self.tstep:
+            raise ValueError("Time binning of the traces and of the noise bank differ")
+        voltages = np.asarray(voltages, dtype=float)
+        nant, ntime = voltages.shape[:2]
+        return voltages + self.sample(nant, ntime, seed, event, antennas)
+
+    def close(self):
+        ''' Unmaps the bank '''
+        self._noise = None
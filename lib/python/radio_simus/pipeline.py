@@ -0,0 +1,313 @@
+'''
+    composable processing chain for batches of traces, the batched counterpart of
+    signal_processing.standard_processing
+
+    A Pipeline runs a list of stages on (time, traces): time (N, T) in ns, traces (N, T, 3), the
+    electric field in muV/m before the response stage, voltages in muV after it. Event information
+    (zenith, azimuth, alpha, beta, types, event, antennas) is handed over as keywords of Pipeline.run
+    and seen by all stages. Each stage counts its calls, wall time and the bytes it processed.
+
+    Usage:
+        chain = standard_pipeline(('antennaresponse', 'noise', 'filter', 'digitise'))
+        time, voltage = chain.run(time, efield, zenith=135., azimuth=123., alpha=alpha, beta=beta, event=12)
+        print(chain.report())
+'''
+
+import numpy as np
+from abc import ABC, abstractmethod
+
+import logging
+logger = logging.getLogger("Pipeline")
+
+from timeit import default_timer as timer
+
+from radio_simus.signal_processing import filter_traces, digitize_traces, Vrms2, tsampling
+
+__all__ = ["Stage", "ResponseStage", "NoiseStage", "FilterStage", "DigitizeStage", "CustomStage", "Pipeline",
+           "standard_pipeline"]
+
+
+#===========================================================================================================
+class Stage(ABC):
+#===========================================================================================================
+    ''' Base class of the pipeline stages
+
+        Subclasses implement process(time, traces, meta), the abstract method, and return (time, traces).
+        __call__ runs process and updates the counters.
+
+    Arguments:
+    ----------
+    name: str
+        optional, name in the report, default: class name
+    '''
+
+    def __init__(self, name=None):
+        self.name = name or self.__class__.__name__
+        self.reset()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.name!r})"
+
+    def reset(self):
+        ''' Sets the counters to zero '''
+        self.calls = 0
+        self.seconds = 0.
+        self.nbytes = 0
+
+    def stats(self):
+        ''' dict of the counters: calls, wall time in s, bytes of input traces '''
+        return {"calls": self.calls, "seconds": self.seconds, "nbytes": self.nbytes}
+
+    @abstractmethod
+    def process(self, time, traces, meta):
+        ''' Runs the stage on (time, traces) with the event information meta (dict), returns (time, traces) '''
+
+    def __call__(self, time, traces, meta=None):
+        start = timer()
+        nbytes = np.asarray(traces).nbytes
+        time, traces = self.process(time, traces, {} if meta is None else meta)
+        self.seconds += timer() - start
+        self.calls += 1
+        self.nbytes += nbytes
+        return time, traces
+
+
+#===========================================================================================================
+class ResponseStage(Stage):
+#===========================================================================================================
+    ''' Antenna response, see computevoltage.compute_antennaresponse_batch
+
+        Uses zenith, azimuth (GRAND, deg) and optionally alpha, beta (deg), types of the event.
+
+    Arguments:
+    ----------
+    interpolation: str
+        optional, "nearest" table azimuth (default) or "bilinear"
+    workers: int
+        optional, number of threads for the FFTs
+    '''
+
+    def __init__(self, interpolation="nearest", workers=None, name=None):
+        super().__init__(name)
+        self.interpolation = interpolation
+        self.workers = workers
+
+    def process(self, time, traces, meta):
+        from radio_simus.computevoltage import compute_antennaresponse_batch
+        try:
+            zenith, azimuth = meta["zenith"], meta["azimuth"]
+        except KeyError:
+            raise ValueError("The response stage needs the zenith and azimuth of the shower")
+        return compute_antennaresponse_batch(time, traces, zenith, azimuth, meta.get("alpha", 0.),
+                                             meta.get("beta", 0.), self.interpolation, self.workers,
+                                             meta.get("types"))
+
+
+#===========================================================================================================
+class NoiseStage(Stage):
+#===========================================================================================================
+    ''' Stationary noise, generated (noise.add_noise_batch) or drawn from a noise bank (noise.NoiseBank)
+
+        Uses event and antennas (IDs) of the event for the random streams.
+
+    Arguments:
+    ----------
+    vrms: float
+        optional, rms of the noise in muV, default VRMS2 of the config file
+    seed: int
+        optional, seed of the simulation
+    spectrum: callable, tuple or str
+        optional, noise spectrum, default NOISESPECTRUM of the config file, "white" for white noise,
+        see noise.generate_noise
+    bank: noise.NoiseBank
+        optional, draw the noise from the bank instead
+    '''
+
+    def __init__(self, vrms=Vrms2, seed=0, spectrum=None, bank=None, name=None):
+        super().__init__(name)
+        self.vrms = vrms
+        self.seed = seed
+        self.spectrum = spectrum
+        self.bank = bank
+
+    def process(self, time, traces, meta):
+        from radio_simus import noise
+        tstep = np.mean(np.diff(time[0]))
+        event, antennas = meta.get("event", 0), meta.get("antennas")
+        if self.bank is not None:
+            return time, self.bank.inject(traces, tstep, self.seed, event, antennas)
+        return time, noise.add_noise_batch(traces, tstep, self.vrms, self.seed, event, antennas, self.spectrum)
+
+
+#===========================================================================================================
+class FilterStage(Stage):
+#===========================================================================================================
+    ''' Butterworth band-pass, see signal_processing.filter_traces
+
+    Arguments:
+    ----------
+    FREQMIN, FREQMAX: float
+        optional, band in Hz
+    order: int
+        optional, order of the filter
+    zerophase: bool
+        optional, filter forwards and backwards
+    '''
+
+    def __init__(self, FREQMIN=50.e6, FREQMAX=200.e6, order=5, zerophase=False, name=None):
+        super().__init__(name)
+        self.FREQMIN = FREQMIN
+        self.FREQMAX = FREQMAX
+        self.order = order
+        self.zerophase = zerophase
+
+    def process(self, time, traces, meta):
+        fs = round(1e9/np.mean(np.diff(time[0]))) # ns -> Hz
+        return time, filter_traces(traces, fs, self.FREQMIN, self.FREQMAX, self.order, axis=1,
+                                   zerophase=self.zerophase)
+
+
+#===========================================================================================================
+class DigitizeStage(Stage):
+#===========================================================================================================
+    ''' Anti-aliased decimation and optional quantization, see signal_processing.digitize_traces
+
+    Arguments:
+    ----------
+    TSAMPLING: float
+        optional, sampling in ns, default TSAMPLING of the config file
+    adc: signal_processing.ADC
+        optional, return integer counts
+    '''
+
+    def __init__(self, TSAMPLING=tsampling, adc=None, name=None):
+        super().__init__(name)
+        self.TSAMPLING = TSAMPLING
+        self.adc = adc
+
+    def process(self, time, traces, meta):
+        tstep = np.mean(np.diff(time[0]))
+        digitized = digitize_traces(traces, tstep, self.TSAMPLING, self.adc, axis=1)
+        ratio = int(round(self.TSAMPLING/tstep))
+        return time[:, ::ratio][:, :digitized.shape[1]], digitized
+
+
+#===========================================================================================================
+class CustomStage(Stage):
+#===========================================================================================================
+    ''' User defined stage
+
+    Arguments:
+    ----------
+    function: callable
+        function(time, traces, meta) -> (time, traces)
+    '''
+
+    def __init__(self, function, name=None):
+        super().__init__(name or getattr(function, "__name__", None))
+        self.function = function
+
+    def process(self, time, traces, meta):
+        return self.function(time, traces, meta)
+
+
+#===========================================================================================================
+class Pipeline:
+#===========================================================================================================
+    ''' Ordered list of stages
+
+    Arguments:
+    ----------
+    stages: list
+        stages, run in the given order
+    '''
+
+    def __init__(self, stages=()):
+        self.stages = list(stages)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.stages!r})"
+
+    def __len__(self):
+        return len(self.stages)
+
+    def __getitem__(self, index):
+        if isinstance(index, str):
+            for stage in self.stages:
+                if stage.name == index:
+                    return stage
+            raise KeyError(index)
+        return self.stages[index]
+
+    def append(self, stage):
+        self.stages.append(stage)
+        return self
+
+    def insert(self, index, stage):
+        self.stages.insert(index, stage)
+        return self
+
+    def run(self, time, traces, **meta):
+        ''' Runs all stages
+
+        Arguments:
+        ----------
+        time: numpy array
+            (T) or (N, T) time in ns
+        traces: numpy array
+            (N, T, 3) traces
+        meta:
+            event information for the stages: zenith, azimuth, alpha, beta, types, event, antennas
+
+        Returns:
+        --------
+        time: numpy array
+            (N, T') time in ns
+        traces: numpy array
+            (N, T', 3) processed traces
+        '''
+        traces = np.asarray(traces)
+        time = np.broadcast_to(np.asarray(time, dtype=float), traces.shape[:2])
+        for stage in self.stages:
+            time, traces = stage(time, traces, meta)
+        return time, traces
+
+    def reset(self):
+        ''' Sets the counters of all stages to zero '''
+        for stage in self.stages:
+            stage.reset()
+
+    def stats(self):
+        ''' dict of the counters of each stage, see Stage.stats '''
+        return {stage.name: stage.stats() for stage in self.stages}
+
+    def report(self):
+        ''' Counters of all stages as text '''
+        total = sum(stage.seconds for stage in self.stages) or 1.
+        lines = ["{:<16s} {:>8s} {:>10s} {:>6s} {:>10s}".format("stage", "calls", "time/s", "%", "MB")]
+        for stage in self.stages:
+            lines.append("{:<16s} {:>8d} {:>10.4f} {:>6.1f} {:>10.2f}".format(
+                stage.name, stage.calls, stage.seconds, 100.*stage.seconds/total, stage.nbytes/2.**20))
+        return "\n".join(lines)
+
+
+#===========================================================================================================
+def standard_pipeline(processing=('antennaresponse', 'noise', 'filter', 'digitise')):
+#===========================================================================================================
+    ''' Pipeline of the steps of standard_processing, in the same order
+
+    Arguments:
+    ----------
+    processing: list
+        choose the steps: 'antennaresponse', 'noise', 'filter', 'digitise'
+
+    Returns:
+    --------
+    Pipeline
+    '''
+    steps = [('antennaresponse', ResponseStage), ('noise', NoiseStage), ('filter', FilterStage),
+             ('digitise', DigitizeStage)]
+    unknown = set(processing) - {name for name, _ in steps}
+    if unknown:
+        raise ValueError("Unknown processing steps: " + ", ".join(sorted(unknown)))
+    return Pipeline([stage(name=name) for name, stage in steps if name in processing])
@@ -3,8 +3,9 @@
 ###       added a new didgitization function (other one didnt work for some reason)
 ###
 
+import functools
 import numpy as np
-from scipy.signal import butter, lfilter, resample
+from scipy.signal import butter, firwin, lfilter, resample, resample_poly, sosfilt, sosfiltfilt, sosfreqz, upfirdn
 from scipy.fftpack import rfft, irfft, rfftfreq
 
 import logging
@@ -20,7 +21,9 @@ Vrms2 = radio_simus.config.Vrms2.value
 tsampling = radio_simus.config.tsampling.value
 
 
-__all__ = ["include_shadowing", "add_noise", "Digitization_2", "filter", "_create_emptytrace", "run"]
+__all__ = ["include_shadowing", "add_noise", "Digitization_2", "digitize", "digitize_traces", "digitize_stream", "ADC",
+           "save_adc_traces", "load_adc_traces", "filter", "filters", "filter_traces", "filter_stream", "butter_sos",
+           "fused_processing", "_create_emptytrace", "run"]
 
 
 ###########################################################################
@@ -67,7 +70,8 @@ def digitization(voltages, tsampling=tsampling):
 #===========================================================================================================
 
 def Digitization_2(v,TSAMPLING=tsampling):
-    """Digitize the voltages at an specific sampling -- v2
+    """Digitize the voltages at an specific sampling -- v2, picks every ratio-th sample (no anti-alias filter,
+    see digitize)
     inputs : (voltages, sampling rate)
     outputs : digitized voltages (time in ns)
     """
@@ -93,12 +97,277 @@ def Digitization_2(v,TSAMPLING=tsampling):
 
 #===========================================================================================================
 
+class ADC:
+    """ Analog to digital converter: quantization of voltages to signed integer counts
+
+    bits: resolution, vrange: full-scale range (peak to peak) in muV, the counts cover
+    [-2**(bits-1), 2**(bits-1)-1], values outside saturate at the limits
+    """
+
+    def __init__(self, bits=14, vrange=1.e4):
+        if not 1 < bits <= 32:
+            raise ValueError("ADC resolution must be between 2 and 32 bits")
+        self.bits = int(bits)
+        self.vrange = float(vrange)
+
+    def __repr__(self):
+        return "ADC(bits={}, vrange={})".format(self.bits, self.vrange)
+
+    @property
+    def lsb(self):
+        """ voltage of one count in muV """
+        return self.vrange / 2**self.bits
+
+    @property
+    def limits(self):
+        """ smallest and largest count """
+        return -2**(self.bits - 1), 2**(self.bits - 1) - 1
+
+    @property
+    def dtype(self):
+        """ smallest integer type holding the counts, int16 up to 16 bits """
+        return np.int16 if self.bits <= 16 else np.int32
+
+    def quantize(self, voltages):
+        """ voltages in muV -> integer counts, saturated at the limits """
+        low, high = self.limits
+        counts = np.clip(np.rint(np.asarray(voltages) / self.lsb), low, high)
+        return counts.astype(self.dtype)
+
+    def saturated(self, counts):
+        """ mask of the samples at the limits """
+        return np.isin(counts, self.limits)
+
+    def to_voltage(self, counts):
+        """ integer counts -> voltages in muV """
+        return np.asarray(counts) * self.lsb
+
+#===========================================================================================================
+
+def digitize_traces(voltages, tstep, TSAMPLING=tsampling, adc=None, axis=-2):
+    """ Digitize many traces at once: anti-alias filter and decimation (polyphase), optional quantization
+    Parameters
+    ----------
+     : voltages
+        The array of voltages (muV), e.g. (N_ant, T, 3), time along axis
+     : tstep
+        The time step of the voltages (ns)
+     : TSAMPLING
+        The sampling of the digitizer (ns), a multiple of tstep
+     : adc
+        optional, ADC, returns integer counts instead of voltages
+     : axis
+        The time axis of voltages, default: second to last
+
+    Returns
+    -------
+      numpy array
+          digitized voltages (muV) or counts, int(T/ratio) samples along axis, sample k at the time of input k*ratio
+    """
+    ratio = int(round(TSAMPLING / tstep))
+    if ratio < 1 or abs(ratio * tstep - TSAMPLING) > 1e-6 * TSAMPLING:
+        raise ValueError("Sampling time not multiple of simulation time")
+    voltages = np.asarray(voltages, dtype=float)
+    nout = voltages.shape[axis] // ratio
+    if ratio > 1:
+        voltages = resample_poly(voltages, 1, ratio, axis=axis)
+    digitized = np.take(voltages, np.arange(nout), axis=axis)
+    if adc is not None:
+        return adc.quantize(digitized)
+    return digitized
+
+#===========================================================================================================
+
+def digitize_stream(blocks, tstep, TSAMPLING=tsampling, adc=None):
+    """ Streaming version of digitize_traces for continuous data, block by block
+    Parameters
+    ----------
+     : blocks
+        iterable of consecutive voltage blocks (muV), (N_ant, L, 3), time along axis 1, any lengths L
+     : tstep
+        The time step of the voltages (ns)
+     : TSAMPLING
+        The sampling of the digitizer (ns), a multiple of tstep
+     : adc
+        optional, ADC, yields integer counts instead of voltages
+
+    Yields
+    ------
+      numpy array
+          digitized blocks (N_ant, L', 3), concatenated identical to digitize_traces of the whole stream
+    Notes
+    -----
+    The anti-alias filter of resample_poly is applied with upfirdn on the samples kept from the previous
+    blocks (20 TSAMPLING), output samples are delayed by half the filter length (10 TSAMPLING).
+    """
+    ratio = int(round(TSAMPLING / tstep))
+    if ratio < 1 or abs(ratio * tstep - TSAMPLING) > 1e-6 * TSAMPLING:
+        raise ValueError("Sampling time not multiple of simulation time")
+    if ratio == 1:
+        for block in blocks:
+            block = np.array(block, dtype=float)
+            yield block if adc is None else adc.quantize(block)
+        return
+
+    # filter of resample_poly, padded so that output k is centred on input k*ratio
+    half_len = 10 * ratio
+    pre_pad = ratio - half_len % ratio
+    h = np.concatenate([np.zeros(pre_pad), firwin(2 * half_len + 1, 1. / ratio, window=('kaiser', 5.0))])
+    delay = (half_len + pre_pad) // ratio # output bins
+    span = -(-(len(h) - 1) // ratio) # output bins of input needed per output
+    buf, start, received, k = None, -(span - delay) * ratio, 0, 0
+
+    def _run(buf, start, k, kend):
+        window = buf[:, (k + delay - span) * ratio - start:(kend - 1 + delay) * ratio + 1 - start]
+        out = upfirdn(h, window, 1, ratio, axis=1)[:, span:span + kend - k]
+        return out if adc is None else adc.quantize(out)
+
+    for block in blocks:
+        block = np.asarray(block, dtype=float)
+        if buf is None: # zeros before the stream, as the padding of the whole trace
+            buf = np.zeros((block.shape[0], -start) + block.shape[2:])
+        buf = np.concatenate([buf, block], axis=1)
+        received += block.shape[1]
+        kend = (received - 1) // ratio - delay + 1
+        if kend > k:
+            yield _run(buf, start, k, kend)
+            k = kend
+            keep = (k + delay - span) * ratio
+            buf, start = buf[:, keep - start:], keep
+    # end of the stream: zeros after it, int(n/ratio) samples in total
+    kend = received // ratio
+    if buf is not None and kend > k:
+        pad = max(0, (kend - 1 + delay) * ratio + 1 - received)
+        buf = np.concatenate([buf, np.zeros((buf.shape[0], pad) + buf.shape[2:])], axis=1)
+        yield _run(buf, start, k, kend)
+
+#===========================================================================================================
+
+def digitize(trace, TSAMPLING=tsampling, adc=None):
+    """Digitize the voltages at an specific sampling, anti-aliased (see digitize_traces)
+    inputs : (voltages: time in ns, Vx, Vy, Vz, sampling in ns, optional ADC)
+    outputs : digitized voltages (time in ns), quantized to the ADC resolution if an ADC is given
+    """
+    trace = np.asarray(trace)
+    tstep = np.mean(np.diff(trace[:, 0]))
+    ratio = int(round(TSAMPLING / tstep))
+    voltages = digitize_traces(trace[:, 1:], tstep, TSAMPLING, adc, axis=0)
+    if adc is not None:
+        voltages = adc.to_voltage(voltages)
+    return np.column_stack([trace[::ratio, 0][:len(voltages)], voltages])
+
+#===========================================================================================================
+
+def save_adc_traces(path, time, counts, adc, **meta):
+    """ Write digitized traces compactly: integer counts (int16 up to 16 bits) and the time axis as t0, tstep
+    inputs : (path of the .npz file, time (N, T) or (T) in ns, counts (N, T, 3), ADC, further arrays to store)
+    raises ValueError for counts that are not integers within the ADC limits (quantize voltages with adc.quantize)
+    """
+    counts = np.asarray(counts)
+    if not np.issubdtype(counts.dtype, np.integer):
+        raise ValueError("Counts must be integers, quantize the voltages with the ADC first")
+    if counts.size and (counts.min() < adc.limits[0] or counts.max() > adc.limits[1]):
+        raise ValueError("Counts outside the range of the ADC")
+    counts = counts.astype(adc.dtype, copy=False)
+    time = np.broadcast_to(time, counts.shape[:2])
+    np.savez_compressed(path, counts=counts, t0=time[:, 0],
+                        tstep=np.mean(np.diff(time[0])), bits=adc.bits, vrange=adc.vrange, **meta)
+
+#===========================================================================================================
+
+def load_adc_traces(path):
+    """ Read traces written by save_adc_traces
+    inputs : path of the .npz file
+    outputs : (time (N, T) in ns, voltages (N, T, 3) in muV, ADC)
+    """
+    with np.load(path) as data:
+        adc = ADC(int(data["bits"]), float(data["vrange"]))
+        counts = data["counts"]
+        time = data["t0"][:, None] + np.arange(counts.shape[1]) * float(data["tstep"])
+    return time, adc.to_voltage(counts), adc
+
+#===========================================================================================================
+
+@functools.lru_cache(maxsize=64)
+def butter_sos(fs, lowcut, highcut, order=5):
+    """Butterworth band-pass as second-order sections, designed once per (fs, band, order)
+    inputs : (sampling frequency, low and high cut frequency in the same units, filter order)
+    outputs : read-only sos coefficients (order, 6)
+    """
+    sos = butter(order, [lowcut / (0.5 * fs), highcut / (0.5 * fs)],
+                 btype='band', output='sos')  # (order, [low, high], btype)
+    sos.flags.writeable = False
+    return sos
+
+#===========================================================================================================
+
 def _butter_bandpass_filter(data, lowcut, highcut, fs):
     """subfunction of filt
     """
-    b, a = butter(5, [lowcut / (0.5 * fs), highcut / (0.5 * fs)],
-                  btype='band')  # (order, [low, high], btype)
-    return lfilter(b, a, data)
+    return sosfilt(np.array(butter_sos(float(fs), float(lowcut), float(highcut))), data)
+
+#===========================================================================================================
+
+def filter_traces(voltages, fs, FREQMIN=50.e6, FREQMAX=200.e6, order=5, axis=-2, zerophase=False):
+    """ Band-pass filter many traces at once, along the time axis
+    Parameters
+    ----------
+     : voltages
+        The array of voltages (muV), e.g. (N_ant, T, 3), time along axis
+     : fs
+        The sampling frequency (Hz)
+     : FREQMIN
+        The minimal frequency of the bandpass filter (Hz)
+     : FREQMAX:
+        The maximal frequency of the bandpass filter (Hz)
+     : order
+        The order of the Butterworth filter
+     : axis
+        The time axis of voltages, default: second to last
+     : zerophase
+        Filter forwards and backwards (sosfiltfilt, no phase shift, squared response)
+
+    Returns
+    -------
+      numpy array
+          filtered voltages, same shape as the input
+    """
+    sos = np.array(butter_sos(float(fs), float(FREQMIN), float(FREQMAX), order)) # scipy needs writable sections
+    if zerophase:
+        return sosfiltfilt(sos, voltages, axis=axis)
+    return sosfilt(sos, voltages, axis=axis)
+
+#===========================================================================================================
+
+def filter_stream(blocks, fs, FREQMIN=50.e6, FREQMAX=200.e6, order=5):
+    """ Streaming version of filter_traces for continuous data, block by block
+    Parameters
+    ----------
+     : blocks
+        iterable of consecutive voltage blocks (muV), (N_ant, L, 3), time along axis 1, any lengths L
+     : fs
+        The sampling frequency (Hz)
+     : FREQMIN, FREQMAX
+        The band of the Butterworth filter (Hz)
+     : order
+        The order of the Butterworth filter
+
+    Yields
+    ------
+      numpy array
+          filtered blocks, concatenated identical to filter_traces of the whole stream
+    Notes
+    -----
+    The state of the filter (zi) is carried from block to block, memory does not grow with the stream
+    """
+    sos = np.array(butter_sos(float(fs), float(FREQMIN), float(FREQMAX), order))
+    zi = None
+    for block in blocks:
+        block = np.asarray(block, dtype=float)
+        if zi is None:
+            zi = np.zeros((sos.shape[0], block.shape[0], 2) + block.shape[2:])
+        filtered, zi = sosfilt(sos, block, axis=1, zi=zi)
+        yield filtered
 
 #===========================================================================================================
 
@@ -121,7 +390,8 @@ def filters(voltages, FREQMIN=50.e6, FREQMAX=200.e6):
   ------
   Notes
   -----
-  At present Butterworth filter only is implemented
+  At present Butterworth filter only is implemented, all channels are filtered in one pass
+  (see filter_traces), the input is not modified
   Examples
   ATTENTION: output traces inversed now
   --------
@@ -130,26 +400,104 @@ def filters(voltages, FREQMIN=50.e6, FREQMAX=200.e6):
   ```
   """
   
+  voltages = np.asarray(voltages)
   t = voltages.T[0]
   # check whether time in s or ns and correct for it
   if t[1]-t[0] > 0.1:
-      t*=1e-9 # ns to s
-  v = np.array(voltages.T[1:, :])  # Raw signal
+      t = t*1e-9 # ns to s
 
   #fs = 1 / np.mean(np.diff(t))  # Compute frequency step
   fs = round(1 / np.mean(np.diff(t)))  # Compute frequency step
   #print("Trace sampling frequency: ",fs/1e6,"MHz")
-  nCh = np.shape(v.T)[1]
-  vout = np.zeros(shape=(len(t), nCh))
-  res = t
-  for i in range(nCh):
-        vi = v[i,:]
-        #vout[:, i] = _butter_bandpass_filter(vi, FREQMIN, FREQMAX, fs)
-        res = np.append(res,_butter_bandpass_filter(vi, FREQMIN, FREQMAX, fs))
-  
-  res = np.reshape(res,(nCh+1,len(t)))  # Put it back inright format
-  res[0]*=1e9 # s to ns
-  return res.T
+  res = np.empty(voltages.shape)
+  res[:, 0] = t*1e9 # s to ns
+  res[:, 1:] = filter_traces(voltages[:, 1:], fs, FREQMIN, FREQMAX, axis=0)
+  return res
+
+#===========================================================================================================
+
+def fused_processing(time, efield, zenith_sim, azimuth_sim, alpha_sim=0., beta_sim=0.,
+                     processing={'antennaresponse', 'noise', 'filter', 'digitise'},
+                     vrms=Vrms2, FREQMIN=50.e6, FREQMAX=200.e6, TSAMPLING=tsampling, types=None, seed=0, event=0,
+                     antennas=None, spectrum=None, workers=None):
+    """ Antenna response, noise, band-pass filter and digitisation of many antennas in one FFT round trip
+
+    The spectra of the antenna response are kept: the noise is added as the spectrum of white noise
+    (from the per antenna random streams of noise.generate_noise, on the padded length) times the noise
+    spectrum, multiplied by the frequency response of the Butterworth filter of filters, and the band-limited
+    spectrum is transformed back once at the digitisation sampling (Fourier resampling as digitization,
+    not the sample picking of Digitization_2). As all steps are done on the DFT of the padded trace,
+    the filter is applied circularly.
+
+    Parameters
+    ----------
+     : time
+        The time (ns), (T) or (N_ant, T)
+     : efield
+        The electric field Ex, Ey, Ez (muV/m), (N_ant, T, 3)
+     : zenith_sim, azimuth_sim
+        The direction of the shower in deg (GRAND)
+     : alpha_sim, beta_sim
+        The antenna slopes in deg, float or (N_ant)
+     : processing
+        The steps 'noise', 'filter', 'digitise' to apply after the antenna response
+     : vrms
+        The rms of the noise before filtering (muV)
+     : FREQMIN, FREQMAX
+        The band of the Butterworth band-pass filter (Hz)
+     : TSAMPLING
+        The sampling time of the digitisation (ns), multiple of the simulation sampling
+     : types
+        The antenna types, see computevoltage.compute_antennaresponse_batch
+     : seed, event, antennas
+        The seed of the simulation, event number and (N_ant) antenna IDs of the noise, see noise.generate_noise
+     : spectrum
+        The noise spectrum, default: NOISESPECTRUM of the config file, see noise.generate_noise
+     : workers
+        The number of threads for the FFTs, default: computevoltage.fft_workers
+
+    Returns
+    -------
+      time: numpy array
+          (N_ant, T') time in ns, T' = int(T/ratio) as digitize_traces
+      voltage: numpy array
+          (N_ant, T', 3) voltages Vx, Vy, Vz in muV
+    """
+    from scipy import fft
+    from radio_simus import computevoltage
+    from radio_simus.noise import generate_noise, _resolve_spectrum, _shaping
+
+    efield = np.asarray(efield, dtype=float)
+    workers = computevoltage.fft_workers if workers is None else workers
+    tstep = np.mean(np.diff(np.asarray(time, dtype=float)[..., :2]))
+    ratio = 1
+    if 'digitise' in processing:
+        ratio = int(round(TSAMPLING / tstep))
+        if abs(ratio * tstep - TSAMPLING) > 1e-6 * TSAMPLING:
+            raise ValueError("Sampling time not multiple of simulation time")
+    t0, fs, nf, vspec = computevoltage.compute_antennaresponse_spectrum(
+        time, efield, zenith_sim, azimuth_sim, alpha_sim, beta_sim, workers=workers, types=types, multiple=ratio)
+
+    if 'noise' in processing:
+        # rfft of white noise of rms vrms on nf samples, shaped in place (as generate_noise)
+        noise = fft.rfft(generate_noise(len(vspec), nf, tstep, vrms, seed, event, antennas, spectrum="white"),
+                         axis=1, workers=workers)
+        spectrum = _resolve_spectrum(spectrum)
+        if spectrum is not None:
+            noise *= _shaping(spectrum, nf, fs)[:, None]
+        vspec += noise
+
+    if 'filter' in processing:
+        freqs = fft.rfftfreq(nf) * fs
+        sos = np.array(butter_sos(float(fs), float(FREQMIN), float(FREQMAX)))
+        vspec *= sosfreqz(sos, worN=freqs, fs=fs)[1][:, None]
+
+    # back at the digitisation sampling, cut to the length of the input trace
+    nout = nf // ratio
+    ntime = efield.shape[1] // ratio
+    voltage = fft.irfft(vspec[:, :nout // 2 + 1], nout, axis=1, workers=workers)[:, :ntime] / ratio
+    time_out = t0[:, None] + np.arange(ntime) * tstep * ratio
+    return time_out, voltage
 
 #===========================================================================================================
 
@@ -190,7 +538,7 @@ def _create_emptytrace(nbins=599, tstep=1):
 #===========================================================================================================
 def standard_processing(efield, zenith_sim, azimuth_sim, alpha_sim=0., beta_sim=0., 
                         processing={'antennaresponse', 'noise', 'filter', 'digitise'},
-                        DISPLAY=1):
+                        DISPLAY=1, fused=False):
         ''' 
         Do the full chain once:
         1. READ IN THE SIMULATED ELECTRIC FIELD TRACE (at higher level) at hand over as parameter
@@ -207,6 +555,10 @@ def standard_processing(efield, zenith_sim, azimuth_sim, alpha_sim=0., beta_sim=
         
         NOTE: can be used modular so that people can pick the steps they need 
                 --> via "processing" parameter
+                --> for batches of antennas and timing per step: radio_simus.pipeline
+        
+        -- fused: antenna response, noise, filter and digitization in one FFT round trip
+           (see fused_processing), no plots
     
         
         Arguments:
@@ -223,6 +575,8 @@ def standard_processing(efield, zenith_sim, azimuth_sim, alpha_sim=0., beta_sim=
             choose the steps: 'antennaresponse', 'noise', 'filter', 'digitise'
         DISPLAY: 0,1
             Plotting option off/on
+        fused: bool
+            optional, run the steps in the frequency domain, needs 'antennaresponse'
         
         Returns:
         ---------
@@ -230,19 +584,29 @@ def standard_processing(efield, zenith_sim, azimuth_sim, alpha_sim=0., beta_sim=
             voltage trace, numpy array: time in ns, voltages (x,y,z)
         
         '''
-        import matplotlib.pyplot as plt
+        if fused and 'antennaresponse' in processing:
+            efield = np.asarray(efield)
+            time, voltage = fused_processing(efield[:, 0], efield[None, :, 1:4], zenith_sim, azimuth_sim,
+                                             alpha_sim, beta_sim, processing=processing)
+            return np.column_stack([time[0], voltage[0]])
+
+        if DISPLAY==1:
+            import matplotlib.pyplot as plt
         
         #print("TSampling in ns: ", tsampling, " , Vrms in muV: ", Vrms )
 
+        # without antenna response the steps work on the input trace itself (e.g. noise traces)
+        trace = np.asarray(efield)
+
         ### 2. APPLY ANTENNA RESPONSE
         if 'antennaresponse' in processing:
             
             from radio_simus.computevoltage import  compute_antennaresponse
             trace = compute_antennaresponse(efield, zenith_sim, azimuth_sim, alpha=alpha_sim, beta=beta_sim )
             
-            #### 2b. deconvolve antenna response - still ongoing work
-            #from invert_computevoltage import compute_electicfield
-            #electric = compute_electicfield(trace, zenith_sim, azimuth_sim, alpha=alpha_sim, beta=beta_sim )
+            #### 2b. deconvolve antenna response - not part of the standard chain
+            #from radio_simus.invert_computevoltage import compute_electricfield
+            #electric = compute_electricfield(trace, zenith_sim, azimuth_sim, alpha=alpha_sim, beta=beta_sim )
             
             if DISPLAY==1:
                         
@@ -321,7 +685,8 @@ def standard_processing(efield, zenith_sim, azimuth_sim, alpha_sim=0., beta_sim=
         if 'digitise' in processing:
             
             #trace = digitization(trace,tsampling)
-            trace = Digitization_2(trace,tsampling)
+            #trace = Digitization_2(trace,tsampling) # sample picking, no anti-alias filter
+            trace = digitize(trace,tsampling)
         
             if DISPLAY==1:
                         
@@ -3,11 +3,19 @@ Astropy units missing
 """
 
 
+import functools
 import numpy as np
+from scipy.fft import rfft, ifft
 
 import logging
 logger = logging.getLogger("Signal_Treatment")
 
+# peak-to-peak values of p2p / p2p_batch: x, y, z, xy-, all-combined
+P2P_FIELDS = ("p2p_x", "p2p_y", "p2p_z", "p2p_xy", "p2p_combined")
+P2P_DTYPE = np.dtype([(name, float) for name in P2P_FIELDS])
+# trigger modes of _trigger / trigger_batch
+TRIGGER_MODES = ("any", "xy", "all")
+
 #===========================================================================================================
 def p2p(trace):
     ''' Calculates peak to peak values
@@ -23,33 +31,168 @@ def p2p(trace):
     '''        
     
     if trace.ndim==2: # simply assume np.array([t, x, y, z])
-        xy = np.sqrt(trace.T[1]**2 + trace.T[2]**2)
-        combined = np.sqrt(trace.T[1]**2 + trace.T[2]**2 + trace.T[3]**2) 
-        return max(trace.T[1])-min(trace.T[1]), max(trace.T[2])-min(trace.T[2]), max(trace.T[3])-min(trace.T[3]), max(xy)-min(xy), max(combined)-min(combined)
+        return tuple(p2p_batch(trace[None, :, 1:4])[0])
     elif trace.ndim==1:
-        return max(trace)-min(trace)
+        return np.ptp(trace)
     else:
         print("in p2p(): dimensions not correct")
 
 #===========================================================================================================
-def hilbert_env(signal):
+def p2p_batch(traces):
+    ''' Calculates peak to peak values of many traces at once
+
+    Arguments:
+    ----------
+    traces: numpy array
+        (N, T, 3) signal traces x, y, z
+
+    Returns:
+    --------
+    numpy structured array
+        (N) peak-to-peak values, fields P2P_FIELDS: p2p_x, p2p_y, p2p_z, p2p_xy, p2p_combined
+    '''
+    traces = np.asarray(traces)
+    res = np.empty(traces.shape[0], dtype=P2P_DTYPE)
+    ptp = np.ptp(traces, axis=1)
+    res["p2p_x"], res["p2p_y"], res["p2p_z"] = ptp.T
+    xy = np.hypot(traces[..., 0], traces[..., 1])
+    res["p2p_xy"] = np.ptp(xy, axis=1)
+    res["p2p_combined"] = np.ptp(np.hypot(xy, traces[..., 2]), axis=1)
+    return res
+
+#===========================================================================================================
+@functools.lru_cache(maxsize=32)
+def _analytic_multiplier(n):
+    ''' Weights of the rfft bins of the analytic signal (as scipy.signal.hilbert), read-only '''
+    h = np.zeros(n//2 + 1)
+    h[0] = 1.
+    h[1:(n + 1)//2] = 2.
+    if n % 2 == 0:
+        h[n//2] = 1.
+    h.flags.writeable = False
+    return h
+
+#===========================================================================================================
+def _analytic_spectrum(traces, axis, workers):
+    ''' rfft spectrum of the analytic signal along axis, moved to the last axis '''
+    traces = np.moveaxis(np.asarray(traces, dtype=float), axis, -1)
+    return rfft(traces, axis=-1, workers=workers)*_analytic_multiplier(traces.shape[-1]), traces.shape[-1]
+
+#===========================================================================================================
+def analytic_signal(traces, axis=1, workers=None):
+    '''
+    Analytic signal of many traces at once, same as scipy.signal.hilbert
+
+    Arguments:
+    ----------
+    traces: np.array
+        signal traces, e.g. (N, T, 3), or a single trace (T)
+    axis: int
+        optional, time axis, default 1 (ignored for a single trace)
+    workers: int
+        optional, number of threads for the FFTs
+    Returns:
+    --------
+    np.array
+        complex analytic signal, same shape as traces
+    '''
+    if np.ndim(traces) == 1:
+        axis = 0
+    spectrum, n = _analytic_spectrum(traces, axis, workers)
+    return np.moveaxis(ifft(spectrum, n, axis=-1, workers=workers), -1, axis)
+
+#===========================================================================================================
+def hilbert_env(signal, axis=1):
     ''' 
     Hilbert envelope - abs(analytical signal)
     Arguments:
     ----------
     signal: np.array
-        signal trace
+        signal trace (T), or many traces with time along axis, e.g. (N, T, 3)
+    axis: int
+        optional, time axis, default 1 (ignored for a single trace)
     Returns:
     --------
     amplitude_envelope: np.array
         Hilbert envelope
         
     '''
-    from scipy.signal import hilbert
-    analytic_signal = hilbert(signal)
-    amplitude_envelope = np.abs(analytic_signal)
+    amplitude_envelope = np.abs(analytic_signal(signal, axis))
     return amplitude_envelope
 
+#===========================================================================================================
+@functools.lru_cache(maxsize=8)
+def _fine_phases(n, upsample):
+    ''' exp(2i pi k d/n) for the offsets d in [-1, 1] sample (step 1/upsample) and the rfft bins k '''
+    offsets = np.arange(-upsample, upsample + 1)/upsample
+    phases = np.exp(2j*np.pi*np.outer(np.arange(n//2 + 1), offsets)/n)
+    phases.flags.writeable = False
+    return offsets, phases
+
+#===========================================================================================================
+def _parabola(ym, y0, yp):
+    ''' vertex of the parabola through (-1, ym), (0, y0), (1, yp): offset and height '''
+    curvature = ym - 2.*y0 + yp
+    with np.errstate(divide="ignore", invalid="ignore"):
+        delta = np.where(curvature < 0., 0.5*(ym - yp)/curvature, 0.)
+    return delta, y0 - 0.25*(ym - yp)*delta
+
+#===========================================================================================================
+def hilbert_peak_batch(time, traces, refine="parabolic", upsample=16, workers=None):
+    ''' Time and amplitude of the peak of the Hilbert envelope of many traces at once
+
+    Arguments:
+    ----------
+    time: numpy array
+        (T) or (N, T) time in ns, equally spaced
+    traces: numpy array
+        (N, T, 3) signal traces in muV or muV/m
+    refine: str
+        optional, sub-sample peak: None (envelope sample), "parabolic" (parabola through the three
+        samples around the maximum) or "sinc" (band-limited interpolation of the analytic signal
+        on a grid of 1/upsample sample, then parabolic)
+    upsample: int
+        optional, grid of the sinc refinement per sample
+    workers: int
+        optional, number of threads for the FFTs
+
+    Returns:
+    --------
+    numpy array
+        (N, 3) time of maximum in ns
+    numpy array
+        (N, 3) maximum of Hilbert envelope in muV or muV/m
+    '''
+    traces = np.asarray(traces, dtype=float)
+    nant, n = traces.shape[:2]
+    time = np.broadcast_to(np.asarray(time, dtype=float), (nant, n))
+    tstep = (time[:, -1] - time[:, 0])/(n - 1)
+
+    spectrum, n = _analytic_spectrum(traces, 1, workers) # (N, 3, F)
+    envelope = np.abs(ifft(spectrum, n, axis=-1, workers=workers))
+    peak = np.argmax(envelope, axis=-1) # (N, 3)
+    amplitude = np.take_along_axis(envelope, peak[..., None], axis=-1)[..., 0]
+    position = peak.astype(float)
+    if refine == "parabolic":
+        inner = (peak > 0) & (peak < n - 1)
+        ym = np.take_along_axis(envelope, np.clip(peak - 1, 0, n - 1)[..., None], axis=-1)[..., 0]
+        yp = np.take_along_axis(envelope, np.clip(peak + 1, 0, n - 1)[..., None], axis=-1)[..., 0]
+        delta, height = _parabola(ym, amplitude, yp)
+        position = np.where(inner, position + delta, position)
+        amplitude = np.where(inner, height, amplitude)
+    elif refine == "sinc":
+        # analytic signal (periodic, band-limited) evaluated around the peak sample
+        offsets, phases = _fine_phases(n, upsample)
+        shift = np.exp(2j*np.pi*np.arange(n//2 + 1)*peak[..., None]/n) # (N, 3, F)
+        fine = np.abs((spectrum*shift) @ phases)/n # (N, 3, 2*upsample+1)
+        best = np.clip(np.argmax(fine, axis=-1), 1, 2*upsample - 1)
+        y = [np.take_along_axis(fine, (best + k)[..., None], axis=-1)[..., 0] for k in (-1, 0, 1)]
+        delta, amplitude = _parabola(*y)
+        position = position + offsets[best] + delta/upsample
+    elif refine is not None:
+        raise ValueError("Unknown peak refinement: " + str(refine))
+    return time[:, :1] + position*tstep[:, None], amplitude
+
 #===========================================================================================================
 def hilbert_peak(time, signal):
     ''' Calculates time and amplitude of peak
@@ -68,9 +211,9 @@ def hilbert_peak(time, signal):
 
     '''
     envelope=hilbert_env(signal)
-    #Get time and amp
-    
-    return time[np.where(signal == signal.max())][0],max(envelope)
+    #Get time and amp of the envelope maximum (see hilbert_peak_batch for sub-sample timing)
+    peak = np.argmax(envelope)
+    return time[peak], envelope[peak]
 
 
 #===========================================================================================================
@@ -132,6 +275,42 @@ def _trigger(p2p, mode, thrs):
        print("this mode doesn't exist")
     #return trig
 
+#===========================================================================================================
+def trigger_batch(p2ps, thresholds, modes=TRIGGER_MODES):
+    '''
+    Trigger flags of many antennas for all modes and thresholds at once, same modes as _trigger:
+    any (x, y or z), xy (xy-combined) and all (all-combined)
+
+    Arguments:
+    ----------
+    p2ps: numpy array
+        (N) structured array of p2p_batch or (N, 5) peak to peak values x, y, z, xy, combined
+    thresholds: float or numpy array
+        (K) threshold values to exceed in muV/m or muV
+    modes: list
+        optional, modes to evaluate, default: any, xy, all
+
+    Returns:
+    ----------
+    numpy structured array
+        (N) one boolean field per mode, of shape (K) for K thresholds
+    '''
+    if np.asarray(p2ps).dtype.names is None:
+        values = np.asarray(p2ps, dtype=float)
+        p2ps = np.empty(len(values), dtype=P2P_DTYPE)
+        for i, name in enumerate(P2P_FIELDS):
+            p2ps[name] = values[:, i]
+    thrs = np.asarray(thresholds, dtype=float)
+    signals = {"any": np.maximum(np.maximum(p2ps["p2p_x"], p2ps["p2p_y"]), p2ps["p2p_z"]),
+               "xy": p2ps["p2p_xy"], "all": p2ps["p2p_combined"]}
+    unknown = set(modes) - set(signals)
+    if unknown:
+        raise ValueError("Unknown trigger modes: " + ", ".join(sorted(unknown)))
+    res = np.empty(len(p2ps), dtype=[(mode, bool, thrs.shape) for mode in modes])
+    for mode in modes:
+        res[mode] = signals[mode][(slice(None),) + (None,)*thrs.ndim] >= thrs
+    return res
+
 #===========================================================================================================
 
 # --------- Different SNR definitions
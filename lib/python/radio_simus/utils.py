@@ -1,4 +1,5 @@
 import numpy as np
+from scipy.spatial import cKDTree
 
 import logging
 logger = logging.getLogger("Utils")
@@ -266,3 +267,126 @@ def freq2time(spectrum, n=None):
     """
     return np.fft.irfft(spectrum, axis=-1, n=n) / 2 ** 0.5
 
+#===========================================================================================================
+
+def unwrap(phi, ontrue=None, axis=-1):
+    """Unwrap the phase to a strictly decreasing function.
+
+    Each step p1 >= p0 between neighbouring frequencies moves the rest of the spectrum down by
+    floor((p1 - p0)/2pi) + 1 turns, the cumulated number of turns is a cumulative sum over the steps.
+
+    Parameters:
+    ----------
+        phi: numpy array, float
+            phase of the signal trace, or phases of many traces (spectra along axis)
+        ontrue: str
+            printing option, default=None
+        axis: int
+            frequency axis, default=-1
+    Returns:
+    ----------
+        phi_unwrapped: numpy array, float
+            unwarpped phase of the signal trace
+    """
+
+    phi = np.moveaxis(np.asarray(phi), axis, -1)
+    pi2 = 2. * np.pi
+    step = phi[..., 1:] - phi[..., :-1]
+    l = np.cumsum(np.where(step >= 0, np.floor_divide(step, pi2) + 1, 0.), axis=-1)
+    phi_unwrapped = np.empty(phi.shape)
+    phi_unwrapped[..., 0] = phi[..., 0]
+    phi_unwrapped[..., 1:] = phi[..., 1:] - l * pi2
+    if ontrue is not None and phi.ndim == 1:
+        for i in range(1, len(phi)):
+            print(i, phi[i], phi[i-1], l[i-1], phi_unwrapped[i], abs(phi[i] - phi[i-1]),
+                  abs(phi[i] - phi[i-1] + np.pi), abs(phi[i] - phi[i-1] - np.pi), l[i-1])
+    return np.moveaxis(phi_unwrapped, -1, axis)
+
+#===========================================================================================================
+
+class PolarIndex:
+    ''' Index of simulated positions in the shower plane for the neighbour selection of do_interpolation
+
+    The neighbours of a desired position are the closest simulated positions in the four quadrants
+    of (delta_phi, delta_r) around it (polar coordinates in the (vxB, vxvxB) plane), sorted as in
+    do_interpolation by (distance, |delta_phi|, |delta_r|) in float32, then by index.
+
+    Candidates come from a KD-tree, k nearest per desired position, k doubled for the positions where a
+    quadrant is empty or its best candidate is not closer than the k-th neighbour.
+
+    Parameters:
+    ----------
+        pos_sims: numpy array
+            (N, 3) simulated positions in shower coordinates (v, vxB, vxvxB)
+    '''
+
+    def __init__(self, pos_sims):
+        yz = np.asarray(pos_sims)[:, 1:3]
+        self.tree = cKDTree(yz)
+        self.theta = np.arctan2(yz[:, 1], yz[:, 0])
+        self.theta[np.round(self.theta, 4) == -3.1416] *= -1
+        self.radius = np.sqrt(yz[:, 0]**2 + yz[:, 1]**2)
+
+    def __len__(self):
+        return len(self.theta)
+
+    def _quadrants(self, theta, radius, cand):
+        ''' best candidate and its distance per quadrant, keys as in do_interpolation '''
+        delta_phi = self.theta[cand] - theta[:, None]
+        delta_phi = np.where(delta_phi > np.pi, delta_phi - 2.*np.pi, delta_phi)
+        delta_r = self.radius[cand] - radius[:, None]
+        with np.errstate(invalid="ignore"):
+            distance = np.sqrt(self.radius[cand]**2. + radius[:, None]**2.
+                               - 2.*self.radius[cand]*radius[:, None]*np.cos(self.theta[cand] - theta[:, None]))
+        keys = (cand, np.abs(np.round(delta_r, 2)).astype(np.float32),
+                np.abs(np.round(delta_phi, 2)).astype(np.float32), distance.astype(np.float32))
+        masks = ((delta_phi >= 0.) & (delta_r >= 0), (delta_phi > 0.) & (delta_r < 0),
+                 (delta_phi <= 0.) & (delta_r <= 0), (delta_phi < 0.) & (delta_r > 0))
+        rows = np.broadcast_to(np.arange(len(theta))[:, None], cand.shape)
+        best = np.full((len(theta), 4), -1)
+        best_distance = np.full((len(theta), 4), np.inf)
+        for q, mask in enumerate(masks):
+            order = np.lexsort(tuple(k.ravel() for k in keys) + ((~mask).ravel(), rows.ravel()))
+            first = order[np.searchsorted(rows.ravel()[order], np.arange(len(theta)))]
+            valid = mask.ravel()[first]
+            best[valid, q] = cand.ravel()[first[valid]]
+            best_distance[valid, q] = distance.ravel()[first[valid]]
+        return best, best_distance
+
+    def quadrant_neighbours(self, pos, k=16):
+        ''' Closest simulated position in each quadrant, for all desired positions at once
+
+        Parameters:
+        ----------
+            pos: numpy array
+                (M, 3) desired positions in shower coordinates (v, vxB, vxvxB)
+            k: int
+                number of candidates of the first query
+        Returns:
+        ----------
+            numpy array, int
+                (M, 4) indices of the simulated positions in the quadrants I-IV, -1 for empty quadrants
+        '''
+        yz = np.asarray(pos)[:, 1:3]
+        theta = np.arctan2(yz[:, 1], yz[:, 0])
+        radius = np.sqrt(yz[:, 0]**2 + yz[:, 1]**2)
+        neighbours = np.full((len(yz), 4), -1)
+        todo = np.arange(len(yz))
+        k = min(k, len(self))
+        while todo.size:
+            dk, cand = self.tree.query(yz[todo], k=k)
+            dk, cand = dk.reshape(len(todo), k), cand.reshape(len(todo), k)
+            best, distance = self._quadrants(theta[todo], radius[todo], cand)
+            if k == len(self): # all simulated positions seen, empty quadrants stay empty
+                neighbours[todo] = best
+                break
+            # positions further than the k-th neighbour cannot win against a clearly closer candidate,
+            # quadrants I, IV (II, III) are empty outside (inside) all simulated radii
+            limit = dk[:, -1:]*(1. - 1e-6) - 1e-6
+            outside = (radius[todo] > self.radius.max())[:, None] & np.array([True, False, False, True])
+            inside = (radius[todo] < self.radius.min())[:, None] & np.array([False, True, True, False])
+            done = np.all((distance < limit) | outside | inside, axis=1)
+            neighbours[todo[done]] = best[done]
+            todo = todo[~done]
+            k = min(2*k, len(self))
+        return neighbours
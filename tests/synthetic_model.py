@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic antenna model in the legacy file layout, shared by the unit tests
+"""
+
+import shutil
+import tempfile
+import numpy as np
+
+from os.path import join
+from radio_simus.antenna_response import AntennaResponse, LEGACY_ARRAYS
+
+
+def create_antenna_file(path, scale=1., shift=0.):
+    """Write a synthetic antenna model in the legacy 9-array layout
+
+    frequencies 20-300MHz in 10MHz steps, zenith 0-90deg in 1deg steps, azimuth 0-90deg in 5deg steps,
+    shift (deg/MHz) adds a frequency dependent phase to the phi response (arms that are not proportional)
+    """
+    freq = np.arange(20., 301., 10.)
+    zen, az = np.meshgrid(np.arange(0., 91.), np.arange(0., 91., 5.), indexing="ij")
+    zen, az = zen.ravel(), az.ravel()
+    f = freq[:, None]
+    tables = dict(
+        freq=np.repeat(f, len(zen), axis=1),
+        realimp=np.repeat(f*0.5, len(zen), axis=1),
+        reactance=np.repeat(-f*0.2, len(zen), axis=1),
+        theta=np.repeat(zen[None, :], len(freq), axis=0),
+        phi=np.repeat(az[None, :], len(freq), axis=0),
+        lefftheta=scale*(1. + np.cos(np.deg2rad(zen))*f/300. + 0.1*np.sin(np.deg2rad(az))),
+        leffphi=scale*(0.5 + np.sin(np.deg2rad(zen))*f/600. + 0.2*np.cos(np.deg2rad(az))),
+        phasetheta=-f*zen/50. - az/10.,
+        phasephi=-f*zen/80. + az/20. + shift*f,
+    )
+    np.save(path, np.array([tables[name] for name in LEGACY_ARRAYS]))
+    return tables
+
+
+class SyntheticModel:
+    """Mixin of test cases run on the synthetic antenna model: replaces the default antenna model
+    of computevoltage (arms X, Y, Z scaled by 1, 0.8, 0.3, phase shifts of shifts) for the test class"""
+
+    shifts = (0., 0., 0.)
+
+    @classmethod
+    def setUpClass(cls):
+        import radio_simus.computevoltage as cv
+        cls.cv = cv
+        cls.tmp = tempfile.mkdtemp()
+        cls.responses = cv.responses
+        cv.responses = {}
+        for arm, scale, shift in zip("XYZ", (1., 0.8, 0.3), cls.shifts):
+            path = join(cls.tmp, "antenna_" + arm + ".npy")
+            create_antenna_file(path, scale, shift)
+            cv.responses[arm] = AntennaResponse(path)
+        cv.transfer_cache.clear()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.cv.responses = cls.responses
+        cls.cv.transfer_cache.clear()
+        shutil.rmtree(cls.tmp)
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the radio_simus.array_trigger module
+
+Usage: python3.7 tests/test_array_trigger.py
+"""
+
+import unittest
+import sys
+import numpy as np
+import astropy.units as u
+
+from os.path import split, join, realpath
+root_dir = realpath(join(split(__file__)[0], "..")) # = $PROJECT
+sys.path.append(join(root_dir, "lib", "python"))
+from radio_simus.array_trigger import ArrayTrigger
+from radio_simus.detector import Detector
+
+
+def brute_force(positions, flags, times, radius, multiplicity, window):
+    """ all pairs reference of the array trigger """
+    dist = np.linalg.norm(positions[:, None] - positions[None], axis=-1)
+    triggered = np.zeros(len(flags), dtype=bool)
+    for e in range(len(flags)):
+        for i in np.flatnonzero(flags[e]):
+            close = (dist[i] <= radius) & flags[e] & (np.abs(times[e] - times[e, i]) <= window)
+            triggered[e] |= np.sum(close) >= multiplicity
+    return triggered
+
+
+class ArrayTriggerTest(unittest.TestCase):
+    """Unit tests for the coincidence trigger"""
+
+    def test_graph(self):
+        # square grid, 1km step
+        x, y = np.meshgrid(np.arange(5.)*1000., np.arange(4.)*1000.)
+        positions = np.column_stack([x.ravel(), y.ravel(), np.zeros(20)])
+        trig = ArrayTrigger(positions, 1100.)
+        self.assertAlmostEqual(trig.window, 1100./0.299792458)
+        np.testing.assert_array_equal(trig.neighbours(0), [1, 5])
+        np.testing.assert_array_equal(trig.neighbours(6), [1, 5, 7, 11])
+        self.assertEqual(trig.adjacency.nnz, 2*(4*4 + 5*3))
+
+        det = Detector()
+        det.position = positions.tolist()
+        trig2 = ArrayTrigger.from_detector(det, 1.1*u.km.to(u.m), multiplicity=2, window=100.)
+        self.assertEqual((trig2.adjacency != trig.adjacency).nnz, 0)
+
+    def test_coincidence(self):
+        rng = np.random.default_rng(4)
+        positions = rng.uniform(0., 10000., size=(200, 3))*np.array([1., 1., 0.01])
+        nevents = 50
+        flags = rng.uniform(size=(nevents, 200)) < 0.15
+        times = rng.uniform(0., 20000., size=(nevents, 200))
+        for multiplicity, window in ((2, 2000.), (3, 5000.), (4, None)):
+            trig = ArrayTrigger(positions, 1500., multiplicity, window)
+            ref = brute_force(positions, flags, times, 1500., multiplicity, trig.window)
+            res = trig.evaluate(flags, times)
+            self.assertGreater(np.sum(ref), 0)
+            np.testing.assert_array_equal(res, ref)
+
+        # hits interface, events without hits
+        trig = ArrayTrigger(positions, 1500., 3, 5000.)
+        event, antenna = np.nonzero(flags)
+        triggered, central = trig.evaluate_hits(event + 2, antenna, times[event, antenna], nevents + 4)
+        self.assertEqual(len(triggered), nevents + 4)
+        self.assertFalse(np.any(triggered[:2]) or np.any(triggered[-2:]))
+        np.testing.assert_array_equal(triggered[2:-2], trig.evaluate(flags, times))
+        self.assertEqual(len(central), len(event))
+        self.assertEqual(len(trig.evaluate(np.zeros((3, 200), dtype=bool), times[:3])), 3)
+        with self.assertRaises(ValueError):
+            trig.evaluate(flags[:, :10], times[:, :10])
+
+
+if __name__ == "__main__":
+    unittest.main()
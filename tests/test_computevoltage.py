@@ -0,0 +1,518 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the radio_simus.computevoltage and radio_simus.antenna_response modules
+
+Usage: python3.7 tests/test_computevoltage.py
+
+Note: uses a small synthetic antenna model in the legacy file layout (tests/synthetic_model.py)
+"""
+
+import unittest
+import sys
+import os
+import pickle
+import shutil
+import tempfile
+import numpy as np
+
+from os.path import split, join, realpath
+root_dir = realpath(join(split(__file__)[0], "..")) # = $PROJECT
+sys.path.append(join(root_dir, "lib", "python"))
+from radio_simus.antenna_response import AntennaResponse, TransferCache, round_azimuth, fold_azimuth
+from tests.synthetic_model import create_antenna_file, SyntheticModel
+
+
+class AntennaResponseTest(unittest.TestCase):
+    """Unit tests for the lazy antenna response store"""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = join(self.tmp, "antenna_leff.npy")
+        self.tables = create_antenna_file(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_lazy(self):
+        resp = AntennaResponse(self.path)
+        self.assertIsNone(resp._tables)
+        self.assertFalse(os.path.exists(resp.store))
+        leff = resp.leff_theta
+        self.assertTrue(os.path.isdir(resp.store))
+        self.assertIsInstance(leff, np.memmap)
+        self.assertEqual(leff.shape, (29, 91, 19))
+
+    def test_dense(self):
+        resp = AntennaResponse(self.path)
+        np.testing.assert_array_equal(resp.freq, self.tables["freq"][:, 0])
+        np.testing.assert_array_equal(resp.zenith, np.arange(0., 91.))
+        np.testing.assert_array_equal(resp.azimuth, np.arange(0., 91., 5.))
+        theta, phi = self.tables["theta"][0], self.tables["phi"][0]
+        for j in (0, 17, 1000, 1728):
+            izen, iaz = int(theta[j]), int(phi[j]/5)
+            np.testing.assert_array_equal(resp.leff_phi[:, izen, iaz], self.tables["leffphi"][:, j])
+            np.testing.assert_allclose(resp.phase_theta[:, izen, iaz], np.deg2rad(self.tables["phasetheta"][:, j]))
+
+    def test_incomplete(self):
+        from radio_simus.antenna_response import _to_dense
+        # one direction missing, one duplicated
+        for index in (slice(1, None), np.r_[0, 0:self.tables["theta"].shape[1]]):
+            tables = {name: table[:, index] for name, table in self.tables.items()}
+            with self.assertRaises(ValueError):
+                _to_dense(tables)
+
+    def test_direction(self):
+        resp = AntennaResponse(self.path)
+        theta, phi = self.tables["theta"][0], self.tables["phi"][0]
+        zen, azim = 42.3, 197.
+        roundazimuth = round_azimuth(azim)
+        self.assertEqual(roundazimuth, 15.)
+        low = np.nonzero((theta == int(zen)) & (phi == roundazimuth))[0][0]
+        high = np.nonzero((theta == int(zen) + 1) & (phi == roundazimuth))[0][0]
+        leff = self.tables["lefftheta"]
+        expected = leff[:, low] + (zen - int(zen))*(leff[:, high] - leff[:, low])
+        ltr, lta, lpr, lpa = resp.direction(zen, azim)
+        np.testing.assert_allclose(ltr, expected)
+        # vectorized over directions
+        ltr2, _, _, _ = resp.direction(np.array([zen, 10., 90.]), np.array([azim, 0., 359.]))
+        self.assertEqual(ltr2.shape, (29, 3))
+        np.testing.assert_allclose(ltr2[:, 0], expected)
+        np.testing.assert_allclose(ltr2[:, 2], resp.leff_theta[:, 90, 0])
+
+    def test_converted_once(self):
+        store = AntennaResponse(self.path).open().store
+        mtime = os.path.getmtime(join(store, "meta.json"))
+        resp = AntennaResponse(self.path).open()
+        self.assertEqual(mtime, os.path.getmtime(join(resp.store, "meta.json")))
+
+    def test_bilinear(self):
+        resp = AntennaResponse(self.path)
+        # on azimuth nodes as nearest
+        zen = np.array([10.3, 42.7, 89.5])
+        azim = np.array([15., 195., 345.])
+        for a, b in zip(resp.direction(zen, azim), resp.direction(zen, azim, interpolation="bilinear")):
+            np.testing.assert_allclose(a, b)
+        # linear in azimuth between nodes, folded into the table quadrant
+        ltr, _, _, lpa = resp.direction(30., np.array([12.5, 167.5, 192.5, 347.5]), interpolation="bilinear")
+        expected = 0.5*(resp.leff_theta[:, 30, 2] + resp.leff_theta[:, 30, 3])
+        for k in range(4):
+            np.testing.assert_allclose(ltr[:, k], expected)
+        np.testing.assert_allclose(fold_azimuth([0., 95., 180., 260., 359.]), [0., 85., 0., 80., 1.])
+        # continuous where nearest jumps
+        a = resp.direction(30., [12.49, 12.51], interpolation="bilinear")[0]
+        b = resp.direction(30., [12.49, 12.51])[0]
+        self.assertLess(np.max(np.abs(a[:, 0] - a[:, 1])), 0.1*np.max(np.abs(b[:, 0] - b[:, 1])))
+        with self.assertRaises(ValueError):
+            resp.direction(30., 10., interpolation="cubic")
+
+    def test_cache_dir(self):
+        cache = join(self.tmp, "cache")
+        resp = AntennaResponse(self.path, cache_dir=cache)
+        resp.open()
+        self.assertEqual(split(resp.store)[0], cache)
+
+    def test_pickle(self):
+        resp = AntennaResponse(self.path).open()
+        resp2 = pickle.loads(pickle.dumps(resp))
+        self.assertIsNone(resp2._tables)
+        np.testing.assert_array_equal(resp.phase_phi, resp2.phase_phi)
+
+
+class TransferCacheTest(unittest.TestCase):
+    """Unit tests for the transfer function cache"""
+
+    def test_lru(self):
+        cache = TransferCache(maxbytes=3*80)
+        for i in range(3):
+            cache.put(i, np.zeros(10))
+        self.assertIsNotNone(cache.get(0)) # 0 is now the most recently used
+        cache.put(3, np.zeros(10))
+        self.assertNotIn(1, cache)
+        self.assertIn(0, cache)
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(cache.stats(), {"entries": 3, "nbytes": 240, "hits": 1, "misses": 1, "evictions": 1})
+        with self.assertRaises(ValueError):
+            cache.get(0)[0] = 1.
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+
+class VoltageTest(SyntheticModel, unittest.TestCase):
+    """Unit tests for the voltage computation, run on the synthetic antenna model"""
+
+    def efield(self, n=1000, tstep=1.):
+        t = np.arange(n)*tstep + 100.
+        pulse = np.exp(-0.5*((t - t[n//3])/3.)**2)
+        return np.stack([t, 80.*pulse, -50.*pulse, 20.*pulse], axis=-1)
+
+    def test_get_voltage(self):
+        efield = self.efield()
+        voltage, time = self.cv.get_voltage(efield.T[0]*1e-9, efield.T[1], efield.T[2], efield.T[3],
+                                            110., 30., typ="X")
+        self.assertEqual(len(voltage), len(time))
+        self.assertAlmostEqual(time[0], efield[0, 0]*1e-9)
+        self.assertGreater(np.max(np.abs(voltage)), 0.)
+
+    def test_batch(self):
+        efield = self.efield()
+        alpha = np.array([0., 10., 0., -5.])
+        beta = np.array([0., 5., 0., 12.])
+        efields = np.stack([efield[:, 1:]*k for k in (1., 2., 0.5, 1.)])
+        time, voltage = self.cv.compute_antennaresponse_batch(efield[:, 0], efields, 135., 123., alpha, beta)
+        self.assertEqual(voltage.shape, (4, 1000, 3))
+        self.assertEqual(time.shape, (4, 1000))
+        for i in range(4):
+            signal = np.column_stack([efield[:, 0], efields[i]])
+            for k, typ in enumerate("XYZ"):
+                v, t = self.cv.get_voltage(signal.T[0]*1e-9, signal.T[1], signal.T[2], signal.T[3],
+                                           135., 123., alpha[i], beta[i], typ=typ)
+                np.testing.assert_allclose(voltage[i, :, k], v, atol=1e-12*np.max(np.abs(v)))
+                np.testing.assert_allclose(time[i], t*1e9)
+
+    def test_compute_antennaresponse(self):
+        efield = self.efield()
+        trace = self.cv.compute_antennaresponse(efield, 150.5, 88., alpha=3., beta=-7.)
+        self.assertEqual(trace.shape, (1000, 4))
+        np.testing.assert_allclose(trace[:, 0], efield[:, 0])
+        for k, typ in enumerate("XYZ"):
+            v, t = self.cv.get_voltage(efield.T[0]*1e-9, efield.T[1], efield.T[2], efield.T[3],
+                                       150.5, 88., 3., -7., typ=typ)
+            np.testing.assert_allclose(trace[:, k+1], v, atol=1e-12*np.max(np.abs(v)))
+        with self.assertRaises(ValueError):
+            self.cv.compute_antennaresponse(efield, 80., 30.)
+
+    def test_odd_length(self):
+        efield = self.efield()
+        padded = efield.copy()
+        padded[-1, 1:] = 0.
+        trace = self.cv.compute_antennaresponse(padded, 120., 135.)
+        odd = self.cv.compute_antennaresponse(efield[:-1], 120., 135.)
+        self.assertEqual(odd.shape, (1000, 4))
+        np.testing.assert_allclose(odd, trace, atol=1e-12*np.max(np.abs(trace[:, 1:])))
+        v, t = self.cv.get_voltage(efield.T[0, :-1]*1e-9, efield.T[1, :-1], efield.T[2, :-1], efield.T[3, :-1],
+                                   120., 135., typ="Y")
+        np.testing.assert_allclose(v, odd[:, 2], atol=1e-12*np.max(np.abs(v)))
+        time, voltage = self.cv.compute_antennaresponse_batch(efield[:-1, 0], efield[None, :-1, 1:], 120., 135.,
+                                                              workers=1)
+        np.testing.assert_allclose(voltage[0], odd[:, 1:], atol=1e-12*np.max(np.abs(v)))
+
+    def test_topo_to_antenna(self):
+        def legacy(u, alpha, beta):
+            alpha, beta = np.deg2rad(alpha), np.deg2rad(beta)
+            ca, sa, cb, sb = np.cos(alpha), np.sin(alpha), np.cos(beta), np.sin(beta)
+            roty = np.linalg.inv(np.array([[ca, 0, sa], [0, 1, 0], [-sa, 0, ca]]))
+            rotz = np.linalg.inv(np.array([[cb, -sb, 0], [sb, cb, 0], [0, 0, 1]]))
+            rotyz = roty.dot(rotz)
+            xarmp = rotyz.dot([1, 0, 0])
+            antrot = np.arctan2(xarmp[1], xarmp[0])
+            cz, sz = np.cos(antrot), np.sin(antrot)
+            rotzant = np.linalg.inv(np.array([[cz, -sz, 0], [sz, cz, 0], [0, 0, 1]]))
+            return rotzant.dot(rotyz).dot(u)
+
+        rng = np.random.RandomState(1)
+        u = rng.normal(size=(50, 3))
+        alpha = rng.choice([-10., 0., 5., 12.], 50)
+        beta = rng.choice([-7., 0., 3.], 50)
+        up = self.cv.topo_to_antenna(u, alpha, beta)
+        for i in range(50):
+            np.testing.assert_allclose(up[i], legacy(u[i], alpha[i], beta[i]), atol=1e-14)
+        np.testing.assert_allclose(self.cv.topo_to_antenna(u, 5., -7.), [legacy(v, 5., -7.) for v in u], atol=1e-14)
+        np.testing.assert_allclose(self.cv.TopoToAntenna(u.T, 5., -7.), legacy(u.T, 5., -7.), atol=1e-14)
+        np.testing.assert_allclose(self.cv.rotation_matrix(alpha, beta)[3], legacy(np.eye(3), alpha[3], beta[3]),
+                                   atol=1e-14)
+
+    def test_compute_folder(self):
+        efield = self.efield()
+        def scaled(i): # a shorter trace and one with an other sampling
+            e = efield[:900].copy() if i == 5 else self.efield(tstep=2.) if i == 6 else efield.copy()
+            e[:, 1:] *= 1. + i
+            return e
+        root = join(self.tmp, "events")
+        for event in ("e1", "e2"):
+            os.makedirs(join(root, event))
+            for i in range(7):
+                np.savetxt(join(root, event, "a%d.trace" % i), scaled(i))
+        alpha = np.arange(7.)
+        output, timing = self.cv.compute_folder(join(root, "e1"), 135., 123., alpha=alpha, processes=2, chunksize=3)
+        self.assertEqual(set(timing), {"read", "response", "write", "total"})
+        data = dict(np.load(output))
+        np.testing.assert_array_equal(data["antenna"], np.arange(7))
+        self.assertEqual(data["voltage"].shape, (7, 1000, 3))
+        self.assertFalse(np.any(data["below"]))
+        for i in range(7):
+            trace = self.cv.compute_antennaresponse(scaled(i), 135., 123., alpha[i])
+            np.testing.assert_allclose(data["voltage"][i, :len(trace)], trace[:, 1:],
+                                       atol=1e-12*np.max(np.abs(trace[:, 1:])))
+            np.testing.assert_allclose(data["time"][i, :len(trace)], trace[:, 0])
+        serial, _ = self.cv.compute_folder(join(root, "e1"), 135., 123., alpha=alpha, processes=1,
+                                           output=join(self.tmp, "serial.npz"))
+        np.testing.assert_allclose(np.load(serial)["voltage"], data["voltage"], atol=1e-12)
+
+        with self.assertLogs(self.cv.logger, "WARNING"): # no slopes given
+            timing = self.cv.compute_tree(root, 135., 123., processes=2, chunksize=4)
+        self.assertEqual(sorted(timing), [join(root, "e1"), join(root, "e2")])
+        np.testing.assert_allclose(np.load(join(root, "e2", "voltage.npz"))["voltage"][0], data["voltage"][0],
+                                   atol=1e-12)
+
+        # slopes of the array file by antenna ID, in-process for one process
+        array_file = join(self.tmp, "array.txt")
+        np.savetxt(array_file, np.column_stack([np.arange(8)[::-1], np.zeros((8, 3)), np.arange(8.)[::-1],
+                                                -np.arange(8.)[::-1]]))
+        self.cv.compute_tree(root, 135., 123., processes=1, detector=array_file)
+        sloped, _ = self.cv.compute_folder(join(root, "e1"), 135., 123., alpha=np.arange(7.), beta=-np.arange(7.),
+                                         processes=1, output=join(self.tmp, "sloped.npz"))
+        np.testing.assert_allclose(np.load(join(root, "e2", "voltage.npz"))["voltage"], np.load(sloped)["voltage"],
+                                   atol=1e-12)
+        np.savetxt(array_file, np.column_stack([np.arange(3), np.zeros((3, 5))]))
+        with self.assertRaises(ValueError):
+            self.cv.compute_folder(join(root, "e1"), 135., 123., processes=1, detector=array_file)
+
+    def test_resampling_matrix(self):
+        f = self.cv.responses["X"].freq*1e6
+        R = self.cv.resampling_matrix(f, 1000, 1e9)
+        self.assertIs(R, self.cv.resampling_matrix(f.copy(), 1000, 1e9))
+        self.assertEqual(R.shape, (501, 29))
+        table = np.random.RandomState(2).normal(size=(29, 4))
+        F = np.fft.rfftfreq(1000)*1e9
+        expected = np.stack([np.interp(F, f, t, left=0., right=0.) for t in table.T], axis=-1)
+        np.testing.assert_allclose(R.dot(table), expected, atol=1e-14)
+
+    def test_fir(self):
+        efield = self.efield()
+        alpha = np.array([0., 10., -5.])
+        beta = np.array([0., 5., 12.])
+        efields = np.stack([efield[:, 1:]]*3)
+        self.assertEqual(self.cv.fir_length(1e9), 1000)
+        # frequency domain on a zero padded trace, no wrap around
+        padded = np.zeros((3, 5000, 3))
+        padded[:, 2000:3000] = efields
+        _, ref = self.cv.compute_antennaresponse_batch(np.arange(5000.), padded, 135., 123., alpha, beta)
+        ref = ref[:, 2000:3000]
+        errors = []
+        for ntaps in (400, 2000):
+            time, voltage = self.cv.compute_antennaresponse_fir(efield[:, 0], efields, 135., 123., alpha, beta,
+                                                                ntaps=ntaps)
+            self.assertEqual(voltage.shape, (3, 1000, 3))
+            errors.append(np.max(np.abs(voltage - ref))/np.max(np.abs(ref)))
+        self.assertLess(errors[1], 0.01)
+        self.assertLess(errors[1], errors[0])
+        np.testing.assert_allclose(time[0], efield[:, 0])
+        # chunks give the whole trace
+        _, chunked = self.cv.compute_antennaresponse_fir(efield[:, 0], efields, 135., 123., alpha, beta,
+                                                         ntaps=2000, chunksize=77)
+        np.testing.assert_allclose(chunked, voltage, atol=1e-12*np.max(np.abs(voltage)))
+        # stream, output delayed by half the kernel
+        stream = self.cv.VoltageStream(135., 123., alpha, beta, tstep=1., ntaps=2000)
+        self.assertEqual(stream.delay, 1000)
+        for k in range(2):
+            stream.reset()
+            out = np.concatenate([stream.process(efields[:, :600]), stream.process(efields[:, 600:]),
+                                  stream.process(np.zeros((3, 1000, 3)))], axis=1)
+            np.testing.assert_allclose(out[:, 1000:], voltage, atol=1e-12*np.max(np.abs(voltage)))
+
+    def test_antenna_models(self):
+        paths = []
+        for arm, scale in zip("XYZ", (2., 1.6, 0.6)):
+            paths.append(join(self.tmp, "antenna_2_" + arm + ".npy"))
+            create_antenna_file(paths[-1], scale)
+        model = self.cv.register_antenna_model("Doubled", *paths)
+        self.addCleanup(self.cv.antenna_models.pop, "Doubled")
+        self.assertIs(self.cv.get_antenna_model("Doubled"), model)
+        self.assertIs(self.cv.get_antenna_model(), self.cv.responses)
+        self.assertIs(self.cv.get_antenna_model("HorizonAntenna"), self.cv.responses)
+        with self.assertRaises(KeyError):
+            self.cv.get_antenna_model("Unknown")
+
+        efield = self.efield()
+        efields = np.stack([efield[:, 1:]]*3)
+        types = np.array(["HorizonAntenna", "Doubled", "HorizonAntenna"])
+        time, voltage = self.cv.compute_antennaresponse_batch(efield[:, 0], efields, 135., 123., types=types)
+        np.testing.assert_allclose(voltage[1], 2.*voltage[0], atol=1e-12*np.max(np.abs(voltage)))
+        np.testing.assert_array_equal(voltage[2], voltage[0])
+        trace = self.cv.compute_antennaresponse(efield, 135., 123., model="Doubled")
+        np.testing.assert_allclose(trace[:, 1:], voltage[1], atol=1e-12*np.max(np.abs(voltage)))
+        v, t = self.cv.get_voltage(efield.T[0]*1e-9, efield.T[1], efield.T[2], efield.T[3], 135., 123., typ="Z",
+                                   model="Doubled")
+        np.testing.assert_allclose(v, voltage[1, :, 2], atol=1e-12*np.max(np.abs(voltage)))
+        # FIR mode with the same models
+        self.assertEqual(self.cv.fir_length(1e9, types), 1000)
+        _, fir = self.cv.compute_antennaresponse_fir(efield[:, 0], efields, 135., 123., ntaps=2000, types=types)
+        np.testing.assert_allclose(fir[1], 2.*fir[0], atol=1e-12*np.max(np.abs(fir)))
+        np.testing.assert_array_equal(fir[2], fir[0])
+        # types of the detector by antenna ID in folders
+        from radio_simus.detector import Detector
+        os.makedirs(join(self.tmp, "event"))
+        for i in range(3):
+            np.savetxt(join(self.tmp, "event", "a%d.trace" % i), efield)
+        det = Detector()
+        det.ID = [2, 1, 0]
+        for i in range(3):
+            det.slope = [0., 0.]
+        det.type = ["HorizonAntenna", "Doubled", "HorizonAntenna"]
+        output, _ = self.cv.compute_folder(join(self.tmp, "event"), 135., 123., processes=1, detector=det)
+        np.testing.assert_allclose(np.load(output)["voltage"], voltage, atol=1e-12*np.max(np.abs(voltage)))
+
+    def test_fused_processing(self):
+        from scipy.signal import resample
+        import radio_simus.signal_processing as sp
+        efield = self.efield(n=3000)
+        efields = np.stack([efield[:, 1:], 2.*efield[:, 1:]])
+        time, voltage = sp.fused_processing(efield[:, 0], efields, 135., 123., processing={'filter', 'digitise'},
+                                            TSAMPLING=2.)
+        self.assertEqual(voltage.shape, (2, 1500, 3))
+        np.testing.assert_allclose(time[0], efield[::2, 0])
+        # step by step: response, IIR filter, Fourier resampling; the fused filter is circular,
+        # so the start-up transient of the IIR filter is left out
+        t, v = self.cv.compute_antennaresponse_batch(efield[:, 0], efields, 135., 123.)
+        ref = resample(sp.filter_traces(v, 1e9), 1500, axis=1)
+        np.testing.assert_allclose(voltage[:, 100:], ref[:, 100:], atol=1e-4*np.max(np.abs(ref)))
+        with self.assertRaises(ValueError):
+            sp.fused_processing(efield[:, 0], efields, 135., 123., TSAMPLING=2.5)
+
+        time, noise = sp.fused_processing(efield[:, 0], np.zeros((2, 3000, 3)), 135., 123., processing={'noise'},
+                                          vrms=20., seed=1, event=3)
+        self.assertAlmostEqual(np.std(noise), 20., delta=0.5)
+        # same random streams as noise.generate_noise on the padded trace
+        from radio_simus.noise import generate_noise
+        np.testing.assert_allclose(noise, generate_noise(2, 3000, 1., 20., seed=1, event=3), atol=1e-10)
+        _, other = sp.fused_processing(efield[:, 0], np.zeros((2, 3000, 3)), 135., 123., processing={'noise'},
+                                       vrms=20., seed=1, event=3, antennas=[5, 0])
+        np.testing.assert_allclose(other[1], noise[0], atol=1e-10)
+        table = (np.array([0., 100e6, 500e6]), np.array([1., 1., 0.]))
+        _, coloured = sp.fused_processing(efield[:, 0], np.zeros((2, 3000, 3)), 135., 123., processing={'noise'},
+                                          vrms=20., seed=1, event=3, spectrum=table)
+        np.testing.assert_allclose(coloured, generate_noise(2, 3000, 1., 20., seed=1, event=3, spectrum=table),
+                                   atol=1e-10)
+        # length of the digitized input, not of the padded DFT
+        time, voltage = sp.fused_processing(efield[:2999, 0], efields[:, :2999], 135., 123., TSAMPLING=2.,
+                                            seed=1)
+        self.assertEqual(voltage.shape, (2, 1499, 3))
+        np.testing.assert_allclose(time[0], efield[:2998:2, 0])
+        trace = sp.standard_processing(efield, 135., 123., DISPLAY=0, fused=True)
+        self.assertEqual(trace.shape, (1500, 4))
+
+    def test_transfer_cache(self):
+        efield = self.efield()
+        cache = self.cv.transfer_cache
+        cache.clear()
+        trace = self.cv.compute_antennaresponse(efield, 135., 123.)
+        self.assertEqual(cache.stats()["misses"], 3)
+        efields = np.stack([efield[:, 1:]]*5)
+        time, voltage = self.cv.compute_antennaresponse_batch(efield[:, 0], efields, 135., 123.)
+        self.assertEqual(cache.stats()["misses"], 3)
+        self.assertEqual(cache.stats()["hits"], 3)
+        np.testing.assert_array_equal(voltage[4], trace[:, 1:])
+
+    def test_transfer_cache_reconverted(self):
+        path = join(self.tmp, "antenna_reconverted.npy")
+        create_antenna_file(path)
+        resp = AntennaResponse(path)
+        Ht, _ = self.cv._transfer_function(resp, np.array([40.]), np.array([30.]), 1000, 1e9)
+        # the legacy file changes, the store is converted again on the next open
+        create_antenna_file(path, scale=2.)
+        mtime = os.path.getmtime(path) + 10.
+        os.utime(path, (mtime, mtime))
+        resp2 = AntennaResponse(path)
+        self.assertNotEqual(resp2.version, resp.version)
+        Ht2, _ = self.cv._transfer_function(resp2, np.array([40.]), np.array([30.]), 1000, 1e9)
+        np.testing.assert_allclose(Ht2, 2.*Ht)
+
+    def test_batch_bilinear(self):
+        efield = self.efield()
+        efields = np.stack([efield[:, 1:]]*2)
+        # azimuth 120deg is on a table node in antenna frame for a flat ground
+        time, voltage = self.cv.compute_antennaresponse_batch(efield[:, 0], efields, 135., 120.)
+        time, voltage2 = self.cv.compute_antennaresponse_batch(efield[:, 0], efields, 135., 120.,
+                                                               interpolation="bilinear")
+        np.testing.assert_allclose(voltage, voltage2, atol=1e-12*np.max(np.abs(voltage)))
+
+    def test_batch_below_horizon(self):
+        efield = self.efield()
+        efields = np.stack([efield[:, 1:]]*2)
+        time, voltage = self.cv.compute_antennaresponse_batch(efield[:, 0], efields, 92., 0., [0., 10.], [0., 0.])
+        self.assertFalse(np.any(voltage[1]))
+        self.assertTrue(np.any(voltage[0]))
+
+    def test_below_horizon(self):
+        efield = self.efield()
+        voltage, time = self.cv.get_voltage(efield.T[0]*1e-9, efield.T[1], efield.T[2], efield.T[3],
+                                            80., 30., typ="X")
+        self.assertEqual(len(voltage), 0)
+
+
+
+class InversionTest(SyntheticModel, unittest.TestCase):
+    """Unit tests for the deconvolution of the antenna response, run on a synthetic antenna model
+    with arms that are not proportional"""
+
+    shifts = (0., 1., -2.)
+
+    @classmethod
+    def setUpClass(cls):
+        import radio_simus.invert_computevoltage as icv
+        cls.icv = icv
+        super().setUpClass()
+
+    def efield(self, alpha, beta, n=1000):
+        """band limited (40-250MHz) pulse, transverse to the direction of the source"""
+        t = np.arange(n)*1. + 100.
+        F = np.fft.rfftfreq(n, 1e-9)
+        band = (F > 40e6) & (F < 250e6)
+        pulse = np.exp(-0.5*((t - t[n//3])/3.)**2)
+        a = np.fft.irfft(np.fft.rfft(80.*pulse)*band, n)
+        b = np.fft.irfft(np.fft.rfft(np.gradient(-50.*pulse))*band, n)
+        zen, azim, rot = self.cv._antenna_directions(135., 123., alpha, beta)
+        zen, azim = np.deg2rad(zen), np.deg2rad(azim)
+        etheta = np.stack([np.cos(zen)*np.cos(azim), np.cos(zen)*np.sin(azim), -np.sin(zen)], axis=-1)
+        ephi = np.stack([-np.sin(azim), np.cos(azim), np.zeros_like(azim)], axis=-1)
+        Ep = a[None, :, None]*etheta[:, None] + b[None, :, None]*ephi[:, None]
+        return t, np.einsum("nji,ntj->nti", rot, Ep)
+
+    def test_roundtrip(self):
+        alpha = np.array([0., 10., -5.])
+        beta = np.array([0., 5., 12.])
+        t, efield = self.efield(alpha, beta)
+        time, voltage = self.cv.compute_antennaresponse_batch(t, efield, 135., 123., alpha, beta)
+        time, rec = self.icv.compute_electricfield_batch(time, voltage, 135., 123., alpha, beta, regularization=1e-9)
+        self.assertEqual(rec.shape, efield.shape)
+        np.testing.assert_allclose(time[0], t)
+        np.testing.assert_allclose(rec, efield, atol=1e-6*np.max(np.abs(efield)))
+
+        trace = np.column_stack([time[1], voltage[1]])
+        single = self.icv.compute_electricfield(trace, 135., 123., 10., 5., regularization=1e-9)
+        np.testing.assert_allclose(single[:, 1:], rec[1], atol=1e-12*np.max(np.abs(efield)))
+        with self.assertRaises(ValueError):
+            self.icv.compute_electricfield(trace, 80., 30.)
+
+    def test_antenna_models(self):
+        paths = []
+        for arm, scale, shift in zip("XYZ", (0.5, 1.2, 0.9), (2., -1., 0.)):
+            paths.append(join(self.tmp, "antenna_2_" + arm + ".npy"))
+            create_antenna_file(paths[-1], scale, shift)
+        self.cv.register_antenna_model("Other", *paths)
+        self.addCleanup(self.cv.antenna_models.pop, "Other")
+        t, efield = self.efield(np.zeros(2), np.zeros(2))
+        types = np.array(["HorizonAntenna", "Other"])
+        time, voltage = self.cv.compute_antennaresponse_batch(t, efield, 135., 123., types=types)
+        time, rec = self.icv.compute_electricfield_batch(time, voltage, 135., 123., regularization=1e-9,
+                                                         types=types)
+        np.testing.assert_allclose(rec, efield, atol=1e-6*np.max(np.abs(efield)))
+        single = self.icv.compute_electricfield(np.column_stack([time[1], voltage[1]]), 135., 123.,
+                                                regularization=1e-9, model="Other")
+        np.testing.assert_allclose(single[:, 1:], rec[1], atol=1e-12*np.max(np.abs(efield)))
+        # inverted with the default model instead
+        wrong = self.icv.compute_electricfield_batch(time, voltage, 135., 123., regularization=1e-9)[1]
+        self.assertGreater(np.max(np.abs(wrong[1] - efield[1])), 0.1*np.max(np.abs(efield)))
+
+    def test_regularization(self):
+        t, efield = self.efield(np.zeros(2), np.zeros(2))
+        time, voltage = self.cv.compute_antennaresponse_batch(t, efield, 135., 123.)
+        rng = np.random.RandomState(0)
+        noisy = voltage + rng.normal(0., 0.05*np.std(voltage), voltage.shape)
+        errors = [np.std(self.icv.compute_electricfield_batch(time, noisy, 135., 123., regularization=r)[1] - efield)
+                  for r in (1e-9, 1e-3)]
+        self.assertLess(errors[1], errors[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
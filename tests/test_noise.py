@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the radio_simus.noise module
+
+Usage: python3.7 tests/test_noise.py
+"""
+
+import unittest
+import os
+import sys
+import pickle
+import shutil
+import tempfile
+import numpy as np
+from unittest.mock import patch
+
+from os.path import split, join, realpath
+root_dir = realpath(join(split(__file__)[0], "..")) # = $PROJECT
+sys.path.append(join(root_dir, "lib", "python"))
+import radio_simus
+import radio_simus.noise as noise
+
+
+class NoiseTest(unittest.TestCase):
+    """Unit tests for the noise generator"""
+
+    def test_reproducible(self):
+        a = noise.generate_noise(4, 1000, vrms=20., seed=1, event=7)
+        self.assertEqual(a.shape, (4, 1000, 3))
+        # same antenna, same noise whatever the batch
+        b = noise.generate_noise(2, 1000, vrms=20., seed=1, event=7, antennas=[3, 1])
+        np.testing.assert_array_equal(b[0], a[3])
+        np.testing.assert_array_equal(b[1], a[1])
+        # other event, other antenna: independent
+        c = noise.generate_noise(4, 1000, vrms=20., seed=1, event=8)
+        self.assertLess(abs(np.corrcoef(a[0, :, 0], c[0, :, 0])[0, 1]), 0.2)
+        self.assertLess(abs(np.corrcoef(a[0, :, 0], a[1, :, 0])[0, 1]), 0.2)
+        self.assertAlmostEqual(np.std(a), 20., delta=1.)
+        with self.assertRaises(ValueError):
+            noise.generate_noise(2, 1000, antennas=[1])
+
+    def test_spectrum(self):
+        n, tstep = 4096, 1.
+        band = lambda f: ((f > 50e6) & (f < 200e6)).astype(float)
+        a = noise.generate_noise(8, n, tstep, vrms=15., spectrum=band)
+        self.assertAlmostEqual(np.std(a), 15., delta=0.5)
+        freq = np.fft.rfftfreq(n, tstep*1e-9)
+        power = np.mean(np.abs(np.fft.rfft(a, axis=1))**2, axis=(0, 2))
+        self.assertLess(np.max(power[(freq < 45e6) | (freq > 205e6)]), 1e-20*np.max(power))
+        # table in Hz, interpolated
+        table = (np.array([0., 100e6, 500e6]), np.array([1., 1., 0.]))
+        b = noise.generate_noise(8, n, tstep, vrms=15., spectrum=table)
+        self.assertAlmostEqual(np.std(b), 15., delta=0.5)
+        v = np.ones((8, n, 3))
+        np.testing.assert_allclose(noise.add_noise_batch(v, tstep, 15., spectrum=table) - v, b)
+        with self.assertRaises(ValueError):
+            noise.generate_noise(1, n, tstep, spectrum=lambda f: 0.*f)
+
+    def test_config_spectrum(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            path = join(tmp, "spectrum.txt")
+            np.savetxt(path, [[0., 1.], [100., 1.], [500., 0.]]) # MHz
+            freq, amplitude = noise.load_noise_spectrum(path)
+            np.testing.assert_allclose(freq, [0., 100e6, 500e6])
+            np.testing.assert_allclose(amplitude, [1., 1., 0.])
+            np.savetxt(join(tmp, "bad.txt"), [100., 1.])
+            with self.assertRaises(ValueError):
+                noise.load_noise_spectrum(join(tmp, "bad.txt"))
+
+            white = noise.generate_noise(2, 4096, vrms=15., seed=2)
+            self.assertIsNone(noise.noise_spectrum())
+            with patch.dict(radio_simus.config._config, {"noisespectrum": path}):
+                freq, amplitude = noise.noise_spectrum()
+                np.testing.assert_allclose(freq, [0., 100e6, 500e6])
+                self.assertIs(noise.noise_spectrum()[0], freq) # read once
+                # NOISESPECTRUM is the default of generate_noise, add_noise_batch and the pipeline
+                coloured = noise.generate_noise(2, 4096, vrms=15., seed=2)
+                np.testing.assert_allclose(coloured, noise.generate_noise(2, 4096, vrms=15., seed=2,
+                                                                          spectrum=(freq, amplitude)))
+                np.testing.assert_allclose(noise.add_noise_batch(np.zeros((2, 4096, 3)), vrms=15., seed=2),
+                                           coloured)
+                np.testing.assert_array_equal(noise.generate_noise(2, 4096, vrms=15., seed=2, spectrum="white"),
+                                              white)
+                self.assertFalse(np.allclose(coloured, white))
+            with self.assertRaises(ValueError):
+                noise.generate_noise(1, 100, spectrum="pink")
+        finally:
+            noise._cached_noise_spectrum.cache_clear()
+            shutil.rmtree(tmp)
+
+
+class NoiseBankTest(unittest.TestCase):
+    """Unit tests for the memory-mapped noise bank"""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = join(self.tmp, "bank")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_bank(self):
+        import radio_simus.signal_processing as sp
+        n = 200000
+        noise.build_noise_bank(self.path, n, vrms=28., seed=3, blocksize=30000)
+        bank = noise.NoiseBank(self.path)
+        self.assertEqual(len(bank), n)
+        self.assertIsInstance(bank.noise, np.memmap)
+        self.assertEqual(bank.noise.dtype, np.float32)
+        # same statistics as add_noise + filters
+        ref = sp.filters(sp.add_noise(np.column_stack([np.arange(n), np.zeros((n, 3))]), 28.))[2000:, 1:]
+        self.assertAlmostEqual(bank.meta["rms"], np.std(ref), delta=0.03*np.std(ref))
+        freq = np.fft.rfftfreq(n, 1e-9)
+        power = np.abs(np.fft.rfft(bank.noise[:, 0]))**2
+        self.assertLess(np.mean(power[freq > 400e6]), 1e-4*np.mean(power[(freq > 80e6) & (freq < 180e6)]))
+
+        # reproducible windows, independent of the batch
+        v = np.zeros((4, 1000, 3))
+        a = bank.inject(v, 1., seed=1, event=5)
+        b = bank.sample(2, 1000, seed=1, event=5, antennas=[2, 0])
+        np.testing.assert_array_equal(b[0], a[2])
+        np.testing.assert_array_equal(b[1], a[0])
+        start = bank.offsets(4, 1000, seed=1, event=5)[1]
+        np.testing.assert_array_equal(a[1], bank.noise[start:start+1000])
+        # the windows have their own random stream, not the one of generate_noise
+        self.assertFalse(np.array_equal(bank.offsets(4, 1000, seed=1, event=5),
+                                        [noise.noise_rng(1, 5, i).integers(0, n - 999) for i in range(4)]))
+        np.testing.assert_array_equal(bank.offsets(4, 1000, seed=1, event=5),
+                                      [noise.noise_rng(1, 5, i, stream=1).integers(0, n - 999) for i in range(4)])
+        np.testing.assert_array_equal(noise.noise_rng(1, 5, 2, stream=0).normal(size=10),
+                                      noise.noise_rng(1, 5, 2).normal(size=10))
+        bank2 = pickle.loads(pickle.dumps(bank))
+        self.assertIsNone(bank2._noise)
+        np.testing.assert_array_equal(bank2.sample(4, 1000, seed=1, event=5), a)
+        with self.assertRaises(ValueError):
+            bank.inject(v, 2.)
+        with self.assertRaises(ValueError):
+            bank.sample(1, n + 1)
+        # rebuilt in place
+        noise.build_noise_bank(self.path, 1000, seed=4)
+        self.assertEqual(len(noise.NoiseBank(self.path)), 1000)
+        self.assertEqual(sorted(os.listdir(self.tmp)), ["bank"])
+
+
+if __name__ == "__main__":
+    unittest.main()
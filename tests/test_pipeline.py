@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the radio_simus.pipeline module
+
+Usage: python3.7 tests/test_pipeline.py
+
+Note: uses the synthetic antenna model of tests/synthetic_model.py
+"""
+
+import unittest
+import sys
+import numpy as np
+
+from os.path import split, join, realpath
+root_dir = realpath(join(split(__file__)[0], "..")) # = $PROJECT
+sys.path.append(join(root_dir, "lib", "python"))
+import radio_simus.signal_processing as sp
+import radio_simus.noise as noise
+import radio_simus.pipeline as pl
+from tests.synthetic_model import SyntheticModel
+
+
+class PipelineTest(SyntheticModel, unittest.TestCase):
+    """Unit tests for the processing pipeline"""
+
+    def efield(self, nant=3, n=1000):
+        t = np.arange(n) + 100.
+        pulse = np.exp(-0.5*((t - t[n//3])/3.)**2)
+        return t, np.arange(1., nant + 1.)[:, None, None]*np.stack([80.*pulse, -50.*pulse, 20.*pulse], axis=-1)
+
+    def test_standard(self):
+        t, efield = self.efield()
+        chain = pl.standard_pipeline()
+        self.assertEqual([stage.name for stage in chain], ['antennaresponse', 'noise', 'filter', 'digitise'])
+        time, voltage = chain.run(t, efield, zenith=135., azimuth=123., event=4)
+
+        # same as the batched functions one after the other
+        t1, v = self.cv.compute_antennaresponse_batch(t, efield, 135., 123.)
+        v = noise.add_noise_batch(v, 1., sp.Vrms2, 0, 4)
+        v = sp.filter_traces(v, 1e9, axis=1)
+        ref = sp.digitize_traces(v, 1., sp.tsampling, axis=1)
+        np.testing.assert_allclose(voltage, ref)
+        np.testing.assert_allclose(time, t1[:, ::2])
+
+        stats = chain.stats()
+        self.assertEqual(stats['filter']['calls'], 1)
+        self.assertEqual(stats['antennaresponse']['nbytes'], efield.nbytes)
+        self.assertEqual(stats['digitise']['nbytes'], v.nbytes)
+        self.assertTrue(all(s['seconds'] > 0. for s in stats.values()))
+        self.assertIn('antennaresponse', chain.report())
+        chain.reset()
+        self.assertEqual(chain['noise'].calls, 0)
+
+        with self.assertRaises(ValueError):
+            chain.run(t, efield)
+        with self.assertRaises(ValueError):
+            pl.standard_pipeline(('antennaresponse', 'smooth'))
+
+    def test_custom(self):
+        t, efield = self.efield()
+        scale = pl.CustomStage(lambda time, traces, meta: (time, meta['gain']*traces), name='gain')
+        chain = pl.Pipeline([pl.FilterStage()]).insert(0, scale).append(pl.DigitizeStage(4.))
+        time, voltage = chain.run(t, efield, gain=2.)
+        self.assertEqual(voltage.shape, (3, 250, 3))
+        np.testing.assert_allclose(voltage, sp.digitize_traces(sp.filter_traces(2.*efield, 1e9, axis=1), 1., 4.))
+        self.assertEqual(chain['gain'].calls, 1)
+        with self.assertRaises(KeyError):
+            chain['noise']
+        # a stage without process cannot be built
+        with self.assertRaises(TypeError):
+            pl.Stage()
+
+    def test_standard_processing(self):
+        # noise traces, no antenna response: the input trace is processed
+        trace = np.column_stack([np.arange(1000.), np.zeros((1000, 3))])
+        res = sp.standard_processing(trace, 135., 123., processing={'noise', 'filter'}, DISPLAY=0)
+        self.assertEqual(res.shape, trace.shape)
+        self.assertGreater(np.std(res[:, 1:]), 0.)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -66,5 +66,97 @@ class SignalTest(unittest.TestCase):
         self.assertEqual(input.shape, res.shape)
 
 
+    def test_filter_bank(self):
+        from scipy.signal import butter, lfilter
+        n = 1000
+        input = np.zeros((n, 4))
+        input[:, 0] = np.arange(n) + 100. # ns
+        rng = np.random.default_rng(1)
+        input[:, 1:] = rng.standard_normal(size=(n, 3))
+        copy = input.copy()
+        res = st.filters(input)
+        np.testing.assert_array_equal(input, copy) # input not modified
+        np.testing.assert_allclose(res[:, 0], input[:, 0])
+        b, a = butter(5, [50.e6 / 0.5e9, 200.e6 / 0.5e9], btype='band')
+        ref = lfilter(b, a, input[:, 1:], axis=0)
+        np.testing.assert_allclose(res[:, 1:], ref, atol=1e-9 * np.max(np.abs(ref)))
+
+        self.assertIs(st.butter_sos(1e9, 50e6, 200e6), st.butter_sos(1e9, 50e6, 200e6))
+        traces = rng.standard_normal(size=(5, n, 3))
+        batch = st.filter_traces(traces, 1e9)
+        for i in range(5):
+            trace = np.column_stack([input[:, 0], traces[i]])
+            np.testing.assert_allclose(batch[i], st.filters(trace)[:, 1:], atol=1e-12)
+        self.assertEqual(st.filter_traces(traces, 1e9, zerophase=True).shape, traces.shape)
+
+
+    def test_digitize(self):
+        n, ratio = 1000, 2
+        t = np.arange(n) + 100. # ns
+        # in band signal: decimation keeps the samples, alias free
+        signal = np.sin(2 * np.pi * 0.05 * t)[:, None] * np.array([1., 0.5, -2.])
+        traces = np.stack([signal, 3. * signal])
+        res = st.digitize_traces(traces, 1., ratio)
+        self.assertEqual(res.shape, (2, n // ratio, 3))
+        np.testing.assert_allclose(res[:, 50:-50], traces[:, ::ratio][:, 50:-50], atol=1e-2)
+        # out of band signal removed, kept by the sample picking of Digitization_2
+        trace = np.column_stack([t, np.cos(np.pi * 0.9 * t)[:, None] * np.ones(3)])
+        self.assertLess(np.max(np.abs(st.digitize(trace, ratio)[50:-50, 1:])), 0.05)
+        self.assertGreater(np.max(np.abs(st.Digitization_2(trace, ratio)[:, 1:])), 0.5)
+        np.testing.assert_allclose(st.digitize(trace, ratio)[:, 0], st.Digitization_2(trace, ratio)[:, 0])
+        with self.assertRaises(ValueError):
+            st.digitize_traces(traces, 1., 2.5)
+
+
+    def test_adc(self):
+        import os, tempfile
+        adc = st.ADC(bits=12, vrange=4096.)
+        self.assertEqual(adc.lsb, 1.)
+        self.assertEqual(adc.dtype, np.int16)
+        counts = adc.quantize([0.4, -1.6, 5000., -5000.])
+        np.testing.assert_array_equal(counts, [0, -2, 2047, -2048])
+        np.testing.assert_array_equal(adc.saturated(counts), [False, False, True, True])
+        self.assertEqual(st.ADC(bits=24).dtype, np.int32)
+
+        t = np.arange(1000) + 100.
+        traces = 100. * np.random.default_rng(2).standard_normal(size=(3, 1000, 3))
+        counts = st.digitize_traces(traces, 1., 2., adc=adc)
+        self.assertEqual(counts.dtype, np.int16)
+        tmp = tempfile.mkdtemp()
+        path = os.path.join(tmp, "traces.npz")
+        st.save_adc_traces(path, t[::2], counts, adc)
+        with self.assertRaises(ValueError):
+            st.save_adc_traces(path, t[::2], st.digitize_traces(traces, 1., 2.), adc)
+        with self.assertRaises(ValueError):
+            st.save_adc_traces(path, t[::2], counts.astype(np.int32) + 4096, adc)
+        time, voltages, adc2 = st.load_adc_traces(path)
+        os.remove(path)
+        os.rmdir(tmp)
+        self.assertEqual((adc2.bits, adc2.vrange), (12, 4096.))
+        np.testing.assert_allclose(time, np.broadcast_to(t[::2], (3, 500)))
+        np.testing.assert_allclose(voltages, st.digitize_traces(traces, 1., 2.), atol=0.5 * adc.lsb)
+
+
+    def test_streaming(self):
+        import radio_simus.noise as noise
+        n, nant = 20011, 3
+        whole = noise.generate_noise(nant, n, vrms=28., seed=2, event=9)
+        blocks = list(noise.noise_stream(nant, n, 3001, vrms=28., seed=2, event=9))
+        self.assertEqual(blocks[0].shape, (nant, 3001, 3))
+        np.testing.assert_array_equal(np.concatenate(blocks, axis=1), whole)
+
+        # bit-identical to whole trace processing, for any block lengths
+        sizes = np.random.default_rng(3).integers(1, 2000, size=100)
+        chunks = np.split(whole, np.cumsum(sizes)[np.cumsum(sizes) < n], axis=1)
+        filtered = st.filter_traces(whole, 1e9, axis=1)
+        np.testing.assert_array_equal(np.concatenate(list(st.filter_stream(chunks, 1e9)), axis=1), filtered)
+        for ratio in (1, 2, 3):
+            adc = st.ADC(bits=12, vrange=200.) if ratio == 3 else None
+            stream = st.digitize_stream(st.filter_stream(chunks, 1e9), 1., float(ratio), adc)
+            np.testing.assert_array_equal(np.concatenate(list(stream), axis=1),
+                                          st.digitize_traces(filtered, 1., float(ratio), adc, axis=1))
+        self.assertEqual(list(st.digitize_stream([], 1., 2.)), [])
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the radio_simus.signal_treatment module
+
+Usage: python3.7 tests/test_signal_treatment.py
+"""
+
+import unittest
+import sys
+import numpy as np
+
+from os.path import split, join, realpath
+root_dir = realpath(join(split(__file__)[0], "..")) # = $PROJECT
+sys.path.append(join(root_dir, "lib", "python"))
+import radio_simus.signal_treatment as st
+
+
+class SignalTreatmentTest(unittest.TestCase):
+    """Unit tests for the signal treatment module"""
+
+    def test_p2p(self):
+        rng = np.random.default_rng(1)
+        traces = rng.standard_normal(size=(20, 500, 3))*np.array([1., 2., 3.])
+        res = st.p2p_batch(traces)
+        self.assertEqual(res.dtype.names, st.P2P_FIELDS)
+        for i in range(20):
+            trace = np.column_stack([np.arange(500.), traces[i]])
+            x, y, z = traces[i].T
+            xy, combined = np.sqrt(x**2 + y**2), np.sqrt(x**2 + y**2 + z**2)
+            expected = (max(x) - min(x), max(y) - min(y), max(z) - min(z), max(xy) - min(xy),
+                        max(combined) - min(combined))
+            np.testing.assert_allclose(tuple(res[i]), expected)
+            np.testing.assert_allclose(st.p2p(trace), expected)
+            self.assertEqual(st.p2p(x), max(x) - min(x))
+
+    def test_trigger(self):
+        rng = np.random.default_rng(2)
+        p2ps = st.p2p_batch(rng.standard_normal(size=(50, 500, 3))*rng.uniform(0.5, 3., (50, 1, 3)))
+        thresholds = np.array([5., 8., 12.])
+        res = st.trigger_batch(p2ps, thresholds)
+        self.assertEqual(res.dtype.names, st.TRIGGER_MODES)
+        for i in range(50):
+            for j, thr in enumerate(thresholds):
+                for mode in st.TRIGGER_MODES:
+                    self.assertEqual(res[mode][i, j], st._trigger(list(p2ps[i]), mode, thr))
+        # plain (N, 5) values and a single threshold
+        values = p2ps.view(float).reshape(50, 5)
+        res1 = st.trigger_batch(values, 8., modes=("xy",))
+        np.testing.assert_array_equal(res1["xy"], res["xy"][:, 1])
+        with self.assertRaises(ValueError):
+            st.trigger_batch(p2ps, 8., modes=("z",))
+
+
+    def test_hilbert(self):
+        from scipy.signal import hilbert
+        traces = np.random.default_rng(3).standard_normal(size=(4, 301, 3))
+        np.testing.assert_allclose(st.analytic_signal(traces), hilbert(traces, axis=1), atol=1e-12)
+        np.testing.assert_allclose(st.hilbert_env(traces[0, :, 1]), np.abs(hilbert(traces[0, :, 1])), atol=1e-12)
+        # same default time axis for the (N, T, 3) layout
+        np.testing.assert_allclose(st.hilbert_env(traces), np.abs(st.analytic_signal(traces)), atol=1e-12)
+        np.testing.assert_allclose(st.hilbert_env(traces.T, axis=-1), np.abs(hilbert(traces.T)), atol=1e-12)
+        self.assertIs(st._analytic_multiplier(301), st._analytic_multiplier(301))
+
+    def test_hilbert_peak(self):
+        # pulses at sub-sample times, time step 2ns
+        n, tstep = 400, 2.
+        time = np.arange(n)*tstep + 100.
+        t0 = 400. + np.random.default_rng(4).uniform(0., tstep, size=(10, 3))
+        width = 6. # ns
+        traces = np.exp(-0.5*((time[:, None, None] - t0)/width)**2)*np.cos(2*np.pi*0.1*(time[:, None, None] - t0))
+        traces = np.moveaxis(traces, 0, 1) # (N, T, 3)
+
+        for refine, accuracy in ((None, 0.5*tstep), ("parabolic", 0.2*tstep), ("sinc", 0.01*tstep)):
+            peak, amplitude = st.hilbert_peak_batch(time, traces, refine=refine)
+            self.assertEqual(peak.shape, (10, 3))
+            self.assertLess(np.max(np.abs(peak - t0)), accuracy)
+        np.testing.assert_allclose(amplitude, 1., rtol=1e-3)
+
+        # envelope sample as hilbert_peak
+        peak, amplitude = st.hilbert_peak_batch(time, traces, refine=None)
+        self.assertEqual(st.hilbert_peak(time, traces[3, :, 1]), (peak[3, 1], amplitude[3, 1]))
+        with self.assertRaises(ValueError):
+            st.hilbert_peak_batch(time, traces, refine="cubic")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the radio_simus.utils module
+
+Usage: python3.7 tests/test_utils.py
+"""
+
+import unittest
+import sys
+import numpy as np
+
+from os.path import split, join, realpath
+root_dir = realpath(join(split(__file__)[0], "..")) # = $PROJECT
+sys.path.append(join(root_dir, "lib", "python"))
+import radio_simus.utils as utils
+
+
+def unwrap_loop(phi):
+    """Reference: the loop of interpolation.unwrap before vectorization"""
+    phi_unwrapped = np.zeros(phi.shape)
+    p0 = phi_unwrapped[0] = phi[0]
+    pi2 = 2. * np.pi
+    l = 0
+    for i0, p1 in enumerate(phi[1:]):
+        i = i0 + 1
+        if p1 >= p0:
+            l += np.floor_divide(p1 - p0, pi2) + 1
+        phi_unwrapped[i] = p1 - l * pi2
+        p0 = p1
+    return phi_unwrapped
+
+
+def quadrant_neighbours_loop(pos_sims, pos):
+    """Reference: the loop over the simulated positions of interpolation.do_interpolation before
+    PolarIndex, closest simulated position per quadrant or -1"""
+    points = []
+    for i in np.arange(0, len(pos_sims[:, 1])):
+        theta2 = np.arctan2(pos_sims[i, 2], pos_sims[i, 1])
+        radius2 = np.sqrt(pos_sims[i, 1]**2 + pos_sims[i, 2]**2)
+        if round(theta2, 4) == -3.1416:
+            theta2 *= -1
+        points.append([i, theta2, radius2])
+    neighbours = []
+    for i in np.arange(0, len(pos[:, 1])):
+        theta = np.arctan2(pos[i, 2], pos[i, 1])
+        radius = np.sqrt(pos[i, 1]**2 + pos[i, 2]**2)
+        quadrants = [[], [], [], []]
+        for m in np.arange(0, len(points)):
+            delta_phi = points[m][1] - theta
+            if delta_phi > np.pi:
+                delta_phi = delta_phi - 2.*np.pi
+            delta_r = points[m][2] - radius
+            distance = np.sqrt(points[m][2]**2. + radius**2. - 2.*points[m][2]*radius*np.cos(points[m][1] - theta))
+            point = (m, abs(round(delta_phi, 2)), abs(round(delta_r, 2)), distance)
+            if delta_phi >= 0. and delta_r >= 0:
+                quadrants[0].append(point)
+            if delta_phi > 0. and delta_r < 0:
+                quadrants[1].append(point)
+            if delta_phi <= 0. and delta_r <= 0:
+                quadrants[2].append(point)
+            if delta_phi < 0. and delta_r > 0:
+                quadrants[3].append(point)
+        row = []
+        for points_q in quadrants:
+            if not points_q:
+                row.append(-1)
+                continue
+            points_q = np.array(points_q, dtype=[('index', 'i4'), ('delta_phi', 'f4'), ('delta_r', 'f4'),
+                                                 ('distance', 'f4')])
+            row.append(np.sort(points_q, order=['distance', 'delta_phi', 'delta_r'])[0][0])
+        neighbours.append(row)
+    return np.array(neighbours)
+
+
+class UnwrapTest(unittest.TestCase):
+    """Unit tests for the phase unwrapping of the interpolation"""
+
+    def test_loop(self):
+        rng = np.random.default_rng(4)
+        # wrapped phase of a delayed pulse, plus noise and jumps of several turns
+        freq = np.linspace(0., 250e6, 300)
+        phases = np.stack([np.angle(np.exp(-2j*np.pi*freq*130e-9)),
+                           rng.uniform(-np.pi, np.pi, 300),
+                           rng.uniform(-20., 20., 300)])
+        phases[0, ::17] += 2.*np.pi
+        for phi in phases:
+            expected = unwrap_loop(phi)
+            np.testing.assert_allclose(utils.unwrap(phi), expected, rtol=0, atol=1e-9)
+            self.assertTrue(np.all(np.diff(expected) < 0))
+        # many spectra at once, along any axis
+        expected = np.stack([unwrap_loop(phi) for phi in phases])
+        np.testing.assert_allclose(utils.unwrap(phases), expected, rtol=0, atol=1e-9)
+        np.testing.assert_allclose(utils.unwrap(phases.T, axis=0), expected.T, rtol=0, atol=1e-9)
+
+
+class PolarIndexTest(unittest.TestCase):
+    """Unit tests for the neighbour selection of the interpolation"""
+
+    def check(self, sims, desired, k=16):
+        sims = np.column_stack([np.zeros(len(sims)), sims])
+        desired = np.column_stack([np.zeros(len(desired)), desired])
+        neighbours = utils.PolarIndex(sims).quadrant_neighbours(desired, k=k)
+        self.assertEqual(neighbours.shape, (len(desired), 4))
+        np.testing.assert_array_equal(neighbours, quadrant_neighbours_loop(sims, desired))
+        return neighbours
+
+    def test_star(self):
+        rng = np.random.default_rng(3)
+        # 8 arms x 20 radii, desired positions at random, on the simulated ones (ties), at the core
+        # and outside the star (empty quadrants)
+        angles = np.deg2rad(np.arange(0., 360., 45.))
+        radii = np.arange(1, 21)*25.
+        sims = np.array([[r*np.cos(a), r*np.sin(a)] for a in angles for r in radii])
+        desired = rng.uniform(-550., 550., (300, 2))
+        desired[:20] = sims[rng.integers(0, len(sims), 20)]
+        desired[20] = 0.
+        desired[21:40] = sims[rng.integers(0, len(sims), 19)]*1.5
+        neighbours = self.check(sims, desired)
+        self.assertTrue(np.any(neighbours < 0))
+
+    def test_random(self):
+        rng = np.random.default_rng(5)
+        self.check(rng.normal(0., 200., (200, 2)), rng.uniform(-500., 500., (200, 2)), k=4)
+
+    def test_grid(self):
+        rng = np.random.default_rng(6)
+        y, z = np.meshgrid(np.arange(-5., 6.)*40., np.arange(-5., 6.)*40.)
+        sims = np.column_stack([y.ravel(), z.ravel()])
+        desired = np.concatenate([rng.uniform(-250., 250., (150, 2)), sims[::7] + 20.])
+        self.check(sims, desired, k=2)
+
+
+if __name__ == "__main__":
+    unittest.main()